@@ -0,0 +1,143 @@
+"""Headless batch runner for parameter sweeps of both tools, no window and no Tk.
+
+The input file (json or yaml) holds a list of parameter sets, or a dict with the list under "runs". A parameter set
+has the shape of the `params` dict of the simple GUI (spot simulation, recognized by 'num_sim') or of
+`prepare_parameters()` of the complex GUI (storage valuation, recognized by 'use_scenarios'). The key "tool" with
+the value 'spot' or 'lsm' overrides the detection, "name" names the run in the results.
+
+Usage::
+
+    python batch_run.py storage_book.yaml --output results.json --workers 8
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import pathlib
+import sys
+
+import numpy as np
+from loguru import logger
+
+import checkpoint
+import job_runner
+import profiling
+import result_cache
+import scenario_io
+import spot_simulation
+
+
+def load_runs(path) -> list:
+    """Read the list of parameter sets from a json or yaml file."""
+    path = pathlib.Path(path)
+    with open(path, 'r') as f:
+        if path.suffix.lower() in ('.yaml', '.yml'):
+            import yaml  # only needed for yaml input files
+            runs = yaml.safe_load(f)
+        else:
+            runs = json.load(f)
+    if isinstance(runs, dict):
+        runs = runs['runs']
+
+    return runs
+
+
+def detect_tool(params: dict) -> str:
+    if 'tool' in params:
+        return params['tool']
+    if 'use_scenarios' in params:
+        return 'lsm'
+    if 'num_sim' in params:
+        return 'spot'
+    raise ValueError(f"Can not detect the tool of parameter set {params.get('name', '')}: "
+                     f"neither 'use_scenarios' nor 'num_sim' given.")
+
+
+def run_spot(params: dict) -> dict:
+    """Complete spot price simulation of one parameter set in the current process."""
+    with profiling.collector() as preparation:
+        params = spot_simulation.prepare_run(params)
+    params.update({'chunk_offset': 0, 'chunk_index': 0, 'num_chunks': 1})
+    result = job_runner.combine_spot_chunks([job_runner.simulate_spot_chunk(params)])
+    result['timings'] = preparation + result['timings']
+    return result
+
+
+def run_storage(params: dict) -> dict:
+    """Complete storage valuation of one parameter set in the current process."""
+    params = params.copy()
+    params.update({'chunk_offset': 0, 'chunk_index': 0, 'num_chunks': 1})
+    # combined like the chunks of a GUI job: statistics instead of the value of every scenario.
+    return job_runner.combine_storage_chunks([job_runner.value_storage_chunk(params)])
+
+
+TOOLS = {'spot': run_spot, 'lsm': run_storage}
+
+
+def run_one(params: dict) -> dict:
+    """Run one parameter set, results of identical parameter sets come from the result cache."""
+    tool = detect_tool(params)
+    cache_key = result_cache.make_key(tool, params)
+    result = result_cache.get(cache_key)
+    if result is None or (tool == 'spot' and not scenario_io.has_cache_key(params['spot_price_simulation'],
+                                                                           cache_key)):
+        if tool == 'spot':
+            result = TOOLS[tool](dict(params, cache_key=cache_key))
+        else:
+            # the backward induction state is checkpointed, a rerun of a crashed storage valuation resumes from it.
+            checkpoint_dir = checkpoint.run_dir(params.get('export_path'), cache_key)
+            result = TOOLS[tool](dict(params, checkpoint_dir=checkpoint_dir))
+            checkpoint.clear(checkpoint_dir)
+        # timings describe this run only, a later cache hit must not report them.
+        result_cache.put(cache_key, {key: value for key, value in result.items() if key != 'timings'})
+
+    return result
+
+
+def to_json(value):
+    """json default for numpy values and paths."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def run_batch(runs: list, max_workers: int = None) -> list:
+    """Run all parameter sets in parallel, one parameter set per worker process. Failed runs report their error."""
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [executor.submit(run_one, params) for params in runs]
+        for index, (params, future) in enumerate(zip(runs, futures)):
+            name = params.get('name', index)
+            try:
+                results.append({'name': name, 'tool': detect_tool(params), 'result': future.result()})
+                logger.info(f"Run {name} finished.")
+            except Exception as e:
+                logger.exception(e)
+                results.append({'name': name, 'error': str(e)})
+
+    return results
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Run spot simulations and storage valuations without GUI.")
+    parser.add_argument('runs', help="json or yaml file with the parameter sets")
+    parser.add_argument('--output', help="json result file, default: <runs>.results.json")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, default: all cores")
+    args = parser.parse_args(argv)
+
+    runs = load_runs(args.runs)
+    results = run_batch(runs, args.workers)
+    output = pathlib.Path(args.output or pathlib.Path(args.runs).with_suffix('.results.json'))
+    with open(output, 'w') as f:
+        json.dump(results, f, default=to_json, indent=2)
+    print(f"{len(results)} runs written to {output}.")
+
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
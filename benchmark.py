@@ -0,0 +1,239 @@
+"""Benchmarks of the spot simulation and storage valuation pipelines. Runs headless, no window is opened.
+
+Synthetic input csv files and storage parameter sets are generated into a temporary folder. Every case runs in a
+fresh worker process, so its peak resident memory can be measured. Results can be stored as baseline and compared
+with later runs::
+
+    python benchmark.py --scale quick --save-baseline benchmark_baseline.json
+    python benchmark.py --scale quick --baseline benchmark_baseline.json
+    python benchmark.py --scale full --max-gb 8
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import pathlib
+import sys
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+
+import data_loader
+import lsm_engine
+import scenario_io
+import spot_simulation
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+DAILY, HOURLY = 365, 8760
+SCALES = {'quick': {'paths': ([10000], [1], [DAILY]),
+                    'export': ([10000], [1], [DAILY]),
+                    'lsm': ([1000], [1]),
+                    'delta': ([1000], [1]),
+                    },
+          'full': {'paths': ([1000, 10000, 100000], [1, 2, 3], [DAILY, HOURLY]),
+                   'export': ([1000, 10000, 100000], [1, 3], [DAILY, HOURLY]),
+                   'lsm': ([1000, 10000], [1, 2, 3]),
+                   'delta': ([1000, 10000], [1]),
+                   },
+          }
+# relative slowdown against the baseline that is reported as regression
+REGRESSION_THRESHOLD = 0.1
+
+
+def write_input_csvs(folder, history_days: int = 3 * 365, seed: int = 0) -> dict:
+    """Write synthetic TermPrices_YEAR.csv, month_prices.csv, actual_spot_prices.csv and month_factors_mr.csv.
+
+    Returns the paths keyed like the simple GUI params.
+    """
+    folder = pathlib.Path(folder)
+    rng = np.random.default_rng(seed)
+    log_deviation = np.zeros(history_days)
+    for day in range(1, history_days):
+        log_deviation[day] = 0.9 * log_deviation[day - 1] + 0.05 * rng.standard_normal()
+    log_deviation += (rng.random(history_days) < 0.02) * rng.normal(0.3, 0.1, history_days)
+    spot = 25 * np.exp(log_deviation)
+    term = 25 * np.exp(np.cumsum(0.01 * rng.standard_normal(history_days)))
+    month_factors = 1 + 0.15 * np.cos(2 * np.pi * np.arange(12) / 12)
+    files = {'actual_spot_prices': ('date;price', spot),
+             'term_prices': ('date;price', term),
+             'month_prices': ('month;price', 25 * month_factors),
+             'month_factors_mr': ('month;factor', month_factors),
+             }
+    paths = {}
+    for key, (header, values) in files.items():
+        path = folder.joinpath(data_loader.INPUT_FILES[key])
+        with open(path, 'w') as f:
+            f.write(header + '\n')
+            f.writelines(f"{index};{value:.4f}\n" for index, value in enumerate(values))
+        paths[key] = path
+
+    return paths
+
+
+def spot_params(folder, num_sim: int, years: int, m: int) -> dict:
+    """Params of the simple GUI for a synthetic spot simulation."""
+    params = {'t': 1, 'm': m, 'start_date': '01.10.2021', 'years_to_future': years, 'reference_year': 0,
+              'initial_prices': [25., 26., 27.], 'jump_distance': 3, 'num_sim': num_sim, 'seed': 0,
+              'export_path': pathlib.Path(folder),
+              'spot_price_simulation': str(pathlib.Path(folder).joinpath('spot_price_simulation')),
+              }
+    params.update(write_input_csvs(folder))
+
+    return params
+
+
+def storage_params(scenario_file, use_scenarios: int, years: int, run_delta: bool = False) -> dict:
+    """Storage parameter set in the shape of `prepare_parameters()` for a seasonal storage."""
+    end_year = 2021 + years
+    return {'interest_rate': 1. / 36000, 'start_date': '2021-10-01', 'end_date': f'{end_year}-10-01',
+            'use_scenarios': use_scenarios, 'initial_storage_volume': 0., 'speicher_wert_besteht': False,
+            'ausspeicherleistung_min_max': [0., 100.], 'einspeicherleistung_min_max': [0., 50.],
+            'total_min_max_volume': [0., 100000.], 'vol_min_max_start': [0., 0.], 'vol_min_max_end': [0., 0.],
+            'inject_costs': 0.5, 'eject_costs': 0.5, 'run_delta': run_delta, 'variation': 1., 'up': 1, 'down': -1,
+            'means_only': False, 'show_statistics': False, 'export_path': None, 'scenario_file': scenario_file,
+            }
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, None where it can not be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def run_case(case: dict) -> dict:
+    """Run one benchmark case in the current (fresh) process."""
+    # the per-stage info records of the engines would drown the benchmark table.
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+    with tempfile.TemporaryDirectory() as folder:
+        if case['kind'] in ('paths', 'export'):
+            params = spot_params(folder, case['num_sim'], case['years'], case['m'])
+            model = spot_simulation.prepare_model(params)
+            steps = len(model['level'])
+            rng = np.random.default_rng(0)
+            start = time.perf_counter()
+            if case['kind'] == 'export':
+                scenario_io.create_scenario_file(params['spot_price_simulation'], case['num_sim'], steps)
+                scenario_io.write_chunks(params['spot_price_simulation'], 0, case['num_sim'],
+                                         lambda rows, out: spot_simulation.simulate(model, rows, rng, out=out))
+            else:
+                rows = max(1, scenario_io.MAX_CHUNK_BYTES // (steps * 8))
+                buffer = np.empty((min(rows, case['num_sim']), steps))
+                for first in range(0, case['num_sim'], rows):
+                    count = min(rows, case['num_sim'] - first)
+                    spot_simulation.simulate(model, count, rng, out=buffer[:count])
+            seconds = time.perf_counter() - start
+            throughput, unit = case['num_sim'] * steps / seconds, 'prices/s'
+        else:
+            params = spot_params(folder, case['use_scenarios'], case['years'], DAILY)
+            params['model'] = spot_simulation.prepare_model(params)
+            scenario_io.create_scenario_file(params['spot_price_simulation'], case['use_scenarios'],
+                                             len(params['model']['level']))
+            rng = np.random.default_rng(0)
+            scenario_io.write_chunks(params['spot_price_simulation'], 0, case['use_scenarios'],
+                                     lambda rows, out: spot_simulation.simulate(params['model'], rows, rng, out=out))
+            scenario_file = scenario_io.scenario_path(params['spot_price_simulation'])
+            storage = storage_params(scenario_file, case['use_scenarios'], case['years'], case['kind'] == 'delta')
+            days = len(lsm_engine.date_range(storage['start_date'], storage['end_date']))
+            S = lsm_engine.load_scenarios(scenario_file)[:, :days]
+            days = S.shape[1]
+            start = time.perf_counter()
+            lsm_engine.value_storage(storage, S)
+            seconds = time.perf_counter() - start
+            throughput, unit = case['use_scenarios'] * days / seconds, 'scenario days/s'
+
+    return dict(case, seconds=seconds, throughput=throughput, unit=unit, peak_rss_mb=peak_rss_mb())
+
+
+def case_name(case: dict) -> str:
+    if case['kind'] in ('paths', 'export'):
+        resolution = 'hourly' if case['m'] == HOURLY else 'daily'
+        return f"{case['kind']}-{case['num_sim']}-{case['years']}y-{resolution}"
+    return f"{case['kind']}-{case['use_scenarios']}-{case['years']}y"
+
+
+def build_cases(scale: str, max_gb: float) -> list:
+    """Cases of a scale. Path cases whose price cube would exceed max_gb on disk are left out."""
+    cases = []
+    for kind, dimensions in SCALES[scale].items():
+        if kind in ('paths', 'export'):
+            for num_sim, years, m in itertools.product(*dimensions):
+                if kind == 'export' and num_sim * years * m * 8 > max_gb * 2 ** 30:
+                    continue
+                cases.append({'kind': kind, 'num_sim': num_sim, 'years': years, 'm': m})
+        else:
+            for use_scenarios, years in itertools.product(*dimensions):
+                cases.append({'kind': kind, 'use_scenarios': use_scenarios, 'years': years})
+    for case in cases:
+        case['name'] = case_name(case)
+
+    return cases
+
+
+def compare(results: list, baseline: dict) -> list:
+    """Lines comparing the throughput of every case with the baseline."""
+    lines = []
+    for result in results:
+        reference = baseline.get(result['name'])
+        if reference is None:
+            continue
+        change = result['throughput'] / reference['throughput'] - 1
+        flag = '  REGRESSION' if change < -REGRESSION_THRESHOLD else ''
+        lines.append(f"{result['name']:<32}{change:>+10.1%}{flag}")
+
+    return lines
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark spot simulation and storage valuation.")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='quick')
+    parser.add_argument('--only', help="run only cases whose name contains this text, e.g. 'lsm'")
+    parser.add_argument('--max-gb', type=float, default=4., help="largest price cube written by export cases")
+    parser.add_argument('--output', help="json file for the results")
+    parser.add_argument('--baseline', help="json file of an earlier run to compare with")
+    parser.add_argument('--save-baseline', help="store the results as baseline json file")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in build_cases(args.scale, args.max_gb) if not args.only or args.only in case['name']]
+    results = []
+    context = multiprocessing.get_context('spawn')
+    print(f"{'case':<32}{'seconds':>10}{'throughput':>16}  {'unit':<16}{'peak RSS [MB]':>14}")
+    for case in cases:
+        # a fresh process per case: peak RSS of one case is not hidden by an earlier, larger case.
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_case, case).result()
+        results.append(result)
+        rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+        print(f"{result['name']:<32}{result['seconds']:>10.3f}{result['throughput']:>16,.0f}  {result['unit']:<16}"
+              f"{rss:>14}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({result['name']: result for result in results}, f, indent=2)
+    regressions = False
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            lines = compare(results, json.load(f))
+        print("\nthroughput against baseline:")
+        print("\n".join(lines))
+        regressions = any(line.endswith('REGRESSION') for line in lines)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Calendar of the valuation horizon, parsed once and cached.
+
+Dates are accepted in the format of the storage tool ('%Y-%m-%d') and of the spot tool ('%d.%m.%Y').
+`valuation_days` holds the days of a storage valuation with their discount factors, `time_grid` the time steps of a
+spot simulation with their month and day-of-week indices. Both are cached per arguments and return read-only arrays,
+the engines index them instead of doing date arithmetic in their loops. `scenario_window` maps the valuation days
+onto the columns of a scenario file, hourly scenarios are aggregated to days with `aggregate_days`.
+"""
+import datetime
+import functools
+
+import numpy as np
+from loguru import logger
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+DAYS_PER_YEAR = 365
+# day count of the interest rate: the daily rate is the rate p.a. / 360
+INTEREST_DAYS = 360
+
+
+def parse_date(text) -> np.datetime64:
+    """Day of a date string in one of DATE_FORMATS, or of a date / datetime64."""
+    if isinstance(text, str):
+        for date_format in DATE_FORMATS:
+            try:
+                return np.datetime64(datetime.datetime.strptime(text, date_format).date(), 'D')
+            except ValueError:
+                continue
+        raise ValueError(f"Date {text!r} matches none of the formats {', '.join(DATE_FORMATS)}.")
+    return np.datetime64(text, 'D')
+
+
+def daily_rate(rate_percent: float) -> float:
+    """Daily interest rate of the rate p.a. in percent, e.g. 3.6 -> 0.0001."""
+    return rate_percent / 100 / INTEREST_DAYS
+
+
+def _read_only(calendar: dict) -> dict:
+    # the cached arrays are shared by every caller
+    for value in calendar.values():
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+    return calendar
+
+
+def weekdays(dates: np.ndarray) -> np.ndarray:
+    """Day of the week of datetime64[D] dates, 0 is Monday."""
+    # 1970-01-01 was a Thursday
+    return (dates.astype(np.int64) + 3) % 7
+
+
+@functools.lru_cache(maxsize=64)
+def valuation_days(start_date: str, end_date: str, interest_rate: float = 0., time_step: int = 1) -> dict:
+    """Days of a storage valuation, start_date inclusive, end_date exclusive.
+
+    :param start_date: first day
+    :param end_date: day after the last day
+    :param interest_rate: daily interest rate, as in the storage parameters
+    :param time_step: days per valuation step
+    :return: dict of 'dates' (datetime64[D]), 'months' (0 is January), 'weekdays' (0 is Monday), 'step_discount'
+        (discount factor from the end to the start of every step) and 'discount_factors' (discount factor of every
+        step to start_date)
+    """
+    dates = np.arange(parse_date(start_date), parse_date(end_date), np.timedelta64(time_step, 'D'))
+    elapsed = (dates - dates[0]).astype(np.int64) if len(dates) else np.zeros(0, dtype=np.int64)
+    return _read_only({'dates': dates,
+                       'months': dates.astype('datetime64[M]').astype(np.int64) % 12,
+                       'weekdays': weekdays(dates),
+                       'step_discount': np.full(len(dates), (1 + interest_rate) ** -time_step),
+                       'discount_factors': (1 + interest_rate) ** -elapsed.astype(np.float64),
+                       })
+
+
+@functools.lru_cache(maxsize=64)
+def time_grid(start_date: str, steps: int, t: int, m: int) -> dict:
+    """Time steps of a spot simulation.
+
+    :param start_date: first simulation date
+    :param steps: number of time steps
+    :param t: time step in units of 1 / m years
+    :param m: annualization factor, time steps per year
+    :return: dict of 'months' (months since January of the start year, a year is split into 12 equal months),
+        'days' (days since start_date), 'weekdays' (0 is Monday) and 'steps_per_day' (None if a time step is not a
+        whole fraction of a day, e.g. trading days)
+    """
+    start = parse_date(start_date)
+    start_month = int(start.astype('datetime64[M]').astype(np.int64) % 12)
+    step = np.arange(steps)
+    days = np.floor(step * t * DAYS_PER_YEAR / m).astype(np.int64)
+    steps_per_day = m / (t * DAYS_PER_YEAR)
+    return _read_only({'months': start_month + np.floor(12 * step * t / m).astype(np.int64),
+                       'days': days,
+                       'weekdays': weekdays(start + days),
+                       'steps_per_day': int(steps_per_day) if steps_per_day >= 1 and steps_per_day.is_integer()
+                       else None,
+                       })
+
+
+def scenario_window(header: dict, start_date: str):
+    """Column of the first valuation day in a scenario file and the number of columns per day.
+
+    :param header: header of the scenario file, see scenario_io. Without 't', 'm' and 'start_date', or if a column
+        is not a whole fraction of a day (e.g. trading days), every column is taken as one day starting at
+        start_date.
+    :param start_date: first valuation day
+    :return: (first column, steps per day)
+    """
+    if not {'t', 'm', 'start_date'} <= header.keys():
+        return 0, 1
+    steps_per_day = time_grid(header['start_date'], 1, header['t'], header['m'])['steps_per_day']
+    if steps_per_day is None:
+        logger.warning(f"Scenarios with {header['m']} / {header['t']} steps per year are valued as daily prices.")
+        return 0, 1
+    offset = int((parse_date(start_date) - parse_date(header['start_date'])).astype(np.int64))
+    if offset < 0:
+        raise ValueError(f"The valuation starts on {start_date}, before the scenarios ({header['start_date']}).")
+
+    return offset * steps_per_day, steps_per_day
+
+
+def aggregate_days(prices: np.ndarray, steps_per_day: int) -> np.ndarray:
+    """Daily mean prices of prices of shape (scenarios, steps). A trailing incomplete day is dropped."""
+    if steps_per_day == 1:
+        return prices
+    days = prices.shape[1] // steps_per_day
+    return prices[:, :days * steps_per_day].reshape(len(prices), days, steps_per_day).mean(axis=-1)
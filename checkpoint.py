@@ -0,0 +1,103 @@
+"""Checkpoints of long runs, a rerun with the same parameters resumes from them.
+
+A job stores the result of every finished chunk (`save_chunk`), the storage valuation of a chunk additionally stores
+its backward induction state every `CHECKPOINT_SECONDS` (`save_state`). The checkpoints of a run are kept in the
+folder checkpoints/<cache key> under the export path. The cache key (see `result_cache.make_key`) covers the
+parameters and the input files, so only a rerun with the same parameters and unchanged input files finds them. A
+crashed or cancelled run leaves its checkpoints behind, a finished run deletes them.
+"""
+import os
+import pathlib
+import pickle
+import shutil
+
+from loguru import logger
+
+CHECKPOINT_FOLDER = 'checkpoints'
+# seconds of backward induction between two checkpoints of the storage valuation state
+CHECKPOINT_SECONDS = 300.
+
+
+def run_dir(export_path, cache_key: str) -> pathlib.Path:
+    """Checkpoint folder of the run with cache_key, None if there is no export path."""
+    if not export_path:
+        return None
+    return pathlib.Path(export_path).joinpath(CHECKPOINT_FOLDER, cache_key[:32])
+
+
+def _write(path: pathlib.Path, content) -> None:
+    """Pickle content to path atomically, a crash while writing keeps the previous checkpoint."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'wb') as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except OSError as e:
+        # a run without checkpoints is still a valid run.
+        logger.warning(f"Could not write checkpoint {path}: {e}")
+
+
+def _read(path: pathlib.Path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def _chunk_path(folder, index: int) -> pathlib.Path:
+    return pathlib.Path(folder).joinpath(f"chunk_{index}.pkl")
+
+
+def _state_path(folder, index: int) -> pathlib.Path:
+    return pathlib.Path(folder).joinpath(f"state_{index}.pkl")
+
+
+def save_chunk(folder, chunk: dict, result) -> None:
+    """Store the result of a finished chunk. The backward induction state of the chunk is not needed anymore."""
+    _write(_chunk_path(folder, chunk['chunk_index']),
+           {'chunk_offset': chunk['chunk_offset'], 'num_chunks': chunk['num_chunks'], 'result': result})
+    _state_path(folder, chunk['chunk_index']).unlink(missing_ok=True)
+
+
+def load_chunks(folder, chunks: list) -> dict:
+    """Results of the chunks that were finished by an earlier run, keyed by chunk index.
+
+    A stored chunk is only used if it covers the same scenarios, i.e. the run was split into chunks the same way.
+    """
+    finished = {}
+    if folder is None:
+        return finished
+    for chunk in chunks:
+        stored = _read(_chunk_path(folder, chunk['chunk_index']))
+        if stored is not None and (stored['chunk_offset'], stored['num_chunks']) == (chunk['chunk_offset'],
+                                                                                      chunk['num_chunks']):
+            finished[chunk['chunk_index']] = stored['result']
+    if finished:
+        logger.info(f"Resuming from checkpoint {folder}: {len(finished)} of {len(chunks)} chunks finished.")
+
+    return finished
+
+
+def exists(folder) -> bool:
+    """True if an earlier run left checkpoints in folder."""
+    return folder is not None and any(pathlib.Path(folder).glob('*.pkl'))
+
+
+def save_state(folder, index: int, state: dict) -> None:
+    """Store the intermediate state of chunk index, e.g. the day and the value grid of the backward induction."""
+    _write(_state_path(folder, index), state)
+
+
+def load_state(folder, index: int):
+    """State of chunk index stored by `save_state`, None if there is none."""
+    if folder is None:
+        return None
+    return _read(_state_path(folder, index))
+
+
+def clear(folder) -> None:
+    """Delete the checkpoints of a finished run."""
+    if folder is not None:
+        shutil.rmtree(folder, ignore_errors=True)
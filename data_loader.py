@@ -0,0 +1,105 @@
+"""Cached loading of the input csv files (TermPrices_YEAR.csv, month_prices.csv, actual_spot_prices.csv, ...).
+
+Every csv file is parsed once into a float64 array. The array is kept in memory and in a binary sidecar file
+``<name>.csv.npz`` next to the csv file. The cache key is the resolved path, modification time and size of the csv
+file, so an edited file is parsed again automatically.
+"""
+import csv
+import os
+import pathlib
+
+import numpy as np
+from loguru import logger
+
+CACHE_SUFFIX = '.npz'
+# input files of the spot simulation: key in params -> file name setting
+INPUT_FILES = {'term_prices': 'TermPrices_YEAR.csv',
+               'month_prices': 'month_prices.csv',
+               'actual_spot_prices': 'actual_spot_prices.csv',
+               'month_factors_mr': 'month_factors_mr.csv',
+               }
+
+_memory_cache = {}
+
+
+def sniff_delimiter(sample: str) -> str:
+    """Delimiter of the csv text sample: ';', ',' or tab. ';' if the sample has a single column or is empty."""
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=';,\t').delimiter
+    except csv.Error:
+        # the sniffer finds no delimiter in a single column
+        return ';'
+
+
+def parse_csv_column(path, column: int = -1) -> np.ndarray:
+    """Read one numeric column of a csv file. Rows that can not be converted (e.g. the header) are skipped.
+
+    :param path: path to csv file, delimiter ';', ',' or tab. ',' is accepted as decimal separator for ';' files.
+    :param column: index of the column
+    """
+    with open(path, 'r', newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = sniff_delimiter(sample)
+        values = []
+        for row in csv.reader(f, delimiter=delimiter):
+            try:
+                values.append(float(row[column].replace(",", ".")))
+            except (IndexError, ValueError):
+                continue
+
+    return np.asarray(values, dtype=np.float64)
+
+
+def cache_key(path, column: int = -1) -> str:
+    """Resolved path, modification time and size of the csv file plus the column."""
+    path = pathlib.Path(path).resolve()
+    stat = path.stat()
+    return f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{column}"
+
+
+def cache_path(path) -> pathlib.Path:
+    path = pathlib.Path(path)
+    return path.with_name(path.name + CACHE_SUFFIX)
+
+
+def load_column(path, column: int = -1) -> np.ndarray:
+    """Cached version of `parse_csv_column`. The returned array is read-only, it is shared between calls."""
+    key = cache_key(path, column)
+    cached_key, values = _memory_cache.get((str(path), column), (None, None))
+    if cached_key == key:
+        return values
+
+    sidecar = cache_path(path)
+    values = None
+    try:
+        with np.load(sidecar) as cached:
+            if str(cached['key']) == key:
+                values = cached['values']
+    except (OSError, KeyError, ValueError):
+        pass
+
+    if values is None:
+        values = parse_csv_column(path, column)
+        # write to a temporary file first, a crashed write must not leave a broken cache behind.
+        temporary = sidecar.with_name(sidecar.name + '.tmp')
+        try:
+            with open(temporary, 'wb') as f:
+                np.savez(f, key=np.array(key), values=values)
+            os.replace(temporary, sidecar)
+        except OSError as e:
+            logger.warning(f"Could not write csv cache {sidecar}: {e}")
+
+    values.setflags(write=False)
+    _memory_cache[(str(path), column)] = key, values
+    return values
+
+
+def load_inputs(params: dict) -> dict:
+    """Load all input files referenced in the simple GUI `params`, keyed like `INPUT_FILES`."""
+    return {key: load_column(params[key]) for key in INPUT_FILES if params.get(key) is not None}
+
+
+def clear_cache() -> None:
+    """Forget the in-memory cache. Sidecar files are checked against the csv file on every load anyway."""
+    _memory_cache.clear()
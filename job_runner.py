@@ -0,0 +1,374 @@
+"""Run simulation jobs in a worker-process pool without blocking the GUI event loop.
+
+A job splits the number of simulations (``num_sim`` / ``use_scenarios``) into chunks, sends every chunk to a
+``ProcessPoolExecutor`` and reports progress, partial and final results back to the window with
+``window.write_event_value``. The worker functions live in this module (and not in the GUI scripts), so the child
+processes never have to build a window.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import pathlib
+import threading
+
+import numpy as np
+from loguru import logger
+
+import checkpoint
+import lsm_engine
+import profiling
+import result_cache
+import scenario_io
+import spot_simulation
+
+# events written to the window. value of each event is documented next to it.
+PROGRESS_EVENT = '-JOB_PROGRESS-'  # (finished chunks, total chunks)
+PARTIAL_EVENT = '-JOB_PARTIAL-'  # (chunk index, chunk result)
+DONE_EVENT = '-JOB_DONE-'  # combined result
+ERROR_EVENT = '-JOB_ERROR-'  # error message
+CANCELLED_EVENT = '-JOB_CANCELLED-'  # None
+
+
+def split_count(total: int, parts: int) -> list:
+    """Split total into at most `parts` chunk sizes that differ by one at most.
+
+    :param total: number of simulations or scenarios
+    :param parts: number of requested chunks
+    """
+    parts = max(1, min(parts, total))
+    size, rest = divmod(total, parts)
+    return [size + 1 if i < rest else size for i in range(parts)]
+
+
+@profiling.profile_if_requested
+@profiling.collect_timings
+def simulate_spot_chunk(params: dict) -> dict:
+    """Worker function of the spot price simulation. Runs one chunk of `num_sim` paths.
+
+    The paths are simulated directly into the rows of the scenario file that belong to the chunk. Returns the sums
+    over the paths of the chunk, `combine_spot_chunks` turns them into mean and standard deviation.
+    """
+    rng = spot_simulation.chunk_rng(params)
+    model = params['model']
+    steps = len(model['level'])
+    sums, squares = np.zeros(steps), np.zeros(steps)
+    statistics = []
+
+    def simulate(rows, out):
+        with profiling.stage('path_generation', paths=rows):
+            spot_simulation.simulate(model, rows, rng, out=out)
+        # float32 paths are summed in float64
+        sums[:] += out.sum(axis=0, dtype=np.float64)
+        squares[:] += np.square(out, dtype=np.float64).sum(axis=0)
+        statistics.append(spot_simulation.path_statistics(model, out))
+
+    scenario_io.write_chunks(params['spot_price_simulation'], params['chunk_offset'], params['num_sim'], simulate)
+    return {'num_sim': params['num_sim'], 'sum': sums, 'sum_squares': squares,
+            'statistics': {key: np.concatenate([entry[key] for entry in statistics]) for key in statistics[0]},
+            'expected_price': float(spot_simulation.expected_prices(model).mean()),
+            'variance_reduction': model.get('variance_reduction', 'none')}
+
+
+def combine_spot_chunks(results: list) -> dict:
+    """Mean and standard deviation of every time step over all chunks of the spot price simulation.
+
+    The strip value with its standard error (see `spot_simulation.strip_estimate`) measures the accuracy of the run.
+    """
+    num_sim = sum(result['num_sim'] for result in results)
+    mean = sum(result['sum'] for result in results) / num_sim
+    variance = sum(result['sum_squares'] for result in results) / num_sim - mean ** 2
+    combined = {'num_sim': num_sim, 'mean': mean, 'std': variance.clip(min=0) ** 0.5,
+                'timings': [entry for result in results for entry in result.get('timings', [])]}
+    if 'statistics' in results[0]:
+        statistics = {key: np.concatenate([result['statistics'][key] for result in results])
+                      for key in results[0]['statistics']}
+        mode = results[0]['variance_reduction']
+        combined.update(spot_simulation.strip_estimate(statistics, results[0]['expected_price'], mode))
+        combined['variance_reduction'] = mode
+        logger.info(f"Strip value {combined['strip_value']:.4f}, standard error {combined['std_error']:.4f} "
+                    f"({mode}, {num_sim} paths)")
+
+    return combined
+
+
+@profiling.profile_if_requested
+@profiling.collect_timings
+def value_storage_chunk(params: dict) -> dict:
+    """Worker function of the storage valuation. Values the storage on one chunk of `use_scenarios` scenarios.
+
+    With 'means_only' the storage is valued on the mean price curve of the chunk instead, see
+    `lsm_engine.value_mean_curve`.
+    """
+    if params.get('means_only'):
+        result = lsm_engine.value_mean_curve(params)
+    else:
+        S = lsm_engine.valuation_scenarios(params, params['chunk_offset'], params['use_scenarios'])
+        result = lsm_engine.value_storage(params, S)
+    return result
+
+
+def combine_storage_chunks(results: list) -> dict:
+    """Scenario weighted mean of the storage values (and deltas) of all chunks."""
+    use_scenarios = sum(result['use_scenarios'] for result in results)
+    combined = {'use_scenarios': use_scenarios,
+                'timings': [entry for result in results for entry in result.get('timings', [])]}
+    for key, error_key in STORAGE_ESTIMATES.items():
+        if key not in results[0]:
+            continue
+        weights = [result['use_scenarios'] / use_scenarios for result in results]
+        combined[key] = sum(result[key] * weight for result, weight in zip(results, weights))
+        # chunks are independent estimates, their standard errors add in quadrature with weights n_i / n
+        combined[error_key] = sum((result[error_key] * weight) ** 2 for result, weight in zip(results, weights)) ** 0.5
+    if 'scenario_values' in results[0]:
+        combined['statistics'] = lsm_engine.value_statistics(
+            np.concatenate([result['scenario_values'] for result in results]))
+    combined['means_only'] = results[0].get('means_only', False)
+    return combined
+
+
+def value_contract_chunk(params: dict) -> dict:
+    """Worker function of the portfolio valuation. Values one chunk of the scenarios of one storage contract."""
+    result = value_storage_chunk(params)
+    result.update({'contract_index': params['contract_index'], 'name': params.get('name', params['contract_index'])})
+    return result
+
+
+def combine_portfolio_chunks(results: list) -> dict:
+    """Value of every contract of the portfolio (see `combine_storage_chunks`) and their sums.
+
+    All contracts are valued on the same scenarios, their errors are not independent. The standard errors of the
+    sums are added linearly, an upper bound of the error of the portfolio.
+    """
+    by_contract = {}
+    for result in results:
+        by_contract.setdefault(result['contract_index'], []).append(result)
+    contracts = [dict(combine_storage_chunks(by_contract[index]), name=by_contract[index][0]['name'])
+                 for index in sorted(by_contract)]
+    combined = {'contracts': contracts, 'timings': [entry for contract in contracts for entry in contract['timings']]}
+    for contract in contracts:
+        del contract['timings']
+    for key, error_key in STORAGE_ESTIMATES.items():
+        if all(key in contract for contract in contracts):
+            combined[key] = sum(contract[key] for contract in contracts)
+            combined[error_key] = sum(contract[error_key] for contract in contracts)
+    logger.info(f"Portfolio of {len(contracts)} contracts: {combined['value']:,.2f}")
+
+    return combined
+
+
+# estimates of the storage valuation and their standard errors
+STORAGE_ESTIMATES = {'value': 'std_error', 'value_up': 'std_error_up', 'value_down': 'std_error_down',
+                     'delta': 'delta_std_error'}
+
+
+def collect_results(results: list) -> list:
+    """Default combine function: chunk results ordered by chunk index."""
+    return results
+
+
+class Job:
+    """A running simulation job. Create it with `start_job`."""
+
+    def __init__(self, window, worker, chunks: list, combine, max_workers: int, cache_key: str = None,
+                 checkpoint_dir=None, in_process: bool = False, timings: list = None, prepare=None):
+        self.window = window
+        self.worker = worker
+        self.chunks = chunks
+        self.combine = combine
+        self.max_workers = max_workers
+        self.cache_key = cache_key
+        self.checkpoint_dir = checkpoint_dir
+        self.in_process = in_process
+        # stage records of the preparation of the job, e.g. the calibration in the GUI, reported with the result
+        self.timings = timings or []
+        # function of the chunks that returns the chunks to run, called in the job thread, e.g. `share_scenarios`
+        self.prepare = prepare
+        self._cancelled = threading.Event()
+        # the first of DONE, ERROR and CANCELLED ends the job, later ones are not sent
+        self._finished = threading.Lock()
+        self._executor = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        """Stop the job now: CANCELLED is sent at once, chunks that have not started are dropped and the worker
+        processes are terminated. Chunks in the threads of an in_process job run to their end and are discarded.
+        """
+        self._cancelled.set()
+        self._finish(CANCELLED_EVENT, None)
+        executor = self._executor
+        if executor is None:
+            return
+        # the pool has no public way to stop running tasks. Checkpoints are written atomically, see checkpoint._write.
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        if processes:
+            logger.info(f"Terminated {len(processes)} worker processes.")
+
+    def _finish(self, event: str, value) -> None:
+        """Send the final event of the job, unless the job has already ended."""
+        if self._finished.acquire(blocking=False):
+            self.window.write_event_value(event, value)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        results = [None] * len(self.chunks)
+        # chunks finished by an earlier, crashed or cancelled run with the same parameters are not run again.
+        resumed = checkpoint.load_chunks(self.checkpoint_dir, self.chunks)
+        for index, result in resumed.items():
+            results[index] = result
+            self.window.write_event_value(PARTIAL_EVENT, (index, result))
+        finished = len(resumed)
+        if finished:
+            self.window.write_event_value(PROGRESS_EVENT, (finished, len(self.chunks)))
+        if self.in_process:
+            # short jobs: starting worker processes would take longer than the job itself.
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            # spawn on every platform: forking a process that runs a Tk main loop is not safe.
+            context = multiprocessing.get_context('spawn')
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        try:
+            if self.prepare is not None:
+                # slow preparations, e.g. parsing csv scenario files, do not block the window.
+                self.chunks = self.prepare(self.chunks)
+                if self.cancelled:
+                    return
+            futures = {self._executor.submit(self.worker, chunk): index for index, chunk in enumerate(self.chunks)
+                       if index not in resumed}
+            if self.cancelled:
+                # cancelled while the pool was starting, before cancel() could see it
+                self.cancel()
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancelled:
+                    break
+                index = futures[future]
+                results[index] = future.result()
+                if self.checkpoint_dir is not None:
+                    checkpoint.save_chunk(self.checkpoint_dir, self.chunks[index], results[index])
+                finished += 1
+                self.window.write_event_value(PARTIAL_EVENT, (index, results[index]))
+                self.window.write_event_value(PROGRESS_EVENT, (finished, len(self.chunks)))
+            if self.cancelled:
+                logger.info("Job cancelled.")
+                return
+            result = self.combine(results)
+            if self.cache_key is not None:
+                # timings describe this run only, a later cache hit must not report them.
+                result_cache.put(self.cache_key, {key: value for key, value in result.items() if key != 'timings'})
+            checkpoint.clear(self.checkpoint_dir)
+            if self.timings:
+                result['timings'] = self.timings + result.get('timings', [])
+            self._finish(DONE_EVENT, result)
+        except concurrent.futures.CancelledError:
+            self._finish(CANCELLED_EVENT, None)
+        except Exception as e:
+            # terminated workers break the pool, a cancelled job has already been reported.
+            if not self.cancelled:
+                logger.exception(e)
+                self._finish(ERROR_EVENT, str(e))
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def share_scenarios(contracts: list) -> list:
+    """Contracts (or chunks of contracts) with every csv scenario file parsed once and published in shared memory.
+
+    .npy scenario files are memory-mapped read-only by the workers, the operating system keeps one copy of them for
+    all processes. A csv file would be parsed again by every chunk, so it is read here once and the contracts get the
+    shared scenario file instead. The shared memory block lives until `scenario_io.release_shared`.
+    """
+    shared = {}
+    contracts = [contract.copy() for contract in contracts]
+    for contract in contracts:
+        path = pathlib.Path(contract['scenario_file'])
+        if path.suffix == scenario_io.SCENARIO_SUFFIX:
+            continue
+        if path not in shared:
+            folder = pathlib.Path(contract.get('export_path') or path.parent)
+            shared[path] = scenario_io.share_array(folder.joinpath(path.stem + '_portfolio'),
+                                                   lsm_engine.load_scenarios(path), metadata={'source': str(path)})
+        contract['scenario_file'] = shared[path]
+
+    return contracts
+
+
+def start_portfolio_job(window, contracts: list, max_workers: int = None, cache_key: str = None,
+                        checkpoint_dir=None) -> Job:
+    """Value a list of storage contracts in one worker pool, the result is sent to window like the one of `start_job`.
+
+    Every contract is split into as many scenario chunks as needed to keep all workers busy (at least one), the
+    chunks of all contracts share the pool. See `combine_portfolio_chunks` for the result. csv scenario files are
+    parsed by the job thread, see `share_scenarios`.
+
+    :param window: window that receives the job events
+    :param contracts: storage parameters of every contract, see `prepare_parameters` of the complex GUI
+    :param max_workers: number of worker processes, defaults to the number of cores
+    :param cache_key: if given, the combined result is stored in the result cache under this key
+    :param checkpoint_dir: if given, finished chunks are stored in this folder, see `start_job`
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    chunks_per_contract = -(-max_workers // len(contracts))
+    chunks = []
+    for contract_index, contract in enumerate(contracts):
+        # the mean curve of the means-only quote is not split
+        sizes = split_count(int(contract['use_scenarios']), 1 if contract.get('means_only') else chunks_per_contract)
+        offset = 0
+        for size in sizes:
+            chunk = contract.copy()
+            chunk.update({'use_scenarios': size, 'chunk_index': len(chunks), 'chunk_offset': offset,
+                          'contract_index': contract_index, 'checkpoint_dir': checkpoint_dir})
+            chunks.append(chunk)
+            offset += size
+    for chunk in chunks:
+        chunk['num_chunks'] = len(chunks)
+    logger.info(f"Starting portfolio job with {len(contracts)} contracts in {len(chunks)} chunks on {max_workers} "
+                f"worker processes.")
+
+    return Job(window, value_contract_chunk, chunks, combine_portfolio_chunks, max_workers, cache_key,
+               checkpoint_dir, prepare=share_scenarios).start()
+
+
+def start_job(window, worker, params: dict, count_key: str, combine=collect_results, max_workers: int = None,
+              chunks_per_worker: int = 4, cache_key: str = None, checkpoint_dir=None, in_process: bool = False,
+              timings: list = None) -> Job:
+    """Split `params[count_key]` across the worker pool and start the job in a background thread.
+
+    :param window: window that receives the job events
+    :param worker: picklable module level function taking one params chunk
+    :param params: parameters of the whole run
+    :param count_key: key of the number of simulations in params, e.g. 'num_sim' or 'use_scenarios'
+    :param combine: function that merges the list of chunk results into the final result
+    :param max_workers: number of worker processes, defaults to the number of cores
+    :param chunks_per_worker: more chunks than workers give finer progress reports
+    :param cache_key: if given, the combined result is stored in the result cache under this key
+    :param checkpoint_dir: if given, finished chunks (and the state of running storage valuations) are stored in this
+        folder, a job with the same folder resumes from them. See checkpoint.py.
+    :param in_process: run the chunks in threads of this process instead of worker processes, for jobs that take less
+        time than starting a process
+    :param timings: stage records of the preparation of the job, see profiling.collector. They are added to the
+        'timings' of the combined result.
+    """
+    max_workers = max_workers or (1 if in_process else os.cpu_count() or 1)
+    sizes = split_count(int(params[count_key]), max_workers * chunks_per_worker)
+    chunks, offset = [], 0
+    for index, size in enumerate(sizes):
+        chunk = params.copy()
+        chunk.update({count_key: size, 'chunk_index': index, 'num_chunks': len(sizes), 'chunk_offset': offset,
+                      'checkpoint_dir': checkpoint_dir})
+        chunks.append(chunk)
+        offset += size
+    logger.info(f"Starting job with {len(chunks)} chunks on {max_workers} worker processes.")
+
+    return Job(window, worker, chunks, combine, max_workers, cache_key, checkpoint_dir, in_process, timings).start()
@@ -0,0 +1,414 @@
+"""Local job server: several GUI clients share the worker pool of one machine.
+
+The server is started as a separate process and listens on localhost (`multiprocessing.connection`, authenticated
+with the shared secret of `auth_key`). A client sends the `params` dict of a spot simulation ('spot'), a storage valuation ('lsm') or a
+portfolio ('portfolio', params {'contracts': [...]}) with a priority. The server queues it and runs at most `--jobs`
+jobs at once, each on its share of the `--workers` worker processes. The job events of job_runner (progress, done,
+error, cancelled) are streamed back to the client, `submit` writes them to the window of the GUI like a local job.
+
+Scheduling: the queued job with the highest priority runs next, between equal priorities the client with the fewest
+started jobs goes first, then the oldest job. A job with the same parameters as a queued or running job is not run
+twice, the client is attached to the running job instead. Finished results come from the result cache.
+
+Paths in params are opened by the server, so the server has to see the same files as the clients (same machine or
+shared drive). Usage::
+
+    python job_server.py --address localhost:6000 --workers 16 --jobs 2
+"""
+import argparse
+import getpass
+import itertools
+import multiprocessing
+import os
+import pathlib
+import queue
+import secrets
+import sys
+import threading
+from multiprocessing.connection import Client, Listener
+
+from loguru import logger
+
+import checkpoint
+import job_runner
+import result_cache
+import scenario_io
+import spot_simulation
+
+DEFAULT_ADDRESS = 'localhost:6000'
+# shared secret of server and clients, see auth_key
+KEY_VARIABLE = 'JOB_SERVER_KEY'
+KEY_FILE = pathlib.Path.home().joinpath('.simulation_tool', 'job_server.key')
+QUEUED_EVENT = '-JOB_QUEUED-'  # position in the queue of the server, 0 if the job runs already
+CANCEL_MESSAGE = 'cancel'
+FINAL_EVENTS = (job_runner.DONE_EVENT, job_runner.ERROR_EVENT, job_runner.CANCELLED_EVENT)
+# seconds between two checks for a cancel message of the client
+POLL_SECONDS = 0.1
+
+
+def parse_address(address: str) -> tuple:
+    """(host, port) of 'host:port', e.g. 'localhost:6000'. Without a port the port of DEFAULT_ADDRESS is used.
+
+    :raises ValueError: if the port is not a number between 1 and 65535
+    """
+    address = str(address or DEFAULT_ADDRESS).strip()
+    host, separator, port = address.rpartition(':')
+    if not separator:
+        host, port = address, DEFAULT_ADDRESS.rpartition(':')[2]
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"Invalid job server address {address!r}, expected host:port, e.g. {DEFAULT_ADDRESS}.")
+    return host or 'localhost', int(port)
+
+
+def auth_key(create: bool = False) -> bytes:
+    """Shared secret of server and clients. Messages are pickled, a client with the key can run any code on the server.
+
+    The key is the environment variable JOB_SERVER_KEY or else the content of KEY_FILE, which only its owner may read.
+    Clients of other users need the key in JOB_SERVER_KEY.
+
+    :param create: write a new random key to KEY_FILE if there is none (the server does on its first start)
+    """
+    key = os.environ.get(KEY_VARIABLE)
+    if key:
+        return key.encode()
+    try:
+        if os.name == 'posix' and KEY_FILE.stat().st_mode & 0o077:
+            raise RuntimeError(f"{KEY_FILE} can be read by other users, restrict it with 'chmod 600 {KEY_FILE}'.")
+        return KEY_FILE.read_bytes().strip()
+    except FileNotFoundError:
+        if not create:
+            raise RuntimeError(f"No job server key: set {KEY_VARIABLE} or start the job server once to create "
+                               f"{KEY_FILE}.") from None
+    KEY_FILE.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    key = secrets.token_hex(32)
+    with os.fdopen(os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+        f.write(key)
+    logger.info(f"New job server key written to {KEY_FILE}.")
+
+    return key.encode()
+
+
+def start_spot(window, params: dict, max_workers: int) -> job_runner.Job:
+    """Spot price simulation of params, see run() of the simple GUI. Returns None for a cached result."""
+    cache_key = result_cache.make_key('spot', params)
+    cached = None if params.get('profile') else result_cache.get(cache_key)
+    if cached is not None and scenario_io.has_cache_key(params['spot_price_simulation'], cache_key):
+        window.write_event_value(job_runner.DONE_EVENT, cached)
+        return None
+    checkpoint_dir = checkpoint.run_dir(pathlib.Path(params['spot_price_simulation']).parent, cache_key)
+    resume = checkpoint.exists(checkpoint_dir) and scenario_io.has_cache_key(params['spot_price_simulation'],
+                                                                            cache_key)
+    if not resume:
+        checkpoint.clear(checkpoint_dir)
+    params = spot_simulation.prepare_run(dict(params, cache_key=cache_key), resume=resume)
+    return job_runner.start_job(window, job_runner.simulate_spot_chunk, params, 'num_sim',
+                                combine=job_runner.combine_spot_chunks, max_workers=max_workers,
+                                cache_key=cache_key, checkpoint_dir=checkpoint_dir)
+
+
+def start_storage(window, params: dict, max_workers: int) -> job_runner.Job:
+    """Storage valuation of params, see run() of the complex GUI. Returns None for a cached result."""
+    cache_key = result_cache.make_key('lsm', params)
+    cached = None if params.get('profile') else result_cache.get(cache_key)
+    if cached is not None:
+        window.write_event_value(job_runner.DONE_EVENT, cached)
+        return None
+    if params.get('means_only'):
+        return job_runner.start_job(window, job_runner.value_storage_chunk, params, 'use_scenarios',
+                                    combine=job_runner.combine_storage_chunks, chunks_per_worker=1,
+                                    cache_key=cache_key, in_process=True)
+    return job_runner.start_job(window, job_runner.value_storage_chunk, params, 'use_scenarios',
+                                combine=job_runner.combine_storage_chunks, max_workers=max_workers,
+                                chunks_per_worker=1, cache_key=cache_key,
+                                checkpoint_dir=checkpoint.run_dir(params.get('export_path'), cache_key))
+
+
+def start_portfolio(window, params: dict, max_workers: int) -> job_runner.Job:
+    """Valuation of the storage contracts params['contracts'], see run_portfolio() of the complex GUI."""
+    contracts = params['contracts']
+    cache_key = result_cache.make_key('portfolio', {'contracts': [result_cache.make_key('lsm', contract)
+                                                                  for contract in contracts]})
+    cached = None if any(contract.get('profile') for contract in contracts) else result_cache.get(cache_key)
+    if cached is not None:
+        window.write_event_value(job_runner.DONE_EVENT, cached)
+        return None
+    return job_runner.start_portfolio_job(window, contracts, max_workers=max_workers, cache_key=cache_key,
+                                          checkpoint_dir=checkpoint.run_dir(contracts[0].get('export_path'),
+                                                                            cache_key))
+
+
+TOOLS = {'spot': start_spot, 'lsm': start_storage, 'portfolio': start_portfolio}
+
+
+class ServerJob:
+    """A job of the server and the event queues of the clients attached to it. Used as window of the job."""
+
+    def __init__(self, scheduler, key: str, request: dict, sequence: int):
+        self.scheduler = scheduler
+        self.key = key
+        self.tool = request['tool']
+        self.params = request['params']
+        self.priority = request.get('priority', 0)
+        self.client = request.get('client', '')
+        self.sequence = sequence
+        self.subscribers = []
+        self.job = None
+        # set when the last client left, the job is cancelled as soon as it exists
+        self.cancelled = False
+
+    def write_event_value(self, event: str, value) -> None:
+        # chunk results are large and not shown by the GUIs
+        if event == job_runner.PARTIAL_EVENT:
+            return
+        for events in list(self.subscribers):
+            events.put((event, value))
+        if event in FINAL_EVENTS:
+            self.scheduler.finished(self)
+
+
+class Scheduler:
+    """Priority queue of the server jobs, runs at most max_jobs of them at once."""
+
+    def __init__(self, workers: int, max_jobs: int = 1):
+        self.max_jobs = max(1, max_jobs)
+        self.workers_per_job = max(1, workers // self.max_jobs)
+        self._condition = threading.Condition()
+        self._queued = []
+        # queued and running jobs by key
+        self._jobs = {}
+        self._running = 0
+        # started jobs per client
+        self._started = {}
+        self._sequence = itertools.count()
+        threading.Thread(target=self._run, name='scheduler', daemon=True).start()
+
+    def submit(self, request: dict):
+        """Queue the job of request, or attach to the identical queued or running job. Returns (job, events)."""
+        if request['tool'] not in TOOLS:
+            raise ValueError(f"Unknown tool {request['tool']!r}, expected one of {', '.join(TOOLS)}.")
+        key = result_cache.make_key(request['tool'], request['params'])
+        events = queue.Queue()
+        with self._condition:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = ServerJob(self, key, request, next(self._sequence))
+                self._queued.append(job)
+                self._condition.notify_all()
+            else:
+                logger.info(f"Job {key[:12]} of {request.get('client', '')} joins the identical job of {job.client}.")
+                job.priority = max(job.priority, request.get('priority', 0))
+            job.subscribers.append(events)
+            position = self._queued.index(job) + 1 if job in self._queued else 0
+        events.put((QUEUED_EVENT, position))
+
+        return job, events
+
+    def unsubscribe(self, job: ServerJob, events: queue.Queue) -> None:
+        """Detach a client from job, a job without clients is dropped from the queue or cancelled."""
+        with self._condition:
+            if events in job.subscribers:
+                job.subscribers.remove(events)
+            if job.subscribers:
+                return
+            if job in self._queued:
+                self._queued.remove(job)
+                self._jobs.pop(job.key, None)
+                return
+            job.cancelled = True
+        # a job that is still being started is cancelled by _run
+        if job.job is not None:
+            job.job.cancel()
+
+    def finished(self, job: ServerJob) -> None:
+        with self._condition:
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+                self._running -= 1
+                self._condition.notify_all()
+
+    def _next(self) -> ServerJob:
+        return min(self._queued, key=lambda job: (-job.priority, self._started.get(job.client, 0), job.sequence))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queued and self._running < self.max_jobs)
+                job = self._next()
+                self._queued.remove(job)
+                self._started[job.client] = self._started.get(job.client, 0) + 1
+                self._running += 1
+            logger.info(f"Starting {job.tool} job {job.key[:12]} of {job.client} (priority {job.priority}).")
+            for events in list(job.subscribers):
+                events.put((QUEUED_EVENT, 0))
+            try:
+                job.job = TOOLS[job.tool](job, job.params, self.workers_per_job)
+            except Exception as e:
+                logger.exception(e)
+                job.write_event_value(job_runner.ERROR_EVENT, str(e))
+                continue
+            with self._condition:
+                cancelled = job.cancelled
+            if cancelled and job.job is not None:
+                # the last client left while the job was starting
+                job.job.cancel()
+
+
+def serve_client(connection, scheduler: Scheduler) -> None:
+    """Receive one job request from connection and stream its events back until the job ends."""
+    job = events = None
+    try:
+        request = connection.recv()
+        try:
+            job, events = scheduler.submit(request)
+        except Exception as e:
+            connection.send((job_runner.ERROR_EVENT, str(e)))
+            return
+        while True:
+            if connection.poll() and connection.recv() == CANCEL_MESSAGE:
+                scheduler.unsubscribe(job, events)
+                connection.send((job_runner.CANCELLED_EVENT, None))
+                return
+            try:
+                event, value = events.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            connection.send((event, value))
+            if event in FINAL_EVENTS:
+                return
+    except (EOFError, OSError):
+        # the client is gone
+        if job is not None:
+            scheduler.unsubscribe(job, events)
+    finally:
+        connection.close()
+
+
+def serve(address: str = DEFAULT_ADDRESS, workers: int = None, max_jobs: int = 1) -> None:
+    """Run the job server until the process is stopped."""
+    authkey = auth_key(create=True)
+    scheduler = Scheduler(workers or os.cpu_count() or 1, max_jobs)
+    with Listener(parse_address(address), authkey=authkey) as listener:
+        logger.info(f"Job server listening on {address}: {max_jobs} jobs at once on "
+                    f"{scheduler.workers_per_job} workers each.")
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                # e.g. a client with the wrong key
+                logger.warning(f"Connection refused: {e}")
+                continue
+            threading.Thread(target=serve_client, args=(connection, scheduler), daemon=True).start()
+
+
+class RemoteJob:
+    """A job running on the job server, with the interface of job_runner.Job. Create it with `submit`."""
+
+    def __init__(self, window, address: str, request: dict):
+        self.window = window
+        self.address = address
+        self.request = request
+        self._cancelled = threading.Event()
+        self._connection = None
+        self._lock = threading.Lock()
+        # the first final event ends the job for the window, see job_runner.Job
+        self._finished = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        """Ask the server to cancel the job, it keeps running for other clients that submitted the same job.
+
+        Without a connection to the server (not connected yet, or the connection failed) the job ends here.
+        """
+        self._cancelled.set()
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.send(CANCEL_MESSAGE)
+                    return
+                except OSError:
+                    pass
+        self._finish(job_runner.CANCELLED_EVENT, None)
+
+    def _finish(self, event: str, value) -> None:
+        if self._finished.acquire(blocking=False):
+            self.window.write_event_value(event, value)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        if self.cancelled:
+            return
+        try:
+            with Client(parse_address(self.address), authkey=auth_key()) as connection:
+                with self._lock:
+                    self._connection = connection
+                    connection.send(self.request)
+                    if self.cancelled:
+                        connection.send(CANCEL_MESSAGE)
+                while True:
+                    event, value = connection.recv()
+                    if event in FINAL_EVENTS:
+                        self._finish(event, value)
+                        break
+                    if not self._finished.locked():
+                        # the events of a job cancelled before the connection was made are dropped
+                        self.window.write_event_value(event, value)
+        except RuntimeError as e:
+            # no key
+            logger.error(e)
+            self._finish(job_runner.ERROR_EVENT, str(e))
+        except multiprocessing.AuthenticationError as e:
+            logger.error(e)
+            self._finish(job_runner.ERROR_EVENT, f"Job server {self.address} refused the key of {KEY_VARIABLE} or "
+                                                 f"{KEY_FILE}: {e}")
+        except (OSError, EOFError) as e:
+            logger.exception(e)
+            self._finish(job_runner.ERROR_EVENT, f"Job server {self.address} not reachable: {e}")
+        except Exception as e:
+            # e.g. an invalid address. The window needs a final event, or the GUI waits for the job forever.
+            logger.exception(e)
+            self._finish(job_runner.ERROR_EVENT, str(e))
+        finally:
+            with self._lock:
+                self._connection = None
+
+
+def submit(window, tool: str, params: dict, address: str = DEFAULT_ADDRESS, priority: int = 0) -> RemoteJob:
+    """Run a job on the job server, its events are written to window like the ones of job_runner.start_job.
+
+    :param window: window that receives the job events, and QUEUED_EVENT with the position in the queue
+    :param tool: 'spot', 'lsm' or 'portfolio'
+    :param params: parameters of the run, for 'portfolio' {'contracts': [params of every contract]}
+    :param address: 'host:port' of the server
+    :param priority: jobs with a higher priority run first
+    """
+    # fair scheduling is per user
+    request = {'tool': tool, 'params': params, 'priority': int(priority or 0), 'client': getpass.getuser()}
+    logger.info(f"Submitting {tool} job to the job server {address}.")
+
+    return RemoteJob(window, address, request).start()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the jobs of several GUI clients on this machine.")
+    parser.add_argument('--address', default=DEFAULT_ADDRESS, help=f"host:port, default: {DEFAULT_ADDRESS}")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, default: all cores")
+    parser.add_argument('--jobs', type=int, default=1, help="jobs running at once, default: 1")
+    args = parser.parse_args(argv)
+    serve(args.address, args.workers, args.jobs)
+
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
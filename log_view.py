@@ -0,0 +1,82 @@
+"""Bounded, throttled log window of the GUI tools.
+
+print() output (stdout and stderr) goes to a `LogBuffer` instead of straight into the Tk text widget. Writing only
+appends to a ring buffer of the last `MAX_LINES` lines, so printing from a tight loop never waits for Tk. The event
+loop reads the window with a timeout of `FLUSH_MILLISECONDS` and calls `LogBuffer.flush_to`, which moves the new
+lines to the Multiline element in one update. The element is rewritten from the ring buffer when it holds more than
+2 * MAX_LINES lines, so the log of a long session does not grow without bound.
+"""
+import collections
+import io
+import sys
+import threading
+
+import PySimpleGUI as sg
+
+LOG_KEY = '-LOG-'
+MAX_LINES = 5000
+FLUSH_MILLISECONDS = 200
+
+
+class LogBuffer(io.TextIOBase):
+    """File-like ring buffer of text lines, used as sys.stdout and sys.stderr. Thread safe."""
+
+    def __init__(self, echo=None, max_lines: int = MAX_LINES):
+        self.echo = echo
+        self.lines = collections.deque(maxlen=max_lines)
+        self._pending = collections.deque(maxlen=max_lines)
+        self._partial = ''
+        # lines that were pushed out of the pending lines before they were shown
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._element = None
+        self._element_lines = 0
+
+    def write(self, text: str) -> int:
+        if self.echo is not None:
+            self.echo.write(text)
+        with self._lock:
+            *complete, self._partial = (self._partial + text).split('\n')
+            self._dropped += max(0, len(self._pending) + len(complete) - self._pending.maxlen)
+            self.lines.extend(complete)
+            self._pending.extend(complete)
+
+        return len(text)
+
+    def flush(self) -> None:
+        if self.echo is not None:
+            self.echo.flush()
+
+    def flush_to(self, window: sg.Window) -> None:
+        """Show the lines written since the last call in the log element of window, as one update."""
+        element = window[LOG_KEY]
+        with self._lock:
+            # a new window or an element that is too long gets the whole ring buffer, otherwise the new lines are
+            # appended.
+            rewrite = element is not self._element or self._element_lines + len(self._pending) > 2 * self.lines.maxlen
+            if not rewrite and not self._pending:
+                return
+            lines = list(self.lines) if rewrite else list(self._pending)
+            if self._dropped and not rewrite:
+                lines.insert(0, f"... {self._dropped} lines not shown ...")
+            self._pending.clear()
+            self._dropped = 0
+            self._element = element
+            self._element_lines = len(lines) if rewrite else self._element_lines + len(lines)
+        element.update("".join(line + '\n' for line in lines), append=not rewrite)
+
+
+def install(echo: bool = True) -> LogBuffer:
+    """Redirect stdout and stderr of this process to a new LogBuffer.
+
+    :param echo: also write to the original stdout, like `sg.Output(echo_stdout_stderr=True)`
+    """
+    buffer = LogBuffer(sys.__stdout__ if echo else None)
+    sys.stdout = sys.stderr = buffer
+
+    return buffer
+
+
+def log_element(size: tuple) -> sg.Multiline:
+    """Read-only log element of the main window, filled by `LogBuffer.flush_to`."""
+    return sg.Multiline(size=size, key=LOG_KEY, font="Any 8", autoscroll=True, disabled=True)
@@ -0,0 +1,503 @@
+"""Least-squares Monte Carlo (LSM) valuation of a gas / power storage.
+
+The storage volume is discretized on a uniform grid. Going backwards from the last day, the discounted value of
+every volume level is regressed on polynomials of the day's spot price. The basis matrix is the same for every volume
+level, so one QR decomposition per day and a single multi right-hand-side solve give the continuation values of all
+levels at once. The decisions use the regressed continuation values, the values carried backwards are the realized
+cash flows along each scenario (Longstaff-Schwartz). In adaptive grid mode unreachable volume levels are pruned day by
+day and the grid is coarsened where the value function is linear in the volume.
+"""
+import itertools
+import math
+import pathlib
+import time
+
+import numpy as np
+from loguru import logger
+
+import calendar_index
+import checkpoint
+import profiling
+import scenario_io
+
+HOURS_PER_DAY = 24
+# value of volume levels that violate the end volume constraint.
+PENALTY = -1e12
+# up to this number of scenarios the decisions of a day are taken by `best_decisions` in one vectorized step, above
+# it offset by offset by `decisions_by_offset`, whose arrays stay in cache.
+VECTORIZED_SCENARIOS = 16
+# scenarios parsed at once by `scenario_chunks` from a csv file
+CSV_CHUNK_ROWS = 1000
+
+
+def load_scenarios(path, offset: int = 0, count: int = None) -> np.ndarray:
+    """Read price scenarios of shape (scenarios, days).
+
+    A .npy scenario file written by the spot simulation is memory-mapped, nothing is parsed or copied. Any other file
+    is read as ';' separated csv file with one scenario per row.
+
+    :param path: path to scenario file
+    :param offset: number of scenarios to skip
+    :param count: number of scenarios to read, all remaining if None
+    """
+    if pathlib.Path(path).suffix == scenario_io.SCENARIO_SUFFIX:
+        return scenario_io.open_scenarios(path, offset, count)
+    return np.loadtxt(path, delimiter=';', skiprows=offset, max_rows=count, ndmin=2)
+
+
+def scenario_chunks(path, offset: int = 0, count: int = None):
+    """The scenarios of `load_scenarios` in row chunks, a csv file is parsed chunk by chunk and never held at once.
+
+    :param path: path to scenario file
+    :param offset: number of scenarios to skip
+    :param count: number of scenarios to read, all remaining if None
+    """
+    if pathlib.Path(path).suffix == scenario_io.SCENARIO_SUFFIX:
+        S = scenario_io.open_scenarios(path, offset, count)
+        rows = max(1, scenario_io.MAX_CHUNK_BYTES // max(1, S.shape[1] * S.itemsize))
+        for start in range(0, len(S), rows):
+            yield S[start:start + rows]
+        return
+    with open(path, 'r') as f:
+        lines = itertools.islice(f, offset, None if count is None else offset + count)
+        while True:
+            block = list(itertools.islice(lines, CSV_CHUNK_ROWS))
+            if not block:
+                return
+            yield np.loadtxt(block, delimiter=';', ndmin=2)
+
+
+def date_range(start_date: str, end_date: str) -> np.ndarray:
+    """Days of the valuation horizon, start_date inclusive, end_date exclusive. Format '%Y-%m-%d'."""
+    return calendar_index.valuation_days(start_date, end_date)['dates']
+
+
+def valuation_scenarios(params: dict, offset: int = 0, count: int = None) -> np.ndarray:
+    """Daily price scenarios of the valuation days of params, shape (scenarios, days).
+
+    The header of a .npy scenario file tells where the valuation starts within the scenarios, hourly scenarios are
+    aggregated to daily means. Scenarios without header (csv) start at the first valuation day.
+
+    :param params: storage parameters with 'scenario_file', 'start_date' and 'end_date'
+    :param offset: number of scenarios to skip
+    :param count: number of scenarios to read, all remaining if None
+    """
+    S = load_scenarios(params['scenario_file'], offset, count)
+    columns, steps_per_day = scenario_columns(params, S.shape[1])
+
+    return calendar_index.aggregate_days(S[:, columns], steps_per_day)
+
+
+def scenario_columns(params: dict, available: int = None):
+    """Columns of the scenario file of params that cover the valuation days, and the number of columns per day.
+
+    :param available: number of columns of the scenario file. A file that ends before the valuation horizon raises a
+        ValueError.
+    """
+    days = len(date_range(params['start_date'], params['end_date']))
+    path = params['scenario_file']
+    try:
+        header = scenario_io.read_header(path) if pathlib.Path(path).suffix == scenario_io.SCENARIO_SUFFIX else {}
+    except (OSError, ValueError):
+        header = {}
+    first, steps_per_day = calendar_index.scenario_window(header, params['start_date'])
+    if available is not None and first + days * steps_per_day > available:
+        raise ValueError(f"The scenarios of {path} cover {max(0, available - first) // steps_per_day} days from "
+                         f"{params['start_date']}, the valuation until {params['end_date']} needs {days} days.")
+
+    return slice(first, first + days * steps_per_day), steps_per_day
+
+
+def mean_curve(params: dict) -> np.ndarray:
+    """Mean daily price of the 'use_scenarios' scenarios of params from 'chunk_offset' on, shape (1, days).
+
+    The scenarios are read in row chunks (`scenario_chunks`), the mean curve of a large scenario file, .npy or csv,
+    needs little memory.
+    """
+    total, scenarios = 0., 0
+    for S in scenario_chunks(params['scenario_file'], params.get('chunk_offset', 0), params['use_scenarios']):
+        columns, steps_per_day = scenario_columns(params, S.shape[1])
+        total = total + S[:, columns].sum(axis=0, dtype=np.float64)
+        scenarios += len(S)
+    if not scenarios:
+        raise ValueError(f"No scenarios in {params['scenario_file']} from scenario {params.get('chunk_offset', 0)}.")
+
+    return calendar_index.aggregate_days(total[None, :] / scenarios, steps_per_day)
+
+
+def volume_grid(params: dict, volume_levels: int = 101) -> np.ndarray:
+    """Uniform volume grid between the total min and max volume [MWh].
+
+    The step is never larger than the smallest non-zero daily injection or withdrawal, so every capacity can be
+    reached on the grid.
+    """
+    v_min, v_max = params['total_min_max_volume']
+    capacities = [c * HOURS_PER_DAY for c in (params['einspeicherleistung_min_max'][1],
+                                              params['ausspeicherleistung_min_max'][1]) if c > 0]
+    step = min([(v_max - v_min) / (volume_levels - 1)] + capacities)
+    if step <= 0:
+        return np.array([v_min], dtype=np.float64)
+
+    return v_min + step * np.arange(int(math.floor((v_max - v_min) / step + 1e-9)) + 1)
+
+
+def feasible_offsets(params: dict, step: float, levels: int = None) -> np.ndarray:
+    """Daily volume changes in grid steps that respect the injection and withdrawal capacities. 0 is idle.
+
+    With levels, changes larger than the grid are left out: a capacity above the storage volume does not add moves.
+    """
+    if step <= 0:
+        return np.zeros(1, dtype=np.int64)
+    inject_min, inject_max = (c * HOURS_PER_DAY / step for c in params['einspeicherleistung_min_max'])
+    eject_min, eject_max = (c * HOURS_PER_DAY / step for c in params['ausspeicherleistung_min_max'])
+    if levels is not None:
+        inject_max, eject_max = min(inject_max, levels - 1), min(eject_max, levels - 1)
+    inject = np.arange(max(1, math.ceil(inject_min - 1e-9)), math.floor(inject_max + 1e-9) + 1)
+    eject = np.arange(max(1, math.ceil(eject_min - 1e-9)), math.floor(eject_max + 1e-9) + 1)
+
+    return np.concatenate([-eject[::-1], [0], inject]).astype(np.int64)
+
+
+def reachable_levels(params: dict, grid: np.ndarray, offsets: np.ndarray, days: int):
+    """Lowest and highest grid level that can be occupied at the start of every day, shape (days + 1,) each.
+
+    A level is kept if it can be reached from the initial storage volume and if the end volume range can still be
+    reached from it with the daily injection and withdrawal capacities. Entry `days` is the end volume range.
+    """
+    levels = len(grid)
+    inject, eject = int(offsets.max()), int(-offsets.min())
+    start = int(np.abs(grid - params['initial_storage_volume']).argmin())
+    end_min, end_max = params['vol_min_max_end']
+    end_levels = np.flatnonzero((grid >= end_min - 1e-9) & (grid <= end_max + 1e-9))
+    day = np.arange(days + 1)
+    lower = np.maximum(start - day * eject, 0)
+    upper = np.minimum(start + day * inject, levels - 1)
+    if len(end_levels):
+        lower = np.maximum(lower, end_levels[0] - (days - day) * inject)
+        upper = np.minimum(upper, end_levels[-1] + (days - day) * eject)
+    if len(end_levels) == 0 or (lower > upper).any():
+        # the end volume can not be met: no pruning, the penalty of the terminal values rules the result.
+        logger.warning("The end volume range can not be reached from the initial storage volume.")
+        return np.zeros(days + 1, dtype=np.int64), np.full(days + 1, levels - 1, dtype=np.int64)
+
+    return lower, upper
+
+
+def grid_knots(profile: np.ndarray, tolerance: float, max_gap: int = 8) -> np.ndarray:
+    """Positions of profile that are kept as knots, the levels in between are interpolated linearly.
+
+    A position is dropped where the value function is flat or linear in the volume, i.e. where its second difference
+    is within tolerance times the range of profile. At least every max_gap-th position is kept, so the interpolation
+    error stays below max_gap ** 2 / 8 times that limit.
+
+    :param profile: mean value of every volume level
+    :param tolerance: allowed second difference, relative to the range of profile
+    :param max_gap: largest distance of two knots in grid levels
+    """
+    keep = np.zeros(len(profile), dtype=bool)
+    keep[::max_gap] = True
+    keep[-1:] = True
+    if len(profile) > 2:
+        keep[1:-1] |= np.abs(np.diff(profile, 2)) > tolerance * (profile.max() - profile.min())
+
+    return np.flatnonzero(keep)
+
+
+def nearest_knots(knots: np.ndarray, levels: np.ndarray) -> np.ndarray:
+    """Position in knots of the knot nearest to every level."""
+    right = np.minimum(np.searchsorted(knots, levels), len(knots) - 1)
+    left = np.maximum(right - 1, 0)
+
+    return np.where(levels - knots[left] <= knots[right] - levels, left, right)
+
+
+def basis(prices: np.ndarray, degree: int = 2) -> np.ndarray:
+    """Polynomial regression basis 1, x, x**2, ... of the normalized prices. Shape (scenarios, degree + 1)."""
+    scale = np.abs(prices).mean() or 1.
+    return np.vander(prices / scale, degree + 1, increasing=True)
+
+
+def continuation_values(prices: np.ndarray, values: np.ndarray, degree: int = 2) -> np.ndarray:
+    """Regress the values of all volume levels on the price basis in one batched least-squares solve.
+
+    :param prices: prices of one day, shape (scenarios,)
+    :param values: discounted values of the next day, shape (..., scenarios), e.g. (levels, scenarios)
+    """
+    # the regression always runs in float64, also for float32 value arrays.
+    q, r = np.linalg.qr(basis(prices.astype(np.float64), degree))
+    rows = values.reshape(-1, values.shape[-1])
+    coefficients = np.linalg.lstsq(r, q.T @ rows.T.astype(np.float64), rcond=None)[0]
+    return (q @ (r @ coefficients)).T.reshape(values.shape).astype(values.dtype, copy=False)
+
+
+def terminal_values(params: dict, grid: np.ndarray, prices: np.ndarray, shifts: np.ndarray,
+                    dtype=np.float64) -> np.ndarray:
+    """Values after the last day, shape (shifts, levels, scenarios).
+
+    Levels outside the end volume range are penalized. If the storage value persists ('speicher_wert_besteht'), the
+    remaining volume is worth the last day's (shifted) price.
+    """
+    values = np.zeros((len(shifts), len(grid), len(prices)), dtype=dtype)
+    if params['speicher_wert_besteht']:
+        values += grid[None, :, None] * (prices[None, None, :] + shifts[:, None, None])
+    end_min, end_max = params['vol_min_max_end']
+    values[:, (grid < end_min - 1e-9) | (grid > end_max + 1e-9)] = PENALTY
+
+    return values
+
+
+def price_shifts(params: dict) -> np.ndarray:
+    """Additive price shifts of the valuation: the base run 0 and, in delta mode, up * variation / down * variation."""
+    shifts = [0.]
+    if params.get('run_delta'):
+        shifts += [direction * params['variation'] for direction in (params['up'], params['down']) if direction]
+
+    return np.asarray(shifts, dtype=np.float64)
+
+
+def best_decisions(continuation: np.ndarray, values: np.ndarray, cash_flows: np.ndarray, knots: np.ndarray,
+                   offsets: np.ndarray, tomorrow: slice):
+    """Best volume change of the levels knots for all shifts and scenarios at once, and its realized value.
+
+    The offsets are compared on a (shifts, knots, offsets, scenarios) array of candidates, so the decision of a day
+    takes a few array operations whatever the number of shifts and offsets. This is the fast way for a few
+    scenarios, e.g. the mean curve of 'means_only'. Ties go to the first offset, as in `decisions_by_offset`.
+
+    :param continuation: regressed values of tomorrow, shape (shifts, levels, scenarios)
+    :param values: realized values of tomorrow, same shape
+    :param cash_flows: cash flow of every offset, shape (shifts, offsets, scenarios)
+    :param knots: levels decided on today
+    :param offsets: feasible volume changes in grid levels
+    :param tomorrow: levels occupied tomorrow, a move must end on one of them
+    :return: (index of the best offset, realized value), shape (shifts, knots, scenarios) each. Knots without a
+        feasible move get PENALTY.
+    """
+    target = knots[:, None] + offsets[None, :]
+    feasible = (target >= tomorrow.start) & (target < tomorrow.stop)
+    target = target.clip(tomorrow.start, tomorrow.stop - 1)
+    candidates = np.take(continuation, target, axis=1)
+    candidates += cash_flows[:, None]
+    candidates += np.where(feasible, 0., -np.inf)[None, :, :, None]
+    choice = candidates.argmax(axis=2)
+    shift = np.arange(len(values))[:, None, None]
+    scenario = np.arange(values.shape[-1])
+    realized = (values[shift, target[np.arange(len(knots))[:, None], choice], scenario]
+                + cash_flows[shift, choice, scenario])
+    realized[:, ~feasible.any(axis=1)] = PENALTY
+
+    return choice, realized
+
+
+def decisions_by_offset(continuation: np.ndarray, values: np.ndarray, cash_flows: np.ndarray, knots: np.ndarray,
+                        offsets: np.ndarray, tomorrow: slice, best: np.ndarray, realized: np.ndarray,
+                        choice: np.ndarray = None) -> None:
+    """Best volume change of the levels knots, shift by shift and offset by offset, see `best_decisions`.
+
+    The realized value of the best offset is written to realized and, if given, its index to choice (zeros on
+    entry), shape (shifts, knots, scenarios) each. best is work space of the same shape.
+    """
+    best.fill(-np.inf)
+    # a level without any feasible decision keeps the penalty.
+    realized.fill(PENALTY)
+    for b in range(len(values)):
+        for k, offset in enumerate(offsets):
+            # level knots[source] moves to level knots[source] + offset, which must be occupied tomorrow.
+            source = slice(np.searchsorted(knots, tomorrow.start - offset),
+                           np.searchsorted(knots, tomorrow.stop - offset))
+            if source.start >= source.stop:
+                continue
+            target = knots[source] + offset
+            if target[-1] - target[0] == len(target) - 1:
+                target = slice(target[0], target[-1] + 1)
+            candidate = continuation[b, target] + cash_flows[b, k]
+            better = candidate > best[b, source]
+            np.maximum(best[b, source], candidate, out=best[b, source])
+            # realized = realized * ~better + new * better: masked arithmetic is much faster than
+            # copyto(where=...) and exact, also next to PENALTY values.
+            update = values[b, target] + cash_flows[b, k]
+            update *= better
+            realized[b, source] *= ~better
+            realized[b, source] += update
+            if choice is not None:
+                choice[b, source] += better * (k - choice[b, source])
+
+
+def mean_and_error(values: np.ndarray):
+    """Mean over the scenarios and its standard error."""
+    error = values.std(ddof=1) / math.sqrt(len(values)) if len(values) > 1 else 0.
+    return float(values.mean()), float(error)
+
+
+def value_storage(params: dict, S: np.ndarray, volume_levels: int = 101, degree: int = 2) -> dict:
+    """Value the storage on the price scenarios S by backward induction.
+
+    In delta mode ('run_delta') the prices shifted up and down by 'variation' are valued in the same backward pass on
+    the same scenarios (common random numbers). A constant shift does not change the space spanned by the polynomial
+    basis, so the base day basis and its QR decomposition serve all shifts in one solve. Only the regression is
+    shared: every shift takes its own decisions, which dominate the run time, so a delta run costs about three base
+    runs (3.3 times on 1000 scenarios of 365 days).
+
+    With 'adaptive_grid' only the volume levels that are reachable from the initial volume and can still reach the
+    end volume range are valued each day, and where the value function is linear in the volume within
+    'grid_tolerance', only a few levels are decided on and the others are interpolated.
+
+    With 'checkpoint_dir' the state of the backward induction is stored every `checkpoint.CHECKPOINT_SECONDS`, a
+    valuation of the same chunk continues from the last stored day.
+
+    :param params: storage parameters as built by `prepare_parameters`
+    :param S: daily price scenarios of shape (scenarios, days)
+    :param volume_levels: maximal number of volume grid levels
+    :param degree: degree of the regression polynomial
+    """
+    grid = volume_grid(params, volume_levels)
+    step = grid[1] - grid[0] if len(grid) > 1 else 0.
+    offsets = feasible_offsets(params, step, len(grid))
+    step_discount = calendar_index.valuation_days(params['start_date'], params['end_date'],
+                                                  params['interest_rate'])['step_discount']
+    shifts = price_shifts(params)
+    num_scenarios, days = S.shape
+    levels = len(grid)
+    shape = (len(shifts), levels, num_scenarios)
+    # 'float32' keeps the price scenarios compact. The value grids, cash flows and regressions stay in float64: the
+    # values of the shifted runs are differenced for the delta, float32 rounding would dominate the difference.
+    dtype = np.dtype(params.get('precision', 'float64'))
+    adaptive = params.get('adaptive_grid', False)
+    if adaptive:
+        lower, upper = reachable_levels(params, grid, offsets, days)
+    else:
+        lower, upper = np.zeros(days + 1, dtype=np.int64), np.full(days + 1, levels - 1)
+
+    # all value arrays have the shape (shifts, levels, scenarios), so that a volume level is one contiguous row.
+    # rows outside the levels occupied on a day are never read.
+    with profiling.stage('scenario_load', scenarios=num_scenarios):
+        prices_by_day = np.ascontiguousarray(S.T, dtype=dtype)
+    values = terminal_values(params, grid, prices_by_day[-1].astype(np.float64), shifts)
+    continuation = np.empty(shape)
+    best = np.empty(shape)
+    realized = np.empty(shape)
+    # volume change [MWh] of every offset and the costs added to the price, injections pay the price plus the
+    # injection costs, withdrawals earn the price minus the withdrawal costs.
+    volumes = -offsets * step
+    costs = np.where(offsets > 0, params['inject_costs'], -params['eject_costs'])
+    computed_levels = 0
+    first_day = days - 1
+    checkpoint_dir, chunk_index = params.get('checkpoint_dir'), params.get('chunk_index', 0)
+    state = checkpoint.load_state(checkpoint_dir, chunk_index)
+    if state is not None and state['values'].shape == shape and state['values'].dtype == np.float64:
+        values, first_day, computed_levels = state['values'], state['day'] - 1, state['computed_levels']
+        logger.info(f"Backward induction resumed from the checkpoint at day {state['day']} of {days}.")
+    last_checkpoint = time.perf_counter()
+    # the regression of every day is timed, but logged once as one record with count and maximum.
+    regression_total, regression_max = 0., 0.
+    backward_start = time.perf_counter()
+    for day in range(first_day, -1, -1):
+        prices = prices_by_day[day].astype(np.float64)
+        shifted_prices = prices[None, :] + shifts[:, None]
+        # levels occupied today and tomorrow
+        today = slice(lower[day], upper[day] + 1)
+        tomorrow = slice(lower[day + 1], upper[day + 1] + 1)
+        values[:, tomorrow] *= step_discount[day]
+        regression_start = time.perf_counter()
+        continuation[:, tomorrow] = continuation_values(prices, values[:, tomorrow], degree)
+        regression_seconds = time.perf_counter() - regression_start
+        regression_total += regression_seconds
+        regression_max = max(regression_max, regression_seconds)
+        knots = np.arange(today.start, today.stop)
+        if adaptive and params.get('grid_tolerance', 0.) > 0:
+            # tomorrow's value function decides where today's grid can be coarse. Levels from which not every
+            # move ends on a level occupied tomorrow are always decided on.
+            is_knot = np.ones(levels, dtype=bool)
+            is_knot[tomorrow.start - offsets.min():tomorrow.stop - offsets.max()] = False
+            is_knot[tomorrow.start + grid_knots(values[0, tomorrow].mean(axis=-1, dtype=np.float64),
+                                                params['grid_tolerance'])] = True
+            is_knot[today.start] = True
+            knots = knots[is_knot[today]]
+        computed_levels += len(knots)
+        coarse = len(knots) < today.stop - today.start
+        # cash flow of every shift, offset and scenario
+        cash_flows = volumes[None, :, None] * (shifted_prices[:, None, :] + costs[None, :, None])
+        if num_scenarios <= VECTORIZED_SCENARIOS:
+            choice, realized_knots = best_decisions(continuation, values, cash_flows, knots, offsets, tomorrow)
+        elif coarse:
+            realized_knots = np.empty((len(shifts), len(knots), num_scenarios))
+            choice = np.zeros(realized_knots.shape, dtype=np.intp)
+            decisions_by_offset(continuation, values, cash_flows, knots, offsets, tomorrow,
+                                np.empty_like(realized_knots), realized_knots, choice)
+        else:
+            realized_knots = realized[:, today]
+            decisions_by_offset(continuation, values, cash_flows, knots, offsets, tomorrow, best[:, today],
+                                realized_knots)
+        if coarse:
+            # the other levels take the decision of the nearest knot, their cash flows stay exact.
+            rest = np.setdiff1d(np.arange(today.start, today.stop), knots)
+            chosen = choice[:, nearest_knots(knots, rest)]
+            shift = np.arange(len(shifts))[:, None, None]
+            scenario = np.arange(num_scenarios)
+            realized[:, rest] = (values[shift, rest[:, None] + offsets[chosen], scenario]
+                                 + cash_flows[shift, chosen, scenario])
+            realized[:, knots] = realized_knots
+        elif num_scenarios <= VECTORIZED_SCENARIOS:
+            realized[:, today] = realized_knots
+        values, realized = realized, values
+        if checkpoint_dir is not None and time.perf_counter() - last_checkpoint > checkpoint.CHECKPOINT_SECONDS:
+            with profiling.stage('checkpoint'):
+                checkpoint.save_state(checkpoint_dir, chunk_index,
+                                      {'day': day, 'values': values, 'computed_levels': computed_levels})
+            last_checkpoint = time.perf_counter()
+    profiling.record('regression', regression_total, count=days, max_seconds=regression_max)
+    profiling.record('decisions', time.perf_counter() - backward_start - regression_total)
+
+    start = int(np.abs(grid - params['initial_storage_volume']).argmin())
+    start_values = values[:, start]
+    start_values = start_values.astype(np.float64)
+    result = {'use_scenarios': num_scenarios, 'volume_levels': levels,
+              'computed_levels': computed_levels / days if days else 0.}
+    result['value'], result['std_error'] = mean_and_error(start_values[0])
+    if len(shifts) > 1:
+        for shift, shifted_values in zip(shifts[1:], start_values[1:]):
+            direction = 'up' if shift > 0 else 'down'
+            result[f'value_{direction}'], result[f'std_error_{direction}'] = mean_and_error(shifted_values)
+        # pathwise finite difference on common random numbers
+        high, low = start_values[shifts.argmax()], start_values[shifts.argmin()]
+        result['delta'], result['delta_std_error'] = mean_and_error((high - low) / (shifts.max() - shifts.min()))
+    if params.get('show_statistics'):
+        # pathwise values of the base run, only collected when they are shown
+        result['scenario_values'] = start_values[0]
+    logger.info({key: value for key, value in result.items() if key != 'scenario_values'})
+
+    return result
+
+
+def value_mean_curve(params: dict) -> dict:
+    """Indicative storage value on the mean forward curve of the scenarios, the fast path of 'means_only'.
+
+    The backward induction runs on the single mean price curve instead of every scenario. Without price uncertainty
+    the decisions are perfect, the result is the intrinsic value of the storage (and its delta in delta mode), without
+    a standard error. The full scenario valuation is never run.
+    """
+    with profiling.stage('mean_curve', scenarios=params['use_scenarios']):
+        curve = mean_curve(params)
+    result = value_storage(dict(params, show_statistics=False), curve)
+    result['use_scenarios'] = params['use_scenarios']
+    result['means_only'] = True
+
+    return result
+
+
+def value_statistics(values: np.ndarray) -> dict:
+    """Distribution of the pathwise storage values: mean, standard deviation and percentiles."""
+    percentiles = (0, 5, 25, 50, 75, 95, 100)
+    statistics = {'mean': float(values.mean()), 'std': float(values.std(ddof=1)) if len(values) > 1 else 0.}
+    statistics.update({f'p{p}': float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))})
+
+    return statistics
+
+
+def memory_footprint(params: dict, scenarios: int, days: int, volume_levels: int = 101) -> int:
+    """Bytes one worker needs to value `scenarios` scenarios: prices plus the value grids and regression temporaries."""
+    itemsize = np.dtype(params.get('precision', 'float64')).itemsize
+    levels = len(volume_grid(params, volume_levels))
+    grid_values = len(price_shifts(params)) * levels * scenarios
+    # prices in the working precision. values, realized, best, continuation and the regression copy of values are
+    # always float64.
+    return scenarios * days * itemsize + grid_values * 5 * 8
@@ -0,0 +1,115 @@
+"""Per-stage timing and optional cProfile output of simulation runs.
+
+Every stage (csv load, path generation, regression, export, ...) is timed with `stage` and logged as one json record
+to the loguru log. The records of a job are gathered by a `collector` around the code of the job: it holds only the
+records of its own thread (context), so jobs running in threads of the same process, the GUI and its background
+threads do not see each other's records. The workers send theirs back with the chunk results, and `summarize` turns
+all records of a run into a short table for the GUI. Records outside of a collector are only logged.
+"""
+import contextlib
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pathlib
+import time
+
+from loguru import logger
+
+# records of the running job of this thread or context, None outside of a `collector`
+_records = contextvars.ContextVar('profiling_records', default=None)
+
+
+def record(name: str, seconds: float, **fields) -> dict:
+    """Store and log the timing of one stage. fields are added to the json record, e.g. count=365."""
+    entry = {'stage': name, 'seconds': round(seconds, 6), 'pid': os.getpid()}
+    entry.update(fields)
+    records = _records.get()
+    if records is not None:
+        records.append(entry)
+    logger.info(json.dumps(entry, default=str))
+
+    return entry
+
+
+@contextlib.contextmanager
+def stage(name: str, **fields):
+    """Time the body of the with statement as stage `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, **fields)
+
+
+@contextlib.contextmanager
+def collector():
+    """Gather the records of the with body in the yielded list, e.g. the records of one chunk of a job.
+
+    Collectors nest, a record goes to the innermost one only.
+    """
+    records = []
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+
+def collect_timings(worker):
+    """Decorator of worker functions: the records of the call are returned under 'timings' of the result dict."""
+    @functools.wraps(worker)
+    def wrapper(params: dict):
+        with collector() as records:
+            result = worker(params)
+        result['timings'] = records
+        return result
+
+    return wrapper
+
+
+def summarize(records: list) -> str:
+    """Total, count and maximum seconds of every stage, slowest stage first."""
+    stages = {}
+    for entry in records:
+        total, count, longest = stages.get(entry['stage'], (0., 0, 0.))
+        steps = entry.get('count', 1)
+        stages[entry['stage']] = (total + entry['seconds'], count + steps,
+                                  max(longest, entry.get('max_seconds', entry['seconds'])))
+    lines = [f"{'stage':<20}{'total [s]':>12}{'count':>8}{'max [s]':>12}"]
+    for name, (total, count, longest) in sorted(stages.items(), key=lambda item: -item[1][0]):
+        lines.append(f"{name:<20}{total:>12.3f}{count:>8}{longest:>12.4f}")
+
+    return "\n".join(lines)
+
+
+def format_bytes(size: float) -> str:
+    """Human readable size, e.g. 1.5 GB."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def profile_if_requested(worker):
+    """Decorator of worker functions: with params['profile'] the call runs under cProfile.
+
+    The statistics are written to profile_<worker>_<chunk index>.prof in params['export_path'], e.g. for snakeviz or
+    `python -m pstats`.
+    """
+    @functools.wraps(worker)
+    def wrapper(params: dict):
+        if not params.get('profile'):
+            return worker(params)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(worker, params)
+        finally:
+            path = pathlib.Path(params.get('export_path') or '.').joinpath(
+                f"profile_{worker.__name__}_{params.get('chunk_index', 0)}.prof")
+            profiler.dump_stats(path)
+            logger.info(f"Profile written to {path}.")
+
+    return wrapper
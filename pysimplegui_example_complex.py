@@ -1,17 +1,34 @@
+# imported first, the startup timing starts with it
+import startup
 import multiprocessing
+import os
 import sys
 import json
 import pathlib
-import decimal
+import typing
 
 from loguru import logger
 import PySimpleGUI as sg
 
-decimal.getcontext().prec = 6
+import checkpoint
+import log_view
+import profiling
+import settings_store
+
+# imported on first use or in the background once the window is shown, see startup.py
+job_runner = startup.LazyModule('job_runner')
+lsm_engine = startup.LazyModule('lsm_engine')
+result_cache = startup.LazyModule('result_cache')
+scenario_io = startup.LazyModule('scenario_io')
+batch_run = startup.LazyModule('batch_run')
+job_server = startup.LazyModule('job_server')
+PRELOAD_MODULES = ('numpy', 'job_runner', 'lsm_engine', 'result_cache', 'scenario_io', 'job_server')
+# read once, the main window is rebuilt after every change of the settings
+LOGO = "./logo.png"
 
-logger.add(pathlib.Path(r".\my_log_path.log"), mode="w")
 sg.theme('DarkGreen4')
-sg.user_settings_filename("my_gui_settings.json", pathlib.Path(__file__).parent)
+# values of the main window, written by save_user_settings()
+USER_SETTINGS_FILE = pathlib.Path(__file__).parent.joinpath("my_gui_settings.json")
 
 # SETTINGS
 current_path = pathlib.Path(sys.executable)
@@ -19,6 +36,12 @@ SETTINGS_FILE_PATH = current_path.joinpath(current_path.parent, r'settings_file.
 DEFAULT_SETTINGS = {'path_power': None, 'path_gas': None
                     , 'export_path_power': None
                     , 'export_path_gas': None
+                    , 'profile_runs': False
+                    , 'precision': 'float64'
+                    , 'adaptive_grid': False
+                    , 'grid_tolerance': 1e-4
+                    , 'job_server': ''
+                    , 'job_priority': 0
                     }
 # "Map" from the settings dictionary keys to the window's element keys
 SETTINGS_KEYS_TO_ELEMENT_KEYS = dict.fromkeys(DEFAULT_SETTINGS)
@@ -26,6 +49,135 @@ SETTINGS_KEYS_TO_ELEMENT_KEYS['path_power'] = '-PATH_POWER-'
 SETTINGS_KEYS_TO_ELEMENT_KEYS['path_gas'] = '-PATH_GAS-'
 SETTINGS_KEYS_TO_ELEMENT_KEYS['export_path_power'] = '-EXPORT_PATH_POWER-'
 SETTINGS_KEYS_TO_ELEMENT_KEYS['export_path_gas'] = '-EXPORT_PATH_GAS-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['profile_runs'] = '-PROFILE_RUNS-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['precision'] = '-PRECISION-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['adaptive_grid'] = '-ADAPTIVE_GRID-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['grid_tolerance'] = '-GRID_TOLERANCE-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['job_server'] = '-JOB_SERVER-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['job_priority'] = '-JOB_PRIORITY-'
+# float32 halves the memory of the price scenarios, the valuation itself runs in float64
+PRECISIONS = ('float64', 'float32')
+# choices of the settings shown as drop down list
+COMBO_CHOICES = {'precision': PRECISIONS}
+# day count of the interest rate p.a., calendar_index.INTEREST_DAYS of the valuation
+INTEREST_DAYS = 360
+
+
+def to_float(text: str) -> float:
+    """float of a window input, ',' is accepted as decimal separator."""
+    return float(text.replace(",", "."))
+
+
+def daily_rate(rate_percent: float) -> float:
+    """Daily interest rate of the rate p.a. in percent, like calendar_index.daily_rate.
+
+    Computed here: the window is built before calendar_index and numpy are imported, see startup.py.
+    """
+    return rate_percent / 100 / INTEREST_DAYS
+
+
+def calculate_arbeit(leistung: str) -> str:
+    # check if leistung exists. Might be empty if user deletes input that creates 'leistung'.
+    if leistung:
+        leistung = leistung.replace(",", ".")
+        # try converting leistung to float. Might fail if user tries to type non-valid characters that are passed here
+        # from the coller.
+        try:
+            return str(int(float(leistung) * 24))
+        except ValueError:
+            pass
+
+
+def calculate_ir_per_day(ir: str) -> str:
+    try:
+        ir_per_day = daily_rate(to_float(ir or '0'))
+    except ValueError:
+        return None
+
+    return f"{100 * ir_per_day:.4f}%"
+
+
+class Field(typing.NamedTuple):
+    """One element of the main window.
+
+    kind is 'float', 'int', 'date', 'choice' (drop down) or 'derived' (computed from the field `source`). setting is
+    the key in the user settings, param the key in the storage parameters, (key, index) for min/max lists.
+    """
+    label: str
+    kind: str
+    frame: str
+    setting: str = None
+    param: object = None
+    unit: str = ''
+    choices: tuple = ()
+    convert: typing.Callable = None
+    source: str = None
+    compute: typing.Callable = None
+    size: tuple = (10, 1)
+
+
+YES_NO = ('Yes', 'No')
+# all fields of the main window, in layout order. Layout, user settings and parameters are generated from it.
+FIELDS = {
+    '-IR-': Field('interest rate p.a. (in %)', 'float', 'rates', 'interest_rate', 'interest_rate',
+                  convert=lambda text: daily_rate(to_float(text))),
+    '-IR_PA-': Field('interest rate p.a.:', 'derived', 'rates', source='-IR-', compute=calculate_ir_per_day,
+                     size=(8, 1)),
+    '-CAL_START-': Field('Start Date', 'date', 'data', 'start_date', 'start_date'),
+    '-CAL_END-': Field('End Date ', 'date', 'data', 'end_date', 'end_date'),
+    '-NUM_SCENARIOS-': Field('Number of Scenarios', 'int', 'data', 'num_scenarios', 'use_scenarios'),
+    '-TOT_VOL_MIN-': Field('Total Volume (min)', 'float', 'volumes', 'tot_vol_min', ('total_min_max_volume', 0), 'MWh'),
+    '-TOT_VOL_MAX-': Field('Total Volume (max)', 'float', 'volumes', 'tot_vol_max', ('total_min_max_volume', 1), 'MWh'),
+    '-VOL_START_MIN-': Field('Volume Start (min)', 'float', 'volumes', 'vol_start_min', ('vol_min_max_start', 0),
+                             'MWh'),
+    '-VOL_START_MAX-': Field('Volume Start (max)', 'float', 'volumes', 'vol_start_max', ('vol_min_max_start', 1),
+                             'MWh'),
+    '-VOL_END_MIN-': Field('Volume End (min)', 'float', 'volumes', 'vol_end_min', ('vol_min_max_end', 0), 'MWh'),
+    '-VOL_END_MAX-': Field('Volume End (max)', 'float', 'volumes', 'vol_end_max', ('vol_min_max_end', 1), 'MWh'),
+    '-INIT_VOL-': Field('Initial Storage Volume', 'float', 'volumes', 'init_vol', 'initial_storage_volume', 'MWh'),
+    '-EIN_L_MIN-': Field('Einspeicherleistung (min)', 'float', 'capacities', 'einspeicher_leistung_min',
+                         ('einspeicherleistung_min_max', 0), 'MW'),
+    '-EIN_L_MAX-': Field('Einspeicherleistung (max)', 'float', 'capacities', 'einspeicher_leistung_max',
+                         ('einspeicherleistung_min_max', 1), 'MW'),
+    '-AUS_L_MIN-': Field('Ausspeicherleistung (min)', 'float', 'capacities', 'ausspeicher_leistung_min',
+                         ('ausspeicherleistung_min_max', 0), 'MW'),
+    '-AUS_L_MAX-': Field('Ausspeicherleistung (max)', 'float', 'capacities', 'ausspeicher_leistung_max',
+                         ('ausspeicherleistung_min_max', 1), 'MW'),
+    '-EIN_A_MIN-': Field('Einspeicherarbeit (min)', 'derived', 'energy', unit='MWh', source='-EIN_L_MIN-',
+                         compute=calculate_arbeit),
+    '-EIN_A_MAX-': Field('Einspeicherarbeit (max)', 'derived', 'energy', unit='MWh', source='-EIN_L_MAX-',
+                         compute=calculate_arbeit),
+    '-AUS_A_MIN-': Field('Ausspeicherarbeit (min)', 'derived', 'energy', unit='MWh', source='-AUS_L_MIN-',
+                         compute=calculate_arbeit),
+    '-AUS_A_MAX-': Field('Ausspeicherarbeit (max)', 'derived', 'energy', unit='MWh', source='-AUS_L_MAX-',
+                         compute=calculate_arbeit),
+    '-INJ_COSTS-': Field('Inject Costs', 'float', 'costs', 'inject_costs', 'inject_costs', '€/MWh'),
+    '-EJ_COSTS-': Field('Eject Costs', 'float', 'costs', 'eject_costs', 'eject_costs', '€/MWh'),
+    '-SPEICHERWERT-': Field('Speicherwert Besteht?', 'choice', 'costs', 'speicherwert', 'speicher_wert_besteht',
+                            choices=YES_NO, size=None),
+    '-RUN_DELTA-': Field('Run Delta Calculation?', 'choice', 'delta', 'run_delta', 'run_delta', choices=YES_NO,
+                         size=None),
+    '-VARIATION-': Field('Price Variation', 'float', 'delta', 'variation', 'variation', '€/MWh'),
+    # the parameters 'up' and 'down' are built in prepare_parameters()
+    '-ACTION-': Field('UP/DOWN MODE', 'choice', 'delta', 'action', choices=('UP&DOWN', )),
+    '-MEANS_ONLY-': Field('Calculate Means Only?', 'choice', 'misc', 'means_only', 'means_only', choices=YES_NO,
+                          size=None),
+    '-SHOW_STATISTICS-': Field('Show Statistics', 'choice', 'misc', 'show_statistics', 'show_statistics',
+                               choices=YES_NO, size=None),
+}
+# characters accepted while typing into a field
+ALLOWED_CHARACTERS = {'float': '0123456789.,', 'int': '0123456789'}
+CONVERSIONS = {'float': to_float, 'int': int, 'date': str, 'choice': lambda text: text == 'Yes'}
+# key of a field -> keys of the fields derived from it
+DERIVED_FIELDS = {}
+for _key, _field in FIELDS.items():
+    if _field.kind == 'derived':
+        DERIVED_FIELDS.setdefault(_field.source, []).append(_key)
+
+
+def user_setting(key: str, default=None):
+    """Value of the main window saved by save_user_settings()."""
+    return settings_store.get_store(USER_SETTINGS_FILE).get(key, default)
 
 
 def load_settings(settings_file: str, default_settings: dict):
@@ -49,9 +201,10 @@ def save_settings(settings_file: str, settings: dict, values: list):
             except Exception as e:
                 print(f'Problem updating settings from window values. Key = {key}')
 
-    with open(settings_file, 'w') as f:
-        json.dump(settings, f)
-
+    # written in the background, the window does not wait for the (network) drive.
+    if not settings_store.get_store(settings_file).update(settings):
+        print("Global settings unchanged.")
+        return
     print("Saving global settings successful.")
     logger.info("Saving global settings successful.")
 
@@ -64,8 +217,6 @@ def report_an_error(dummy) -> None:
 @logger.catch(onerror=report_an_error)
 def prepare_parameters(value: dict, settings) -> dict:
     """"""
-    # create function that first converts "," to ".
-    float_ = lambda x: float(x.replace(",", "."))
     if value["-GAS-"]:
         import_path_spot_prices = settings["path_gas"]
         import_path = pathlib.Path(import_path_spot_prices)
@@ -74,28 +225,31 @@ def prepare_parameters(value: dict, settings) -> dict:
         import_path_spot_prices = settings["path_power"]
         import_path = pathlib.Path(import_path_spot_prices)
         export_path = settings["export_path_power"]
-
-    params = {'interest_rate': float_(value['-IR-']) / 36000,
-              'start_date': value['-CAL_START-'],
-              'end_date': value['-CAL_END-'],
-              'use_scenarios': int(value['-NUM_SCENARIOS-']),
-              'initial_storage_volume': float_(value['-INIT_VOL-']),
-              'speicher_wert_besteht': True if value['-SPEICHERWERT-'] == 'Yes' else False,
-              'ausspeicherleistung_min_max': [float_(value['-AUS_L_MIN-']), float_(value['-AUS_L_MAX-'])],
-              'einspeicherleistung_min_max': [float_(value['-EIN_L_MIN-']), float_(value['-EIN_L_MAX-'])],
-              'total_min_max_volume': [float_(value['-TOT_VOL_MIN-']), float_(value['-TOT_VOL_MAX-'])],
-              'vol_min_max_start': [float_(value['-VOL_START_MIN-']), float_(value['-VOL_START_MAX-'])],
-              'vol_min_max_end': [float_(value['-VOL_END_MIN-']), float_(value['-VOL_END_MAX-'])],
-              'inject_costs': float_(value['-INJ_COSTS-']),
-              'eject_costs': float_(value['-EJ_COSTS-']),
-              'run_delta': True if value['-RUN_DELTA-'] == 'Yes' else False,
-              'variation': float_(value['-VARIATION-']),
-              'up': 1 if 'UP' in value['-ACTION-'] else 0,  # to activate up direction set value to 1
-              'down': -1 if 'DOWN' in value['-ACTION-'] else 0,  # to activate down direction set value to -1
-              'means_only': True if value['-MEANS_ONLY-'] == 'Yes' else False,
-              'show_statistics': True if value['-SHOW_STATISTICS-'] == 'Yes' else False,
-              'export_path': export_path,
-              }
+    # binary scenario file (or shared memory block) of the spot simulation, older csv exports are still supported.
+    scenario_file = import_path.joinpath("spot_price_simulation.npy")
+    if not scenario_io.exists(scenario_file):
+        scenario_file = scenario_file.with_suffix(".csv")
+
+    params = {}
+    for key, field in FIELDS.items():
+        if field.param is None:
+            continue
+        converted = (field.convert or CONVERSIONS[field.kind])(value[key])
+        if isinstance(field.param, tuple):
+            name, index = field.param
+            params.setdefault(name, [None, None])[index] = converted
+        else:
+            params[field.param] = converted
+    params.update({'up': 1 if 'UP' in value['-ACTION-'] else 0,  # to activate up direction set value to 1
+                   'down': -1 if 'DOWN' in value['-ACTION-'] else 0,  # to activate down direction set value to -1
+                   'export_path': export_path,
+                   'scenario_file': scenario_file,
+                   'profile': bool(settings.get('profile_runs', False)),
+                   'precision': settings.get('precision', 'float64'),
+                   # value only the reachable volume levels, coarse where the value function is linear
+                   'adaptive_grid': bool(settings.get('adaptive_grid', False)),
+                   'grid_tolerance': to_float(str(settings.get('grid_tolerance', 1e-4))),
+                   })
 
     return params
 
@@ -129,129 +283,126 @@ def check_assertions(params: dict) -> bool:
 
 
 @logger.catch(onerror=report_an_error)
-def run(params):
-    """"""
+def run(window: sg.Window, params: dict, server: str = None, priority: int = 0) -> 'job_runner.Job':
+    """Start the storage valuation in the worker pool. Progress and results are sent to window as events.
+
+    Every worker values the storage on its own share of the scenarios, the job result is their weighted mean.
+    Returns None if the result is taken from the result cache, the DONE event is sent right away in that case.
+    With server ('host:port') the valuation is queued on the job server instead, see job_server.py.
+    """
     params_without_S = params.copy()
     params_without_S.update({'S': 'removed from log.'})
     params_without_S.update({'date_range': 'removed from log.'})
     logger.info(params_without_S)
+    if server:
+        return job_server.submit(window, 'lsm', params, server, priority)
+    cache_key = result_cache.make_key('lsm', params)
+    # a profiled run is never answered from the cache.
+    cached = None if params.get('profile') else result_cache.get(cache_key)
+    if cached is not None:
+        window.write_event_value(job_runner.DONE_EVENT, cached)
+        return None
+    if params['means_only']:
+        # indicative quote on the mean price curve, in a thread of this process: no worker start, no checkpoints.
+        return job_runner.start_job(window, job_runner.value_storage_chunk, params, 'use_scenarios',
+                                    combine=job_runner.combine_storage_chunks, chunks_per_worker=1,
+                                    cache_key=cache_key, in_process=True)
+    workers = os.cpu_count() or 1
+    days = len(lsm_engine.date_range(params['start_date'], params['end_date']))
+    footprint = workers * lsm_engine.memory_footprint(params, -(-params['use_scenarios'] // workers), days)
+    print(f"Memory ({params['precision']}): {profiling.format_bytes(footprint)} RAM on {workers} workers")
+    # finished chunks and the backward induction state are checkpointed, a rerun with the same parameters resumes.
+    checkpoint_dir = checkpoint.run_dir(params['export_path'], cache_key)
+    if checkpoint.exists(checkpoint_dir):
+        print("Resuming the valuation from the checkpoint of an earlier run.")
+    # one chunk per worker: the regression of every chunk should see as many scenarios as possible.
+    return job_runner.start_job(window, job_runner.value_storage_chunk, params, 'use_scenarios',
+                                combine=job_runner.combine_storage_chunks, chunks_per_worker=1, cache_key=cache_key,
+                                checkpoint_dir=checkpoint_dir)
+
+
+@logger.catch(onerror=report_an_error)
+def load_portfolio(path, params: dict) -> list:
+    """Storage parameters of every contract of the portfolio file path.
+
+    The file (json or yaml, see batch_run.load_runs) lists the contracts. Every contract changes some parameters of
+    the main window, e.g. [{"name": "Storage A", "initial_storage_volume": 500}, ...], the scenarios are shared.
+    """
+    return [{**params, 'name': entry.get('name', f"Contract {index + 1}"), **entry}
+            for index, entry in enumerate(batch_run.load_runs(path))]
+
+
+@logger.catch(onerror=report_an_error)
+def run_portfolio(window: sg.Window, contracts: list, server: str = None, priority: int = 0) -> 'job_runner.Job':
+    """Start the valuation of all contracts in one worker pool, see run(). Returns None for a cached result."""
+    logger.info(f"Portfolio: {', '.join(str(contract['name']) for contract in contracts)}")
+    if server:
+        return job_server.submit(window, 'portfolio', {'contracts': contracts}, server, priority)
+    cache_key = result_cache.make_key('portfolio', {'contracts': [result_cache.make_key('lsm', contract)
+                                                                  for contract in contracts]})
+    cached = None if any(contract.get('profile') for contract in contracts) else result_cache.get(cache_key)
+    if cached is not None:
+        window.write_event_value(job_runner.DONE_EVENT, cached)
+        return None
+    checkpoint_dir = checkpoint.run_dir(contracts[0]['export_path'], cache_key)
+    if checkpoint.exists(checkpoint_dir):
+        print("Resuming the portfolio from the checkpoint of an earlier run.")
+    return job_runner.start_portfolio_job(window, contracts, cache_key=cache_key, checkpoint_dir=checkpoint_dir)
 
 
 start_lsm = "Start LSM"
+cancel_lsm = "Cancel"
+portfolio = "Portfolio"
+
+
+def field_rows(frame: str) -> list:
+    """Layout rows of the fields of frame, filled with the saved user settings."""
+    rows = []
+    for key, field in FIELDS.items():
+        if field.frame != frame:
+            continue
+        label = f"{field.label} [{field.unit}]" if field.unit else field.label
+        size = {'size': field.size} if field.size else {}
+        if field.kind == 'date':
+            rows.append([sg.CalendarButton(label, target=key, format='%Y-%m-%d', begin_at_sunday_plus=1),
+                         sg.Input(user_setting(field.setting, ''), key=key, **size)])
+        elif field.kind == 'choice':
+            rows.append([sg.Text(label), sg.DropDown(field.choices, default_value=user_setting(field.setting),
+                                                     key=key, **size)])
+        elif field.kind == 'derived':
+            source = FIELDS[field.source]
+            rows.append([sg.Text(label), sg.Text(field.compute(user_setting(source.setting, '')) or '', key=key,
+                                                 enable_events=True, **size)])
+        else:
+            rows.append([sg.Text(label), sg.Input(user_setting(field.setting, ''), key=key, enable_events=True,
+                                                  **size)])
+
+    return rows
 
 
 # Create main window
 def create_main_window() -> sg.Window:
     """"""
-    # Layout the design of the GUI
-    frame_data_layout = [
-        [sg.CalendarButton('Start Date',
-                           target='-CAL_START-',
-                           format='%Y-%m-%d',
-                           begin_at_sunday_plus=1),
-         sg.Input(sg.user_settings_get_entry('start_date', ''), key='-CAL_START-', size=(10, 1))],
-        [sg.CalendarButton('End Date ',
-                           target='-CAL_END-',
-                           format='%Y-%m-%d',
-                           begin_at_sunday_plus=1),
-         sg.Input(sg.user_settings_get_entry('end_date', ''), key='-CAL_END-', size=(10, 1))],
-        [sg.Text('Number of Scenarios'), sg.Input(sg.user_settings_get_entry('num_scenarios', ''),
-                                                  key='-NUM_SCENARIOS-',
-                                                  enable_events=True
-                                                  , size=(10, 1))],
-    ]
-
-    mwh_objects_1 = [
-        [sg.Text('Total Volume (min) [MWh]'),
-         sg.Input(sg.user_settings_get_entry('tot_vol_min', ''), key='-TOT_VOL_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Total Volume (max) [MWh]'),
-         sg.Input(sg.user_settings_get_entry('tot_vol_max', ''), key='-TOT_VOL_MAX-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Volume Start (min) [MWh]'),
-         sg.Input(sg.user_settings_get_entry('vol_start_min', ''), key='-VOL_START_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Volume Start (max) [MWh]'),
-         sg.Input(sg.user_settings_get_entry('vol_start_max', ''), key='-VOL_START_MAX-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Volume End (min) [MWh]'),
-         sg.Input(sg.user_settings_get_entry('vol_end_min', ''), key='-VOL_END_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Volume End (max) [MWh]'),
-         sg.Input(sg.user_settings_get_entry('vol_end_max', ''), key='-VOL_END_MAX-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Initial Storage Volume [MWh]'),
-         sg.Input(sg.user_settings_get_entry('init_vol', ''), key='-INIT_VOL-', enable_events=True, size=(10, 1))],
-        ]
-    mw_objects = [
-        [sg.Text('Einspeicherleistung (min) [MW]'),
-         sg.Input(sg.user_settings_get_entry('einspeicher_leistung_min', ''), key='-EIN_L_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Einspeicherleistung (max) [MW]'),
-         sg.Input(sg.user_settings_get_entry('einspeicher_leistung_max', ''), key='-EIN_L_MAX-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Ausspeicherleistung (min) [MW]'),
-         sg.Input(sg.user_settings_get_entry('ausspeicher_leistung_min', ''), key='-AUS_L_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Ausspeicherleistung (max) [MW]'),
-         sg.Input(sg.user_settings_get_entry('ausspeicher_leistung_max', ''), key='-AUS_L_MAX-', enable_events=True,
-                  size=(10, 1))],
-        ]
-    mwh_objects_2 = [
-        [sg.Text('Einspeicherarbeit (min) [MWh]'),
-         sg.Text(sg.user_settings_get_entry('einspeicher_arbeit_min', ''), key='-EIN_A_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Einspeicherarbeit (max) [MWh]'),
-         sg.Text(sg.user_settings_get_entry('einspeicher_arbeit_max', ''), key='-EIN_A_MAX-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Ausspeicherarbeit (min) [MWh]'),
-         sg.Text(sg.user_settings_get_entry('ausspeicher_arbeit_min', ''), key='-AUS_A_MIN-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Ausspeicherarbeit (max) [MWh]'),
-         sg.Text(sg.user_settings_get_entry('ausspeicher_arbeit_max', ''), key='-AUS_A_MAX-', enable_events=True,
-                  size=(10, 1))],
-        ]
-    misc_objects = [
-        [sg.Text('Inject Costs [€/MWh]'),
-         sg.Input(sg.user_settings_get_entry('inject_costs', ''), key='-INJ_COSTS-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Eject Costs [€/MWh]'),
-         sg.Input(sg.user_settings_get_entry('eject_costs', ''), key='-EJ_COSTS-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('Speicherwert Besteht?', ),
-         sg.DropDown(('Yes', 'No'), default_value=sg.user_settings_get_entry('speicherwert'), key='-SPEICHERWERT-')],
-    ]
-
-    delta_calculation_frame = [
-        [sg.Text('Run Delta Calculation?'),
-         sg.DropDown(('Yes', 'No'), default_value=sg.user_settings_get_entry('run_delta'), key='-RUN_DELTA-')],
-        [sg.Text('Price Variation [€/MWh]'),
-         sg.Input(sg.user_settings_get_entry('variation', ''), key='-VARIATION-', enable_events=True,
-                  size=(10, 1))],
-        [sg.Text('UP/DOWN MODE'),
-         sg.DropDown(('UP&DOWN', ), key='-ACTION-', default_value=sg.user_settings_get_entry('action'),
-                     size=(10, 1))],
-    ]
-
-    misc_frame = [
-        [sg.Text('Calculate Means Only?'),
-         sg.DropDown(('Yes', 'No'), key='-MEANS_ONLY-', default_value=sg.user_settings_get_entry('means_only'))],
-        [sg.Text('Show Statistics'),
-         sg.DropDown(('Yes', 'No'), key='-SHOW_STATISTICS-',
-                     default_value=sg.user_settings_get_entry('show_statistics'))],
-    ]
+    # Layout the design of the GUI, the rows are generated from FIELDS
+    frame_data_layout = field_rows('data')
+    mwh_objects_1 = field_rows('volumes')
+    mw_objects = field_rows('capacities')
+    mwh_objects_2 = field_rows('energy')
+    misc_objects = field_rows('costs')
+    delta_calculation_frame = field_rows('delta')
+    misc_frame = field_rows('misc')
     frame_layout = [
         [sg.Radio('Gas', 'RADIO1', default=True, key='-GAS-'), sg.Radio('Power', 'RADIO1', key='-POWER-')],
-        [sg.Text('interest rate p.a. (in %)'),
-         sg.Input(sg.user_settings_get_entry('interest_rate', ''), key='-IR-', enable_events=True, size=(10, 1))],
-        [sg.Text('interest rate p.a.:'), sg.Text("", key='-IR_PA-', enable_events=True, size=(8, 1))],
+        *field_rows('rates'),
         [sg.Frame('Data Info', frame_data_layout)],
         [sg.Frame('Volumes', mwh_objects_1, element_justification="right")],
     ]
     right_frame_layout = [
         [sg.Frame('Delta Calculation Parameters', delta_calculation_frame, element_justification="right")],
         [sg.Frame('Misc Settings', misc_frame, element_justification="right")],
-        [sg.Button(start_lsm, disabled=True), sg.Quit(), sg.B('Save'), sg.B('Settings')],
+        [sg.Button(start_lsm), sg.Button(cancel_lsm, disabled=True), sg.B(portfolio), sg.Quit(),
+         sg.B('Save'), sg.B('Settings')],
+        [sg.ProgressBar(1, orientation='h', size=(20, 10), key='-PROGRESS-')],
     ]
     width, height = sg.Window.get_screen_size()
     window_width, window_height, output_height = round(0.77 * width), round(0.75 * height), round(0.15 * height)
@@ -264,11 +415,11 @@ def create_main_window() -> sg.Window:
                 [sg.Frame('Costs', misc_objects, element_justification="right")],
                 ]),
             sg.Column([
-                [sg.Image(filename="./logo.png", size=(260, 260))],
+                [sg.Image(data=startup.image_data(LOGO), size=(260, 260))],
                 [sg.Frame('User Inputs', right_frame_layout)],
             ]),
         ],
-        [sg.Output(size=(window_width, output_height), key='-LOG-', echo_stdout_stderr=True, font="Any 8")],
+        [log_view.log_element(size=(window_width, output_height))],
     ]
     # Show the Window to the user
     window = sg.Window('Simulation Tool', layout, size=(window_width, window_height), font="Any 11")
@@ -285,6 +436,11 @@ def create_settings_window(settings):
         if object_type == 'text':
             return text_label_object
 
+        if object_type == 'checkbox':
+            return [text_label_object, sg.Checkbox('', key=d[text])]
+        if object_type == 'combo':
+            return [text_label_object, sg.Combo(COMBO_CHOICES[text], key=d[text], readonly=True)]
+
         input_object = sg.Input(key=d[text])
         if object_type == 'folder':
             return [text_label_object, input_object, sg.FolderBrowse(target=d[text])]
@@ -296,6 +452,13 @@ def create_settings_window(settings):
               TextLabel("path_gas", "folder"),
               TextLabel('export_path_power', "folder"),
               TextLabel('export_path_gas', "folder"),
+              TextLabel('precision', 'combo'),
+              TextLabel('adaptive_grid', "checkbox"),
+              TextLabel('grid_tolerance'),
+              TextLabel('profile_runs', "checkbox"),
+              # host:port of a job server (job_server.py), empty: value on this computer
+              TextLabel('job_server'),
+              TextLabel('job_priority'),
               [sg.Button('Save Settings'), sg.Button('OK')]]
 
     window = sg.Window('Settings', layout, keep_on_top=True, finalize=True)
@@ -310,121 +473,145 @@ def create_settings_window(settings):
 
 
 def save_user_settings(value):
-    """Default path for json-file is documented here: https://github.com/PySimpleGUI/PySimpleGUI/issues/3371
-    On Windows this is the default path: \\user\\username\\AppData\\Local\\PySimpleGUI\\settings"""
-    sg.user_settings_set_entry('interest_rate', value['-IR-'])
-    sg.user_settings_set_entry('start_date', value['-CAL_START-'])
-    sg.user_settings_set_entry('end_date', value['-CAL_END-'])
-    sg.user_settings_set_entry('num_scenarios', value['-NUM_SCENARIOS-'])
-    sg.user_settings_set_entry('init_vol', value['-INIT_VOL-'])
-    sg.user_settings_set_entry('speicherwert', value['-SPEICHERWERT-'])
-    sg.user_settings_set_entry('ausspeicher_leistung_min', value['-AUS_L_MIN-'])
-    sg.user_settings_set_entry('ausspeicher_leistung_max', value['-AUS_L_MAX-'])
-    sg.user_settings_set_entry('einspeicher_leistung_min', value['-EIN_L_MIN-'])
-    sg.user_settings_set_entry('einspeicher_leistung_max', value['-EIN_L_MAX-'])
-    sg.user_settings_set_entry('tot_vol_min', value['-TOT_VOL_MIN-'])
-    sg.user_settings_set_entry('tot_vol_max', value['-TOT_VOL_MAX-'])
-    sg.user_settings_set_entry('vol_start_min', value['-VOL_START_MIN-'])
-    sg.user_settings_set_entry('vol_start_max', value['-VOL_START_MAX-'])
-    sg.user_settings_set_entry('vol_end_min', value['-VOL_END_MIN-'])
-    sg.user_settings_set_entry('vol_end_max', value['-VOL_END_MAX-'])
-    sg.user_settings_set_entry('inject_costs', value['-INJ_COSTS-'])
-    sg.user_settings_set_entry('eject_costs', value['-EJ_COSTS-'])
-    sg.user_settings_set_entry('run_delta', value['-RUN_DELTA-'])
-    sg.user_settings_set_entry('variation', value['-VARIATION-'])
-    sg.user_settings_set_entry('action', value['-ACTION-'])
-    sg.user_settings_set_entry('means_only', value['-MEANS_ONLY-'])
-    sg.user_settings_set_entry('show_statistics', value['-SHOW_STATISTICS-'])
+    """Save the values of the main window to USER_SETTINGS_FILE, all keys in one background write."""
+    changed = settings_store.get_store(USER_SETTINGS_FILE).update(
+        {field.setting: value[key] for key, field in FIELDS.items() if field.setting is not None})
+    if not changed:
+        print("User settings unchanged.")
+        return None
     print("Saving user settings successful.")
     logger.info("Saving user settings successful.")
 
     return None
 
 
-def check_float(window, event, value, key):
-    if event == key and value[key] and value[key][-1] not in '0123456789.,':
+def validate_field(window, key: str, value: dict) -> None:
+    """Remove a character that is not allowed in the field key, as it is typed."""
+    allowed = ALLOWED_CHARACTERS.get(FIELDS[key].kind)
+    if allowed and value[key] and value[key][-1] not in allowed:
         window[key].update(value[key][:-1])
 
 
-def check_int(window, event, value, key):
-    if event == key and value[key] and value[key][-1] not in '0123456789':
-        window[key].update(value[key][:-1])
-
-
-def calculate_arbeit(leistung: str) -> str:
-    # check if leistung exists. Might be empty if user deletes input that creates 'leistung'.
-    if leistung:
-        leistung = leistung.replace(",", ".")
-        # try converting leistung to float. Might fail if user tries to type non-valid characters that are passed here
-        # from the coller.
-        try:
-            return str(int(float(leistung) * 24))
-        except ValueError:
-            pass
+def update_derived(window, value: dict, keys) -> None:
+    """Recompute the derived fields keys from the current values of their sources."""
+    for key in keys:
+        field = FIELDS[key]
+        window[key].update(field.compute(value[field.source]))
 
 
 def main():
     # Event loop. Read buttons, make callbacks
+    # print() goes to the log element of the window, see log_view.py
+    log = log_view.install()
     window, settings = None, load_settings(SETTINGS_FILE_PATH, DEFAULT_SETTINGS)
+    job = None
+    startup.mark('imports')
+    # the splash is shown while the first window is built, the engine modules are imported once the window is shown.
+    splash = startup.show_splash('Simulation Tool', LOGO)
+    window = create_main_window()
+    window.finalize()
+    splash.close()
+    startup.mark('window')
+    startup.preload(window, PRELOAD_MODULES)
     while True:
         # Read the Window
         if window is None:
             window = create_main_window()
-        event, value = window.read()
+        event, value = window.read(timeout=log_view.FLUSH_MILLISECONDS)
+        # prints of the last interval are shown in one update, not one Tk update per print.
+        log.flush_to(window)
+        if event == sg.TIMEOUT_KEY:
+            continue
         if event in ('Quit', sg.WIN_CLOSED):
+            if job is not None:
+                job.cancel()
             break
+        if event == startup.PRELOAD_EVENT:
+            print(value[event])
+        if event == cancel_lsm and job is not None:
+            job.cancel()
+            print("Cancelling calculation...")
+        if event == job_runner.PROGRESS_EVENT:
+            finished, total = value[event]
+            window['-PROGRESS-'].update(current_count=finished, max=total)
+        if event == job_server.QUEUED_EVENT:
+            print(f"Job server: {value[event]} jobs ahead." if value[event] else "Job server: calculation started.")
+        if event in (job_runner.DONE_EVENT, job_runner.CANCELLED_EVENT, job_runner.ERROR_EVENT):
+            job = None
+            window[cancel_lsm].update(disabled=True)
+            window[start_lsm].update(disabled=False)
+        if event == job_runner.CANCELLED_EVENT:
+            window['-PROGRESS-'].update(current_count=0)
+            print("Calculation cancelled.")
+        if event == job_runner.ERROR_EVENT:
+            report_an_error(value[event])
+        if event == job_runner.DONE_EVENT:
+            result = value[event]
+            for contract in result.get('contracts', ()):
+                print(f"{contract['name']}: {contract['value']:,.2f} € "
+                      f"(standard error {contract['std_error']:,.2f} €, {contract['use_scenarios']} scenarios)")
+            if 'contracts' in result:
+                print(f"Portfolio value: {result['value']:,.2f} € "
+                      f"(standard error at most {result['std_error']:,.2f} €, {len(result['contracts'])} contracts)")
+            elif result.get('means_only'):
+                print(f"Intrinsic storage value on the mean curve of {result['use_scenarios']} scenarios: "
+                      f"{result['value']:,.2f} €")
+            else:
+                print(f"Storage value: {result['value']:,.2f} € (standard error {result['std_error']:,.2f} €, "
+                      f"{result['use_scenarios']} scenarios)")
+            if 'delta' in result:
+                print(f"Delta: {result['delta']:,.2f} MWh (standard error {result['delta_std_error']:,.2f} MWh)")
+            if 'statistics' in result:
+                print("Scenario values [€]: " + ", ".join(f"{name} {number:,.0f}"
+                                                          for name, number in result['statistics'].items()))
+            print(profiling.summarize(result.get('timings', [])))
+            print("Calculation finished.")
         if event == 'Settings':
             event, settings_value = create_settings_window(settings).read(close=True)
             if event == 'Save Settings':
                 window.close()
                 window = None
                 save_settings(SETTINGS_FILE_PATH, settings, settings_value)
-        # check if initial prices are of type float
-        check_int(window, event, value, '-NUM_SCENARIOS-')
-        check_float(window, event, value, '-TOT_VOL_MIN-')
-        check_float(window, event, value, '-TOT_VOL_MAX-')
-        check_float(window, event, value, '-INIT_VOL-')
-        check_float(window, event, value, '-AUS_L_MIN-')
-        if event in ('-AUS_L_MIN-', 'Save', start_lsm):
-            arbeit = calculate_arbeit(value['-AUS_L_MIN-'])
-            window['-AUS_A_MIN-'].update(arbeit)
-        check_float(window, event, value, '-AUS_L_MAX-')
-        if event in ('-AUS_L_MAX-', 'Save', start_lsm):
-            arbeit = calculate_arbeit(value['-AUS_L_MAX-'])
-            window['-AUS_A_MAX-'].update(arbeit)
-        check_float(window, event, value, '-EIN_L_MIN-')
-        if event in ('-EIN_L_MIN-', 'Save', start_lsm):
-            arbeit = calculate_arbeit(value['-EIN_L_MIN-'])
-            window['-EIN_A_MIN-'].update(arbeit)
-        check_float(window, event, value, '-EIN_L_MAX-')
-        if event in ('-EIN_L_MAX-', 'Save', start_lsm):
-            arbeit = calculate_arbeit(value['-EIN_L_MAX-'])
-            window['-EIN_A_MAX-'].update(arbeit)
-        check_float(window, event, value, '-VOL_START_MIN-')
-        check_float(window, event, value, '-VOL_START_MAX-')
-        check_float(window, event, value, '-VOL_END_MIN-')
-        check_float(window, event, value, '-VOL_END_MAX-')
-        check_float(window, event, value, '-INJ_COSTS-')
-        check_float(window, event, value, '-EJ_COSTS-')
-        check_float(window, event, value, '-VARIATION-')
-        check_float(window, event, value, '-IR-')
-        ir = value['-IR-'].replace(",", ".")
-        if not ir:
-            ir = '0.'
-        ir_per_annum = decimal.Decimal(ir) / 360
-        ir_percent = str(round(ir_per_annum.normalize(), 4)) + '%'
+        # only the field of the event is validated and only the fields derived from it are recomputed.
+        if event in FIELDS:
+            validate_field(window, event, value)
+            update_derived(window, value, DERIVED_FIELDS.get(event, ()))
+        if event in ('Save', start_lsm, portfolio):
+            update_derived(window, value, [key for keys in DERIVED_FIELDS.values() for key in keys])
         if event == 'Save':
-            window["-IR_PA-"].update(ir_percent)
             save_user_settings(value)
-        if event == start_lsm:
-            window["-IR_PA-"].update(ir_percent)
+        if event in (start_lsm, portfolio) and job is not None:
+            print("A calculation is already running.")
+        elif event in (start_lsm, portfolio):
             params = prepare_parameters(value, settings)
-            if check_assertions(params):
-                run(params)
-            print("Calculation finished.")
+            if event == start_lsm:
+                if check_assertions(params):
+                    job = run(window, params, settings.get('job_server'), settings.get('job_priority', 0))
+            else:
+                path = sg.popup_get_file("Contracts of the portfolio",
+                                         file_types=(("json / yaml", "*.json *.yaml *.yml"),))
+                contracts = load_portfolio(path, params) if path else None
+                if contracts and all(check_assertions(contract) for contract in contracts):
+                    job = run_portfolio(window, contracts, settings.get('job_server'),
+                                        settings.get('job_priority', 0))
+            if job is not None:
+                window['-PROGRESS-'].update(current_count=0)
+                window[cancel_lsm].update(disabled=False)
+                window[start_lsm].update(disabled=True)
 
     window.close()
+    # the last saves may still wait for their background write
+    settings_store.flush_all()
+    # csv scenarios of the portfolio valuation
+    if 'scenario_io' in sys.modules:
+        scenario_io.release_shared()
 
 
 if __name__ == '__main__':
+    # the worker processes import this module again. Only the GUI process may open the log file with mode="w".
+    multiprocessing.freeze_support()
+    # enqueue: the log file is written by a background thread, logging never waits for the disk.
+    logger.add(pathlib.Path(r".\my_log_path.log"), mode="w", enqueue=True)
     main()
+    # writes the queued messages
+    logger.remove()
@@ -1,3 +1,7 @@
+# imported first, the startup timing starts with it
+import startup
+import multiprocessing
+import os
 import sys
 import json
 import pathlib
@@ -5,13 +9,29 @@ import pathlib
 from loguru import logger
 import PySimpleGUI as sg
 
-logger.add(pathlib.Path(r".\mein_log_pfad.log"), mode="w")
+import checkpoint
+import log_view
+import profiling
+import settings_store
+import volatility
+
+# imported on first use or in the background once the window is shown, see startup.py
+job_runner = startup.LazyModule('job_runner')
+result_cache = startup.LazyModule('result_cache')
+reuters_export = startup.LazyModule('reuters_export')
+scenario_io = startup.LazyModule('scenario_io')
+spot_simulation = startup.LazyModule('spot_simulation')
+job_server = startup.LazyModule('job_server')
+PRELOAD_MODULES = ('numpy', 'job_runner', 'result_cache', 'scenario_io', 'spot_simulation', 'reuters_export',
+                   'job_server')
+
 sg.theme('DarkGreen4')
 
 # SETTINGS
 current_path = pathlib.Path(sys.executable)
 SETTINGS_FILE_PATH = current_path.joinpath(current_path.parent, r'settings_file.json')
-sg.user_settings_filename("./my_gui_settings.json")
+# values of the main window, written by save_user_settings()
+USER_SETTINGS_FILE = pathlib.Path("./my_gui_settings.json")
 DEFAULT_SETTINGS = {'path_power': None, 'path_gas': None, 'time_step': 1, 'annualization_factor': 250,
                     'jump_distance_factor': 3
                     , 'TermPrices_YEAR.csv': None
@@ -20,6 +40,12 @@ DEFAULT_SETTINGS = {'path_power': None, 'path_gas': None, 'time_step': 1, 'annua
                     , 'month_prices.csv': None
                     , 'export_path_power': None
                     , 'export_path_gas': None
+                    , 'profile_runs': False
+                    , 'precision': 'float64'
+                    , 'variance_reduction': 'none'
+                    , 'shared_memory': False
+                    , 'job_server': ''
+                    , 'job_priority': 0
                     }
 
 # "Map" from the settings dictionary keys to the window's element keys
@@ -36,6 +62,21 @@ SETTINGS_KEYS_TO_ELEMENT_KEYS['actual_spot_prices.csv'] = '-ACTUAL_SPOT_PRICES-'
 SETTINGS_KEYS_TO_ELEMENT_KEYS['month_prices.csv'] = '-MONTH_PRICES-'
 SETTINGS_KEYS_TO_ELEMENT_KEYS['export_path_power'] = '-EXPORT_PATH_POWER-'
 SETTINGS_KEYS_TO_ELEMENT_KEYS['export_path_gas'] = '-EXPORT_PATH_GAS-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['profile_runs'] = '-PROFILE_RUNS-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['precision'] = '-PRECISION-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['variance_reduction'] = '-VARIANCE_REDUCTION-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['shared_memory'] = '-SHARED_MEMORY-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['job_server'] = '-JOB_SERVER-'
+SETTINGS_KEYS_TO_ELEMENT_KEYS['job_priority'] = '-JOB_PRIORITY-'
+# float32 halves the memory of price scenarios and value grids
+PRECISIONS = ('float64', 'float32')
+# choices of the settings shown as drop down list, the engine modules are only imported when the list is shown
+COMBO_CHOICES = {'precision': lambda: PRECISIONS, 'variance_reduction': lambda: spot_simulation.VARIANCE_REDUCTION}
+
+
+def user_setting(key: str, default=None):
+    """Value of the main window saved by save_user_settings()."""
+    return settings_store.get_store(USER_SETTINGS_FILE).get(key, default)
 
 
 def load_settings(settings_file: str, default_settings: dict):
@@ -59,9 +100,10 @@ def save_settings(settings_file: str, settings: dict, values: list):
             except Exception as e:
                 print(f'Problem updating settings from window values. Key = {key}')
 
-    with open(settings_file, 'w') as f:
-        json.dump(settings, f)
-
+    # written in the background, the window does not wait for the (network) drive.
+    if not settings_store.get_store(settings_file).update(settings):
+        print("Global settings unchanged.")
+        return
     print("Saving global settings successful.")
     logger.info("Saving global settings successful.")
 
@@ -75,6 +117,11 @@ def create_settings_window(settings):
         if object_type == 'text':
             return text_label_object
 
+        if object_type == 'checkbox':
+            return [text_label_object, sg.Checkbox('', key=d[text])]
+        if object_type == 'combo':
+            return [text_label_object, sg.Combo(COMBO_CHOICES[text](), key=d[text], readonly=True)]
+
         input_object = sg.Input(key=d[text])
         if object_type == 'folder':
             return [text_label_object, input_object, sg.FolderBrowse(target=d[text])]
@@ -87,6 +134,8 @@ def create_settings_window(settings):
               TextLabel("path_gas", "folder"),
               TextLabel('time_step'),
               TextLabel('annualization_factor'),
+              TextLabel('precision', 'combo'),
+              TextLabel('variance_reduction', 'combo'),
               TextLabel('jump_distance_factor'),
               TextLabel('TermPrices_YEAR.csv'),
               TextLabel('month_factors_mr.csv'),
@@ -94,6 +143,12 @@ def create_settings_window(settings):
               TextLabel('month_prices.csv'),
               TextLabel('export_path_power', "folder"),
               TextLabel('export_path_gas', "folder"),
+              TextLabel('profile_runs', "checkbox"),
+              # the scenarios stay in memory while this window is open, the storage tool reads them from there.
+              TextLabel('shared_memory', "checkbox"),
+              # host:port of a job server (job_server.py), empty: simulate on this computer
+              TextLabel('job_server'),
+              TextLabel('job_priority'),
               [sg.Button('Save Settings'), sg.Button('OK')]]
 
     window = sg.Window('Settings', layout, keep_on_top=True, finalize=True)
@@ -120,13 +175,46 @@ def update_volatility(json_path: str) -> dict:
 
 
 @logger.catch(onerror=report_an_error)
-def run(params):
-    """"""
+def run(window: sg.Window, params: dict, server: str = None, priority: int = 0) -> 'job_runner.Job':
+    """Start the spot price simulation in the worker pool. Progress and results are sent to window as events.
+
+    Returns None if the result is taken from the result cache, the DONE event is sent right away in that case.
+    With server ('host:port') the simulation is queued on the job server instead, see job_server.py.
+    """
     logger.info(params)
-    # callback function here.
+    if server:
+        return job_server.submit(window, 'spot', params, server, priority)
+    cache_key = result_cache.make_key('spot', params)
+    # a profiled run is never answered from the cache.
+    cached = None if params.get('profile') else result_cache.get(cache_key)
+    # the cached result is only valid together with the scenario file written by the same run.
+    if cached is not None and scenario_io.has_cache_key(params['spot_price_simulation'], cache_key):
+        window.write_event_value(job_runner.DONE_EVENT, cached)
+        return None
+    # the chunks of an earlier, crashed or cancelled run with the same parameters are kept together with their rows.
+    checkpoint_dir = checkpoint.run_dir(pathlib.Path(params['spot_price_simulation']).parent, cache_key)
+    resume = checkpoint.exists(checkpoint_dir) and scenario_io.has_cache_key(params['spot_price_simulation'],
+                                                                            cache_key)
+    if resume:
+        print("Resuming the simulation from the checkpoint of an earlier run.")
+    else:
+        checkpoint.clear(checkpoint_dir)
+    # csv load and calibration run here, their timings are reported together with the ones of the workers.
+    with profiling.collector() as preparation:
+        params = spot_simulation.prepare_run(dict(params, cache_key=cache_key), resume=resume)
+    footprint = spot_simulation.memory_footprint(params['num_sim'], len(params['model']['level']),
+                                                 params['precision'], os.cpu_count() or 1,
+                                                 params['variance_reduction'])
+    location = "in shared memory" if params.get('shared_memory') else "on disk"
+    print(f"Memory ({params['precision']}): scenario file {profiling.format_bytes(footprint['scenario_file'])} "
+          f"{location}, workers {profiling.format_bytes(footprint['workers'])} RAM")
+    return job_runner.start_job(window, job_runner.simulate_spot_chunk, params, 'num_sim',
+                                combine=job_runner.combine_spot_chunks, cache_key=cache_key,
+                                checkpoint_dir=checkpoint_dir, timings=preparation)
 
 
 start_simulation = "Start Simulation"
+cancel_simulation = "Cancel"
 
 
 # Create main window
@@ -135,39 +223,43 @@ def create_main_window() -> sg.Window:
     # Layout the design of the GUI
     frame_years_layout = [
         [sg.Text('Year 0 (€/MWh)'),
-         sg.Input(sg.user_settings_get_entry('year0', ''), key='-YEAR0-', enable_events=True, size=(10, 1))],
+         sg.Input(user_setting('year0', ''), key='-YEAR0-', enable_events=True, size=(10, 1))],
         [sg.Text('Year 1 (€/MWh)'),
-         sg.Input(sg.user_settings_get_entry('year1', ''), key='-YEAR1-', enable_events=True, size=(10, 1))],
+         sg.Input(user_setting('year1', ''), key='-YEAR1-', enable_events=True, size=(10, 1))],
         [sg.Text('Year 2 (€/MWh)'),
-         sg.Input(sg.user_settings_get_entry('year2', ''), key='-YEAR2-', enable_events=True, size=(10, 1))],
+         sg.Input(user_setting('year2', ''), key='-YEAR2-', enable_events=True, size=(10, 1))],
 
     ]
 
     frame_layout = [
-        [sg.B('Export CSV from Reuters', key="-CREATE-CSV-", button_color=("white", "green"), disabled=True)],
-        [sg.Radio('Gas', 'RADIO1', default=sg.user_settings_get_entry('gas', True), key='-GAS-'),
-         sg.Radio('Power', 'RADIO1', default=sg.user_settings_get_entry('power', False), key='-POWER-')],
+        [sg.B('Export CSV from Reuters', key="-CREATE-CSV-", button_color=("white", "green"))],
+        [sg.Radio('Gas', 'RADIO1', default=user_setting('gas', True), key='-GAS-', enable_events=True),
+         sg.Radio('Power', 'RADIO1', default=user_setting('power', False), key='-POWER-',
+                  enable_events=True)],
         [sg.CalendarButton('Start Date',
                            target='-CAL-',
                            format='%d.%m.%Y',
                            locale='de_DE',
                            begin_at_sunday_plus=1),
-         sg.Input(sg.user_settings_get_entry('start_date', ''), key='-CAL-', size=(10, 1))],
+         sg.Input(user_setting('start_date', ''), key='-CAL-', size=(10, 1))],
         [sg.Text('Years to Future'),
-         sg.DropDown((1, 2), default_value=sg.user_settings_get_entry('years_to_future', 2), key='-DD1-')],
+         sg.DropDown((1, 2), default_value=user_setting('years_to_future', 2), key='-DD1-')],
         [sg.Text('Reference Year'), sg.DropDown(('initial year', 'initial year + 1'),
-                                                default_value=sg.user_settings_get_entry('reference_year',
+                                                default_value=user_setting('reference_year',
                                                                                          'initial year + 1'),
                                                 key='-DD2-', size=(12, 1), )],
         [sg.Frame('Initial Prices', frame_years_layout)],
-        [sg.Text('Number of Simulations'), sg.Input(sg.user_settings_get_entry('num_sim', ''),
+        [sg.Text('Number of Simulations'), sg.Input(user_setting('num_sim', ''),
                                                     key='-NUM_SIM-',
                                                     enable_events=True
                                                     , size=(10, 1))],
         [sg.Text('Year Volatility:'), sg.Text("", key='-year_vola-', enable_events=True, size=(8, 1))],
         [sg.Text('Spot Volatility w/ Jumps:'), sg.Text("", key='-spot_vola_w_jumps-', enable_events=True, size=(8, 1))],
         [sg.Text('Spot Volatility w/o Jumps:'),
-         sg.Text("", key='-year_vola_wo_jumps-', enable_events=True, size=(8, 1))]
+         sg.Text("", key='-year_vola_wo_jumps-', enable_events=True, size=(8, 1))],
+        [sg.ProgressBar(1, orientation='h', size=(20, 10), key='-PROGRESS-')],
+        [sg.Button(start_simulation), sg.Button(cancel_simulation, disabled=True), sg.Quit(), sg.B('Save'),
+         sg.B('Settings')],
     ]
     width, height = sg.Window.get_screen_size()
     # window_width, window_height, output_height = round(0.3 * width), round(0.56 * height), round(0.07 * height)
@@ -182,7 +274,7 @@ def create_main_window() -> sg.Window:
 
         ],
 
-        [sg.Output(size=(window_width, output_height), key='-LOG-', echo_stdout_stderr=True, font="Any 8")],
+        [log_view.log_element(size=(window_width, output_height))],
     ]
     # Show the Window to the user
     window = sg.Window('Simulation Tool', layout, size=(window_width, window_height), font="Any 11", )
@@ -191,15 +283,20 @@ def create_main_window() -> sg.Window:
 
 
 def save_user_settings(value):
-    sg.user_settings_set_entry('gas', value['-GAS-'])
-    sg.user_settings_set_entry('power', value['-POWER-'])
-    sg.user_settings_set_entry('years_to_future', value['-DD1-'])
-    sg.user_settings_set_entry('reference_year', value['-DD2-'])
-    sg.user_settings_set_entry('year0', value['-YEAR0-'])
-    sg.user_settings_set_entry('year1', value['-YEAR1-'])
-    sg.user_settings_set_entry('year2', value['-YEAR2-'])
-    sg.user_settings_set_entry('num_sim', value['-NUM_SIM-'])
-    sg.user_settings_set_entry('start_date', value['-CAL-'])
+    changed = settings_store.get_store(USER_SETTINGS_FILE).update({
+        'gas': value['-GAS-'],
+        'power': value['-POWER-'],
+        'years_to_future': value['-DD1-'],
+        'reference_year': value['-DD2-'],
+        'year0': value['-YEAR0-'],
+        'year1': value['-YEAR1-'],
+        'year2': value['-YEAR2-'],
+        'num_sim': value['-NUM_SIM-'],
+        'start_date': value['-CAL-'],
+    })
+    if not changed:
+        print("User settings unchanged.")
+        return None
     print("Saving user settings successful.")
     logger.info("Saving user settings successful.")
 
@@ -212,32 +309,124 @@ def format_vola(vola: float):
     return str(vola) + '%'
 
 
-@logger.catch(onerror=report_an_error)
-def export_reuters_csv(settings: dict) -> None:
-    """Create csv-files from main excel sheet.
+def export_reuters_csv(settings: dict) -> str:
+    """Create csv-files from main excel sheet. Runs in a worker thread, returns the error message or None.
+
+    The error is shown by the event loop, a popup must not be opened outside the main thread.
 
     :param settings: dictionary containing settings values
     """
-    reuters_path = pathlib.Path(settings["path_reuters"])
-    export_path_gas = settings["path_gas"]
-    print(f"INFO - actual_spot_prices.csv was successfully created at {export_path_gas}")
+    try:
+        reuters_path = reuters_export.find_workbook(settings["path_reuters"])
+        export_paths = {'gas': settings["path_gas"], 'power': settings["path_power"]}
+        for csv_path in reuters_export.export_workbook(reuters_path, export_paths):
+            print(f"INFO - {csv_path.name} was successfully created at {csv_path.parent}")
+    except Exception as e:
+        logger.exception(e)
+        return str(e)
+    print("Reuters export finished.")
 
     return None
 
 
+def show_volatility(window: sg.Window, json_path: pathlib.Path) -> None:
+    volatilities = update_volatility(json_path)
+    anualized_vola, jump_vola, no_jump_vola = map(format_vola,
+                                                  [volatilities["vola"], volatilities["jump_vola"],
+                                                   volatilities["no_jumps_vola"]])
+    window["-year_vola-"].update(anualized_vola)
+    window["-spot_vola_w_jumps-"].update(jump_vola)
+    window["-year_vola_wo_jumps-"].update(no_jump_vola)
+
+
+@logger.catch(onerror=report_an_error)
+def show_current_volatility(window: sg.Window, settings: dict, gas: bool) -> None:
+    """Show the volatilities of the gas or power input files as soon as the settings are loaded.
+
+    Only prices appended since the last update are read, see `volatility.update`.
+    """
+    import_path = settings["path_gas" if gas else "path_power"]
+    if not import_path or not settings.get("actual_spot_prices.csv") or not settings.get("TermPrices_YEAR.csv"):
+        return
+    path = pathlib.Path(import_path)
+    params = {"actual_spot_prices": path.joinpath(settings["actual_spot_prices.csv"]),
+              "term_prices": path.joinpath(settings["TermPrices_YEAR.csv"]),
+              "jump_distance": int(settings["jump_distance_factor"]),
+              "t": int(settings["time_step"]), "m": int(settings["annualization_factor"]),
+              "export_path": path,
+              }
+    if params["actual_spot_prices"].is_file() and params["term_prices"].is_file():
+        volatility.update(params)
+        show_volatility(window, path.joinpath(volatility.VOLATILITY_FILE))
+
+
 def main():
+    # print() goes to the log element of the window, see log_view.py
+    log = log_view.install()
     window, settings = None, load_settings(SETTINGS_FILE_PATH, DEFAULT_SETTINGS)
+    job, job_export_path = None, None
+    startup.mark('imports')
+    # the splash is shown while the first window is built, the engine modules are imported once the window is shown.
+    splash = startup.show_splash('Simulation Tool')
+    window = create_main_window()
+    window.finalize()
+    splash.close()
+    startup.mark('window')
+    startup.preload(window, PRELOAD_MODULES)
+    show_current_volatility(window, settings, window['-GAS-'].get())
     # Event loop. Read buttons, make callbacks
     while True:
         # Read the Window
         if window is None:
             window = create_main_window()
-
-        event, value = window.read()
+            window.finalize()
+            show_current_volatility(window, settings, window['-GAS-'].get())
+
+        event, value = window.read(timeout=log_view.FLUSH_MILLISECONDS)
+        # prints of the last interval are shown in one update, not one Tk update per print.
+        log.flush_to(window)
+        if event == sg.TIMEOUT_KEY:
+            continue
         if event in ('Quit', sg.WIN_CLOSED):
+            if job is not None:
+                job.cancel()
             break
+        if event == startup.PRELOAD_EVENT:
+            print(value[event])
+        if event in ('-GAS-', '-POWER-'):
+            show_current_volatility(window, settings, value['-GAS-'])
+        if event == cancel_simulation and job is not None:
+            job.cancel()
+            print("Cancelling simulation...")
+        if event == job_runner.PROGRESS_EVENT:
+            finished, total = value[event]
+            window['-PROGRESS-'].update(current_count=finished, max=total)
+        if event == job_server.QUEUED_EVENT:
+            print(f"Job server: {value[event]} jobs ahead." if value[event] else "Job server: simulation started.")
+        if event in (job_runner.DONE_EVENT, job_runner.CANCELLED_EVENT, job_runner.ERROR_EVENT):
+            job = None
+            window[cancel_simulation].update(disabled=True)
+            window[start_simulation].update(disabled=False)
+        if event == job_runner.CANCELLED_EVENT:
+            window['-PROGRESS-'].update(current_count=0)
+            print("Calculation cancelled.")
+        if event == job_runner.ERROR_EVENT:
+            report_an_error(value[event])
+        if event == job_runner.DONE_EVENT:
+            show_volatility(window, job_export_path.joinpath(volatility.VOLATILITY_FILE))
+            if 'std_error' in value[event]:
+                print(f"Strip value {value[event]['strip_value']:.4f} +- {value[event]['std_error']:.4f} "
+                      f"(standard error, {value[event]['variance_reduction']}, {value[event]['num_sim']} paths)")
+            print(profiling.summarize(value[event].get('timings', [])))
+            print("Calculation finished.")
         if event == "-CREATE-CSV-":
-            export_reuters_csv(settings)
+            # the export streams the whole workbook, keep the window responsive meanwhile.
+            window["-CREATE-CSV-"].update(disabled=True)
+            window.perform_long_operation(lambda: export_reuters_csv(settings), "-CREATE-CSV-DONE-")
+        if event == "-CREATE-CSV-DONE-":
+            window["-CREATE-CSV-"].update(disabled=False)
+            if value[event]:
+                report_an_error(value[event])
         # check if initial prices are of type float
         if event == '-YEAR0-' and value['-YEAR0-'] and value['-YEAR0-'][-1] not in '0123456789.,':
             window['-YEAR0-'].update(value['-YEAR0-'][:-1])
@@ -255,7 +444,9 @@ def main():
                 save_settings(SETTINGS_FILE_PATH, settings, value)
         if event == 'Save':
             save_user_settings(value)
-        if event == start_simulation:
+        if event == start_simulation and job is not None:
+            print("A simulation is already running.")
+        elif event == start_simulation:
             ref_year = {'initial year': 0, 'initial year + 1': 1}
             if value["-GAS-"]:
                 import_data_path = settings["path_gas"]
@@ -284,18 +475,31 @@ def main():
                       "num_sim": int(value["-NUM_SIM-"]),
                       "spot_price_simulation": str(export_path.joinpath("spot_price_simulation")),
                       "export_path": path,  # this is export path of volas_for_gui.json, not spot_price_simulation.csv
+                      "profile": bool(settings.get("profile_runs", False)),
+                      "precision": settings.get("precision", "float64"),
+                      "variance_reduction": settings.get("variance_reduction", "none"),
+                      "shared_memory": bool(settings.get("shared_memory", False)),
                       }
-            run(params)
-            volatilities = update_volatility(path.joinpath("volas_for_gui.json"))
-            anualized_vola, jump_vola, no_jump_vola = map(format_vola,
-                                                          [volatilities["vola"], volatilities["jump_vola"],
-                                                           volatilities["no_jumps_vola"]])
-            window["-year_vola-"].update(anualized_vola)
-            window["-spot_vola_w_jumps-"].update(jump_vola)
-            window["-year_vola_wo_jumps-"].update(no_jump_vola)
-            print("Calculation finished.")
+            job = run(window, params, settings.get('job_server'), settings.get('job_priority', 0))
+            job_export_path = path
+            if job is not None:
+                window['-PROGRESS-'].update(current_count=0)
+                window[cancel_simulation].update(disabled=False)
+                window[start_simulation].update(disabled=True)
 
     window.close()
-
-
-main()
+    # the last saves may still wait for their background write
+    settings_store.flush_all()
+    # scenarios published in shared memory are not available to the storage tool anymore.
+    if 'scenario_io' in sys.modules:
+        scenario_io.release_shared()
+
+
+if __name__ == '__main__':
+    # the worker processes import this module again. Only the GUI process may open the log file with mode="w".
+    multiprocessing.freeze_support()
+    # enqueue: the log file is written by a background thread, logging never waits for the disk.
+    logger.add(pathlib.Path(r".\mein_log_pfad.log"), mode="w", enqueue=True)
+    main()
+    # writes the queued messages
+    logger.remove()
@@ -0,0 +1,130 @@
+"""Content-addressed on-disk cache of simulation results.
+
+The key of a run is the sha256 of its canonicalized parameters. Keys that only change the display or the location of
+logs (e.g. 'profile', 'export_path' of the storage tool) are left out. Optionally the modification time and
+size of every input file referenced in the parameters is part of the key, so a changed csv or scenario file
+invalidates the cached result. Scenario files add the cache key and creation time of their header, which also covers
+scenarios kept in shared memory. The cache is limited in size, the least recently used entries are evicted first.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+
+import numpy as np
+from loguru import logger
+
+import scenario_io
+
+CACHE_DIR = pathlib.Path(__file__).parent.joinpath('.result_cache')
+MAX_CACHE_BYTES = 512 * 2 ** 20
+ENTRY_SUFFIX = '.pkl'
+# parameters that do not change the result of a tool
+OUTPUT_ONLY_KEYS = {'spot': {'name', 'tool', 'profile'},
+                    'lsm': {'name', 'tool', 'profile', 'export_path'},
+                    }
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {str(key): _canonical(value[key]) for key in sorted(value, key=str)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest() + str(value.shape) + value.dtype.name
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, pathlib.PurePath):
+        return value.as_posix()
+    if isinstance(value, float):
+        return repr(value)
+    return value
+
+
+def _input_files(params: dict) -> dict:
+    """Modification time and size of every existing file referenced in params.
+
+    A scenario file also adds the cache key and creation time of its header: scenarios kept in shared memory have no
+    .npy file, see scenario_io.
+    """
+    files = {}
+    for key, value in params.items():
+        if isinstance(value, (str, pathlib.PurePath)) and str(value):
+            path = pathlib.Path(value)
+            if path.is_file():
+                stat = path.stat()
+                files[key] = [stat.st_mtime_ns, stat.st_size]
+            if path.suffix == scenario_io.SCENARIO_SUFFIX:
+                try:
+                    header = scenario_io.read_header(path)
+                except (OSError, ValueError):
+                    continue
+                files[key + ' header'] = [header.get('cache_key'), header.get('created')]
+
+    return files
+
+
+def make_key(tool: str, params: dict, track_inputs: bool = True) -> str:
+    """Cache key of a run of `tool` ('spot' or 'lsm') with params.
+
+    :param tool: name of the tool, results of different tools never share a key
+    :param params: parameters of the run
+    :param track_inputs: include modification time and size of the input files in the key
+    """
+    relevant = {key: value for key, value in params.items() if key not in OUTPUT_ONLY_KEYS.get(tool, ())}
+    payload = {'tool': tool, 'params': _canonical(relevant)}
+    if track_inputs:
+        payload['inputs'] = _input_files(relevant)
+
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _entry_path(key: str, cache_dir=None) -> pathlib.Path:
+    return pathlib.Path(cache_dir or CACHE_DIR).joinpath(key + ENTRY_SUFFIX)
+
+
+def get(key: str, cache_dir=None):
+    """Cached result of key or None. A hit marks the entry as recently used."""
+    path = _entry_path(key, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    os.utime(path)
+    logger.info(f"Result cache hit {key[:12]}.")
+
+    return result
+
+
+def put(key: str, result, cache_dir=None, max_bytes: int = MAX_CACHE_BYTES) -> None:
+    """Store result under key and evict the least recently used entries above max_bytes."""
+    path = _entry_path(key, cache_dir)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + '.tmp')
+        with open(temporary, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.warning(f"Could not write result cache entry {path}: {e}")
+        return
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir=None, max_bytes: int = MAX_CACHE_BYTES) -> None:
+    """Delete the least recently used entries until the cache is not larger than max_bytes."""
+    entries = [(p.stat().st_mtime, p.stat().st_size, p)
+               for p in pathlib.Path(cache_dir or CACHE_DIR).glob('*' + ENTRY_SUFFIX)]
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def clear(cache_dir=None) -> None:
+    for path in pathlib.Path(cache_dir or CACHE_DIR).glob('*' + ENTRY_SUFFIX):
+        path.unlink(missing_ok=True)
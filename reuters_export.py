@@ -0,0 +1,124 @@
+"""Streaming export of the Reuters master workbook into the per-commodity csv files.
+
+Every sheet named ``<commodity>_<csv name>`` (e.g. ``gas_actual_spot_prices`` or ``power_TermPrices_YEAR``) is
+written to ``<csv name>.csv`` in the settings folder of the commodity (path_gas / path_power). Other sheets are
+skipped. The workbook is read in read-only mode row by row, so the sheets are never loaded completely.
+
+A sheet is only exported again if its content changed: the CRC of the sheet part (and of the shared strings) inside
+the xlsx archive is compared with the CRC stored at the last export, which does not require reading the sheet.
+"""
+import csv
+import datetime
+import json
+import os
+import pathlib
+import posixpath
+import re
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+import openpyxl
+from loguru import logger
+
+SHEET_NAME_PATTERN = re.compile(r'^(?P<commodity>gas|power)_(?P<csv_name>.+)$', re.IGNORECASE)
+MANIFEST_SUFFIX = '.export.json'
+WORKBOOK_SUFFIXES = ('.xlsx', '.xlsm')
+
+_NS = {'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+       'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+       'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'}
+
+
+def find_workbook(path) -> pathlib.Path:
+    """Return path if it is a workbook, otherwise the most recent workbook in the folder path."""
+    path = pathlib.Path(path)
+    if path.is_file():
+        return path
+    workbooks = [p for p in path.iterdir() if p.suffix.lower() in WORKBOOK_SUFFIXES and not p.name.startswith('~$')]
+    if not workbooks:
+        raise FileNotFoundError(f"No Excel workbook found in {path}")
+
+    return max(workbooks, key=lambda p: p.stat().st_mtime)
+
+
+def sheet_checksums(workbook_path) -> dict:
+    """Checksum of every sheet, read from the zip directory of the xlsx file without decompressing the sheets."""
+    with zipfile.ZipFile(workbook_path) as archive:
+        workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+        relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in relations.findall('rel:Relationship', _NS)}
+        crc = {info.filename: f"{info.CRC:08x}-{info.file_size}" for info in archive.infolist()}
+
+    shared_strings = crc.get('xl/sharedStrings.xml', '')
+    checksums = {}
+    for sheet in workbook.find('main:sheets', _NS):
+        target = targets[sheet.get(f"{{{_NS['r']}}}id")]
+        part = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        checksums[sheet.get('name')] = f"{crc.get(part, '')}|{shared_strings}"
+
+    return checksums
+
+
+def format_cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def write_sheet(worksheet, csv_path: pathlib.Path) -> int:
+    """Stream the rows of worksheet into csv_path. Returns the number of rows."""
+    temporary = csv_path.with_name(csv_path.name + '.tmp')
+    rows = 0
+    with open(temporary, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        for row in worksheet.iter_rows(values_only=True):
+            if all(value is None for value in row):
+                continue
+            writer.writerow([format_cell(value) for value in row])
+            rows += 1
+    os.replace(temporary, csv_path)
+
+    return rows
+
+
+def export_workbook(workbook_path, export_paths: dict, force: bool = False) -> list:
+    """Export the commodity sheets of the workbook. Returns the paths of the csv files that were written.
+
+    :param workbook_path: path to the Reuters workbook
+    :param export_paths: commodity ('gas' / 'power') -> folder of the csv files
+    :param force: export every sheet even if it did not change
+    """
+    workbook_path = pathlib.Path(workbook_path)
+    manifest_path = workbook_path.with_name(workbook_path.name + MANIFEST_SUFFIX)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    checksums = sheet_checksums(workbook_path)
+    written = []
+    workbook = openpyxl.load_workbook(workbook_path, read_only=True, data_only=True)
+    try:
+        for name in workbook.sheetnames:
+            match = SHEET_NAME_PATTERN.match(name)
+            if match is None or not export_paths.get(match['commodity'].lower()):
+                logger.info(f"Skipping sheet {name}.")
+                continue
+            csv_path = pathlib.Path(export_paths[match['commodity'].lower()]).joinpath(match['csv_name'] + '.csv')
+            if not force and csv_path.exists() and manifest.get(name) == checksums.get(name):
+                logger.info(f"Sheet {name} unchanged, keeping {csv_path}.")
+                continue
+            rows = write_sheet(workbook[name], csv_path)
+            manifest[name] = checksums.get(name)
+            written.append(csv_path)
+            logger.info(f"Exported {rows} rows of sheet {name} to {csv_path}.")
+    finally:
+        workbook.close()
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+
+    return written
@@ -0,0 +1,225 @@
+"""Binary, memory-mapped storage of simulated price scenarios.
+
+Scenarios are stored as a ``.npy`` file of shape (scenarios, steps) next to a small ``.json`` header with the
+metadata of the simulation (start date, time step, seed, ...). The simulation writes row chunks directly into the
+memory map, readers slice the memory map without parsing or copying the whole file.
+
+In shared memory mode the scenarios are not written to disk. The process that creates the scenarios publishes them in
+a `multiprocessing.shared_memory` block that lives as long as this process (or until `release_shared`), only the
+json header is written, with the name of the block. Readers and writers in any process attach to the block by that
+name, e.g. the workers of the spot simulation and the storage valuation of the other GUI.
+"""
+import datetime
+import hashlib
+import json
+import pathlib
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from loguru import logger
+
+import profiling
+
+SCENARIO_SUFFIX = '.npy'
+HEADER_SUFFIX = '.json'
+# upper limit of the rows simulated at once by `write_chunks`, keeps temporary arrays small.
+MAX_CHUNK_BYTES = 256 * 2 ** 20
+SHARED_PREFIX = 'scenarios_'
+
+# shared memory blocks created by this process, by name
+_published = {}
+# shared memory blocks of other processes this process is attached to, by name: (version, block)
+_attached = {}
+# guards both tables and the switched off resource tracker of `_attach`
+_lock = threading.RLock()
+
+
+def scenario_path(path) -> pathlib.Path:
+    """Path of the scenario file, e.g. 'spot_price_simulation' -> 'spot_price_simulation.npy'."""
+    return pathlib.Path(path).with_suffix(SCENARIO_SUFFIX)
+
+
+def header_path(path) -> pathlib.Path:
+    return pathlib.Path(path).with_suffix(HEADER_SUFFIX)
+
+
+def shared_name(path) -> str:
+    """Name of the shared memory block of the scenario file path."""
+    digest = hashlib.sha1(str(scenario_path(path).resolve()).encode()).hexdigest()[:16]
+    # short enough for the 31 characters allowed on macOS
+    return SHARED_PREFIX + digest
+
+
+def _attach(name: str, version: tuple = None) -> shared_memory.SharedMemory:
+    """Attach to the shared memory block name of another process.
+
+    :param version: shape and creation time from the header. A block that was published again under the same name
+        since the last call (e.g. by a new simulation run) is attached anew, the old block is closed.
+    """
+    with _lock:
+        if name in _published:
+            return _published[name]
+        if name in _attached and _attached[name][0] != version:
+            _close(_attached.pop(name)[1])
+        if name not in _attached:
+            try:
+                block = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Python < 3.13 tracks every attached block and unlinks it when the attached process ends. Only the
+                # creating process may unlink the block. Unregistering afterwards is not enough: processes spawned by
+                # the creator share its resource tracker and would remove the creator's registration. The lock keeps
+                # other threads of this module from creating a block while registering is switched off.
+                register = resource_tracker.register
+                resource_tracker.register = lambda name, rtype: None
+                try:
+                    block = shared_memory.SharedMemory(name=name)
+                finally:
+                    resource_tracker.register = register
+            _attached[name] = (version, block)
+        return _attached[name][1]
+
+
+def _close(block: shared_memory.SharedMemory) -> None:
+    try:
+        block.close()
+    except BufferError:
+        # arrays on the old block are still in use, the mapping is released together with the last of them
+        logger.debug(f"Shared memory block {block.name} is still in use, it is closed later.")
+
+
+def publish_shared(name: str, nbytes: int) -> shared_memory.SharedMemory:
+    """Create the shared memory block name, a block of an earlier run with the same name is replaced."""
+    with _lock:
+        release_shared(name)
+        try:
+            block = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        except FileExistsError:
+            # left behind by a process that ended without releasing it
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            block = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        _published[name] = block
+    logger.info(f"Scenarios published in shared memory block {name} ({nbytes} bytes).")
+
+    return block
+
+
+def release_shared(name: str = None) -> None:
+    """Free the shared memory block name created by this process, all of them if name is None."""
+    with _lock:
+        for key in [name] if name is not None else list(_published):
+            block = _published.pop(key, None)
+            if block is not None:
+                block.close()
+                block.unlink()
+
+
+def create_scenario_file(path, num_sim: int, steps: int, metadata: dict = None, dtype=np.float64,
+                         shared: bool = False) -> pathlib.Path:
+    """Allocate the scenario file and write its header. The rows are filled later with `write_chunks`.
+
+    :param path: path of the scenario file, the suffix is replaced by .npy
+    :param num_sim: number of scenarios
+    :param steps: number of time steps of every scenario
+    :param metadata: json serializable information stored in the header
+    :param dtype: dtype of the prices
+    :param shared: keep the scenarios in a shared memory block of this process instead of the .npy file
+    """
+    path = scenario_path(path)
+    header = {'shape': [num_sim, steps], 'dtype': np.dtype(dtype).name,
+              'created': datetime.datetime.now().isoformat(timespec='microseconds')}
+    if shared:
+        header['shared_memory'] = shared_name(path)
+        publish_shared(header['shared_memory'], max(1, num_sim * steps * np.dtype(dtype).itemsize))
+        # an older scenario file must not be mistaken for the new scenarios
+        path.unlink(missing_ok=True)
+    else:
+        scenarios = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(num_sim, steps))
+        del scenarios
+    header.update(metadata or {})
+    with open(header_path(path), 'w') as f:
+        json.dump(header, f, default=str)
+
+    return path
+
+
+def share_array(path, scenarios: np.ndarray, metadata: dict = None) -> pathlib.Path:
+    """Publish scenarios that are already in memory (e.g. parsed from a csv file) as shared scenario file path.
+
+    Readers in other processes open path like any scenario file, see `create_scenario_file`.
+    """
+    path = create_scenario_file(path, *scenarios.shape, metadata=metadata, dtype=scenarios.dtype, shared=True)
+    _open(path, writable=True)[:] = scenarios
+
+    return path
+
+
+def write_chunks(path, offset: int, count: int, simulate) -> None:
+    """Fill the rows offset .. offset + count of the scenario file chunk by chunk.
+
+    :param path: path of the scenario file
+    :param offset: first row
+    :param count: number of rows
+    :param simulate: function (rows, out) that writes `rows` scenarios into the buffer `out`
+    """
+    scenarios = _open(path, writable=True)
+    rows = max(1, MAX_CHUNK_BYTES // (scenarios.shape[1] * scenarios.itemsize))
+    for start in range(offset, offset + count, rows):
+        stop = min(start + rows, offset + count)
+        simulate(stop - start, scenarios[start:stop])
+        if isinstance(scenarios, np.memmap):
+            with profiling.stage('export', rows=stop - start):
+                scenarios.flush()
+    del scenarios
+
+
+def _open(path, writable: bool = False) -> np.ndarray:
+    """All scenarios of path, from the shared memory block named in the header or memory-mapped from the file."""
+    try:
+        header = read_header(path)
+    except (OSError, ValueError):
+        header = {}
+    name = header.get('shared_memory')
+    if name is None:
+        return np.load(scenario_path(path), mmap_mode='r+' if writable else 'r')
+    try:
+        block = _attach(name, (tuple(header['shape']), header.get('created')))
+    except FileNotFoundError:
+        raise FileNotFoundError(f"The scenarios of {scenario_path(path)} were kept in shared memory by the spot "
+                                f"simulation, which is not running anymore. Run the simulation again.") from None
+    scenarios = np.ndarray(header['shape'], dtype=header['dtype'], buffer=block.buf)
+    scenarios.flags.writeable = writable
+
+    return scenarios
+
+
+def open_scenarios(path, offset: int = 0, count: int = None) -> np.ndarray:
+    """Read-only view of the scenarios offset .. offset + count, shape (scenarios, steps). Nothing is copied."""
+    scenarios = _open(path)
+    stop = None if count is None else offset + count
+
+    return scenarios[offset:stop]
+
+
+def read_header(path) -> dict:
+    with open(header_path(path), 'r') as f:
+        return json.load(f)
+
+
+def exists(path) -> bool:
+    """True if the scenarios of path can be read, from the file or from shared memory."""
+    try:
+        _open(path)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def has_cache_key(path, cache_key: str) -> bool:
+    """True if the scenarios exist and were written by the run with cache_key."""
+    try:
+        return exists(path) and read_header(path).get('cache_key') == cache_key
+    except (OSError, ValueError):
+        return False
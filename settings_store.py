@@ -0,0 +1,95 @@
+"""Json settings files that are written in the background.
+
+Saving only updates the values in memory. All keys changed within `DEBOUNCE_SECONDS` are written together by a
+background thread, as one atomic write (temporary file + rename), and nothing is written if no value changed. The
+GUI never waits for a slow (network) drive. `flush_all` writes pending changes before the program ends.
+"""
+import json
+import os
+import pathlib
+import threading
+
+from loguru import logger
+
+DEBOUNCE_SECONDS = 0.5
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class SettingsStore:
+    """Settings of one json file, see the module docstring."""
+
+    def __init__(self, path, debounce: float = DEBOUNCE_SECONDS):
+        self.path = pathlib.Path(path)
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        # only one write at a time, a later write always carries the newer values.
+        self._write_lock = threading.Lock()
+        self._timer = None
+        try:
+            with open(self.path, 'r') as f:
+                self._saved = json.load(f)
+        except (OSError, ValueError):
+            self._saved = {}
+        self._values = dict(self._saved)
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    def update(self, values: dict) -> bool:
+        """Change the values of several keys and schedule one write. Returns False if no value changed."""
+        with self._lock:
+            changed = {key: value for key, value in values.items()
+                       if key not in self._values or self._values[key] != value}
+            if not changed:
+                return False
+            self._values.update(changed)
+            # debounce: a save within the waiting time postpones the write and is written with it.
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+        return True
+
+    def flush(self) -> None:
+        """Write pending changes now."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if self._values == self._saved:
+                    return
+                values = dict(self._values)
+            temporary = self.path.with_name(self.path.name + '.tmp')
+            try:
+                with open(temporary, 'w') as f:
+                    json.dump(values, f, default=str)
+                os.replace(temporary, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write settings file {self.path}: {e}")
+                return
+            with self._lock:
+                self._saved = values
+        logger.info(f"Settings written to {self.path}.")
+
+
+def get_store(path) -> SettingsStore:
+    """The store of the settings file path, one per file and process."""
+    key = str(pathlib.Path(path).resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SettingsStore(path)
+        return _stores[key]
+
+
+def flush_all() -> None:
+    """Write the pending changes of all stores, e.g. before the program ends."""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
@@ -0,0 +1,395 @@
+"""Vectorized spot price simulation: mean reversion with jumps around a seasonal price level.
+
+The log price deviation from the seasonal level follows an Ornstein-Uhlenbeck process with compound Poisson jumps::
+
+    X[k] = phi * X[k-1] + eps[k],    phi = exp(-kappa * dt)
+    S[k] = level[k] * exp(X[k] - E[X[k]] - Var[X[k]] / 2)
+
+All paths are generated as one ``(num_sim, steps)`` array. The AR(1) recursion runs block-wise over the time axis
+with a scaled cumulative sum, so there is no Python loop over paths or days.
+
+The diffusion can be driven by plain pseudo random numbers, antithetic pairs, or a randomized Sobol sequence with
+Brownian bridge construction. Every mode reports the estimated value of a strip of daily at-the-money calls on the
+forward curve, with its standard error. 'control_variate' simulates the same paths as 'none', its strip estimate uses
+the mean price of every path, whose expectation is known (`expected_prices`), as control variate.
+"""
+import functools
+import math
+import warnings
+
+import numpy as np
+from loguru import logger
+
+import calendar_index
+import data_loader
+import profiling
+import scenario_io
+import volatility
+
+# largest scaling phi ** -block used by the block-wise recursion. keeps the scaled cumsum well inside float range.
+MAX_BLOCK_SCALE = 1e6
+VARIANCE_REDUCTION = ('none', 'antithetic', 'sobol', 'control_variate')
+# leading Brownian bridge coordinates taken from the Sobol sequence, the fine coordinates are pseudo random.
+SOBOL_DIMENSIONS = 256
+# independently shifted Sobol sets per simulate() call, their spread gives the standard error
+SOBOL_REPLICATIONS = 8
+
+
+def calibrate(spot_prices: np.ndarray, dt: float, jump_distance: float, max_iterations: int = 10) -> dict:
+    """Estimate mean reversion, diffusion and jump parameters from a history of spot prices.
+
+    The residuals of an AR(1) regression of the log prices are split into jumps and diffusion: every residual further
+    than `jump_distance` standard deviations away from the mean is a jump. The split is repeated until it is stable.
+
+    :param spot_prices: historical spot prices, oldest first
+    :param dt: length of one time step in years
+    :param jump_distance: jump threshold in standard deviations of the diffusion residuals
+    :param max_iterations: maximal number of jump filter iterations
+    """
+    x = np.log(spot_prices)
+    x_prev, x_next = x[:-1], x[1:]
+    b = np.cov(x_prev, x_next)[0, 1] / np.var(x_prev, ddof=1)
+    kappa = -math.log(b) / dt if 0 < b < 1 else 0.
+    a = x_next.mean() - b * x_prev.mean()
+    residuals = x_next - a - b * x_prev
+
+    jumps = np.zeros(residuals.shape, dtype=bool)
+    for _ in range(max_iterations):
+        diffusion = residuals[~jumps]
+        new_jumps = np.abs(residuals - diffusion.mean()) > jump_distance * diffusion.std(ddof=1)
+        if np.array_equal(new_jumps, jumps):
+            break
+        jumps = new_jumps
+
+    diffusion, jump_sizes = residuals[~jumps], residuals[jumps] - residuals[~jumps].mean()
+    return {'kappa': float(kappa),
+            'sigma': float(diffusion.std(ddof=1) / math.sqrt(dt)),
+            'jump_intensity': float(jumps.sum() / (len(residuals) * dt)),
+            'jump_mean': float(jump_sizes.mean()) if len(jump_sizes) else 0.,
+            'jump_vola': float(jump_sizes.std()) if len(jump_sizes) else 0.,
+            'x0': float(x[-1]),
+            }
+
+
+def seasonal_level(start_date: str, steps: int, t: int, m: int, initial_prices: list, month_factors: np.ndarray,
+                   reference_year: int = 0) -> np.ndarray:
+    """Deterministic price level of every time step: year price times month factor.
+
+    :param start_date: first simulation date, format '%d.%m.%Y'
+    :param steps: number of time steps
+    :param t: time step in units of 1 / m years
+    :param m: annualization factor, time steps per year
+    :param initial_prices: prices of year 0, 1, 2
+    :param month_factors: 12 month factors, January first
+    :param reference_year: index into initial_prices of the first simulated calendar year
+    """
+    months = calendar_index.time_grid(start_date, steps, t, m)['months']
+    year_index = np.minimum(months // 12 + reference_year, len(initial_prices) - 1)
+
+    return np.asarray(initial_prices, dtype=np.float64)[year_index] * month_factors[months % 12]
+
+
+def prepare_model(params: dict) -> dict:
+    """Read and calibrate the inputs of the simple GUI `params` once, before the paths are simulated in the workers.
+
+    Updates volas_for_gui.json in params['export_path'], only prices appended since the last run are read.
+    """
+    dt = params['t'] / params['m']
+    with profiling.stage('csv_load'):
+        inputs = data_loader.load_inputs(params)
+    spot_prices = inputs['actual_spot_prices']
+    month_factors = inputs['month_factors_mr'][:12]
+    with profiling.stage('calibration'):
+        model = calibrate(spot_prices, dt, params['jump_distance'])
+    steps = int(params['years_to_future'] * params['m'] / params['t'])
+    model.update({'dt': dt,
+                  'level': seasonal_level(params['start_date'], steps, params['t'], params['m'],
+                                          params['initial_prices'], month_factors, params['reference_year'])})
+    model['x0'] -= math.log(model['level'][0])
+
+    with profiling.stage('volatility_json'):
+        volatility.update(params)
+    logger.info({key: value for key, value in model.items() if key != 'level'})
+
+    return model
+
+
+def prepare_run(params: dict, resume: bool = False) -> dict:
+    """Calibrate the model and allocate the scenario file of a run. Returns a copy of params ready for the workers.
+
+    :param params: parameters of the run
+    :param resume: keep the scenario file of an earlier, unfinished run with the same parameters. The rows of its
+        checkpointed chunks stay valid, the remaining chunks are simulated with the seed of that run.
+    """
+    params = params.copy()
+    if resume:
+        params['seed'] = scenario_io.read_header(params['spot_price_simulation'])['seed']
+    # one seed for the whole run, every chunk spawns its own generator from it.
+    params.setdefault('seed', np.random.SeedSequence().entropy)
+    params['model'] = prepare_model(params)
+    metadata = {key: params.get(key) for key in ('t', 'm', 'start_date', 'years_to_future', 'reference_year',
+                                                 'initial_prices', 'seed', 'cache_key', 'precision',
+                                                 'variance_reduction')}
+    params['model']['precision'] = params.get('precision', 'float64')
+    params['model']['variance_reduction'] = params.get('variance_reduction', 'none')
+    if not resume:
+        scenario_io.create_scenario_file(params['spot_price_simulation'], params['num_sim'],
+                                         len(params['model']['level']), metadata, dtype=params['model']['precision'],
+                                         shared=params.get('shared_memory', False))
+
+    return params
+
+
+def moments(model: dict, steps: int):
+    """Mean and variance of the stochastic part of X (without the decaying start value) for every time step."""
+    phi = math.exp(-model['kappa'] * model['dt'])
+    n = np.arange(1, steps + 1, dtype=np.float64)
+    lam = model['jump_intensity'] * model['dt']
+    step_variance = (model['sigma'] ** 2 * (1 - phi ** 2) / (2 * model['kappa'])
+                     if model['kappa'] > 0 else model['sigma'] ** 2 * model['dt'])
+    step_variance += lam * (model['jump_mean'] ** 2 + model['jump_vola'] ** 2)
+    if phi < 1:
+        mean = lam * model['jump_mean'] * (1 - phi ** n) / (1 - phi)
+        variance = step_variance * (1 - phi ** (2 * n)) / (1 - phi ** 2)
+    else:
+        mean, variance = lam * model['jump_mean'] * n, step_variance * n
+
+    return mean, variance
+
+
+def expected_prices(model: dict) -> np.ndarray:
+    """Expectation of the simulated price of every time step.
+
+    `simulate` compensates the stochastic part of X with its mean and half its variance, which is exact for the
+    diffusion only. The expectation adds the exact cumulant of the compound Poisson jumps: the stochastic part of
+    X[n] is sum(phi ** m * eps[n - m], m < n), and log E[exp(c * eps)] = c ** 2 * diffusion variance / 2
+    + lam * (exp(c * jump_mean + c ** 2 * jump_vola ** 2 / 2) - 1).
+    """
+    level = model['level']
+    steps, dt = len(level), model['dt']
+    phi = math.exp(-model['kappa'] * dt)
+    c = phi ** np.arange(steps, dtype=np.float64)
+    diffusion_variance = (model['sigma'] ** 2 * (1 - phi ** 2) / (2 * model['kappa'])
+                          if model['kappa'] > 0 else model['sigma'] ** 2 * dt)
+    cumulant = np.cumsum(0.5 * c ** 2 * diffusion_variance + model['jump_intensity'] * dt
+                         * np.expm1(c * model['jump_mean'] + 0.5 * (c * model['jump_vola']) ** 2))
+    mean, variance = moments(model, steps)
+
+    return level * np.exp(phi * c * model['x0'] + cumulant - mean - 0.5 * variance)
+
+
+def ar1_inplace(eps: np.ndarray, phi: float, x0: float) -> np.ndarray:
+    """Turn the innovations eps of shape (num_sim, steps) into X[k] = phi * X[k-1] + eps[k] in place.
+
+    Within a block of length B: X[k] = phi ** (k - a) * (phi * X[a - 1] + cumsum(phi ** (a - j) * eps[j])).
+    """
+    steps = eps.shape[1]
+    block = steps if phi >= 1 else max(1, int(math.log(MAX_BLOCK_SCALE) / -math.log(phi)))
+    powers = phi ** np.arange(min(block, steps), dtype=np.float64)
+    previous = np.full(eps.shape[0], x0, dtype=eps.dtype)
+    for a in range(0, steps, block):
+        view = eps[:, a:a + block]
+        p = powers[:view.shape[1]].astype(eps.dtype)
+        view /= p
+        np.cumsum(view, axis=1, out=view)
+        view += phi * previous[:, None]
+        view *= p
+        previous = view[:, -1].copy()
+
+    return eps
+
+
+@functools.lru_cache(maxsize=8)
+def bridge_schedule(steps: int) -> list:
+    """Points of the Brownian bridge on 0 .. steps, level by level: a list of (left, middle, right) index arrays."""
+    schedule = []
+    known = np.array([0, steps])
+    while True:
+        left, right = known[:-1], known[1:]
+        split = right - left > 1
+        if not split.any():
+            return schedule
+        left, right = left[split], right[split]
+        middle = (left + right) // 2
+        schedule.append((left, middle, right))
+        known = np.union1d(known, middle)
+
+
+def bridge_increments(z: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """Standard normal increments of Brownian paths built by Brownian bridge from the normals z in bridge order.
+
+    Row 0 of z fixes the end point of the paths, the following rows the mid points of ever finer intervals, so the
+    first rows of z decide the coarse shape of every path.
+
+    :param z: independent standard normals, time-major shape (steps, num_sim)
+    :param out: output buffer of shape (num_sim, steps)
+    """
+    steps = z.shape[0]
+    # time-major, so that every bridge point is one contiguous row
+    path = np.zeros((steps + 1, z.shape[1]))
+    path[steps] = math.sqrt(steps) * z[0]
+    row = 1
+    for left, middle, right in bridge_schedule(steps):
+        width = right - left
+        path[middle] = (path[left] * ((right - middle) / width)[:, None]
+                        + path[right] * ((middle - left) / width)[:, None]
+                        + z[row:row + len(middle)] * np.sqrt((middle - left) * (right - middle) / width)[:, None])
+        row += len(middle)
+    np.subtract(path[1:], path[:-1], out=out.T)
+
+    return out
+
+
+def sobol_replications(num_sim: int) -> list:
+    """Row slices of the independently shifted Sobol sets of a simulate() call, at most SOBOL_REPLICATIONS."""
+    bounds = np.linspace(0, num_sim, min(num_sim, SOBOL_REPLICATIONS) + 1).astype(int)
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def sobol_normals(rng: np.random.Generator, num_sim: int, steps: int) -> np.ndarray:
+    """Standard normals of time-major shape (steps, num_sim).
+
+    The leading SOBOL_DIMENSIONS rows come from the Sobol sequence, randomized by an independent random digital shift
+    per replication of `sobol_replications`, so the spread of the replications gives the standard error.
+    """
+    from scipy.stats import norm, qmc  # only needed for the 'sobol' mode
+    z = rng.standard_normal((steps, num_sim))
+    dimensions = min(steps, SOBOL_DIMENSIONS)
+    replications = sobol_replications(num_sim)
+    with warnings.catch_warnings():
+        # the balance of the Sobol points is best for powers of 2, but any number of points is valid.
+        warnings.simplefilter('ignore', UserWarning)
+        points = qmc.Sobol(dimensions, scramble=False).random(max(r.stop - r.start for r in replications))
+    points = (points * 2 ** 32).astype(np.uint64)
+    for replication in replications:
+        shift = rng.integers(2 ** 32, size=dimensions, dtype=np.uint64)
+        # centered in its cell, so no uniform is exactly 0 or 1
+        uniforms = ((points[:replication.stop - replication.start] ^ shift) + 0.5) / 2 ** 32
+        z[:dimensions, replication] = norm.ppf(uniforms).T
+
+    return z
+
+
+def diffusion_normals(model: dict, rng: np.random.Generator, out: np.ndarray) -> np.ndarray:
+    """Fill out with the standard normals of the diffusion, according to model['variance_reduction']."""
+    mode = model.get('variance_reduction', 'none')
+    if mode == 'sobol':
+        return bridge_increments(sobol_normals(rng, *out.shape), out)
+    if mode == 'antithetic':
+        # row i and row half + i are an antithetic pair, an odd last row stays on its own.
+        half = len(out) // 2
+        rng.standard_normal(out=out[:half], dtype=out.dtype)
+        np.negative(out[:half], out=out[half:2 * half])
+        rng.standard_normal(out=out[2 * half:], dtype=out.dtype)
+        return out
+    if mode not in VARIANCE_REDUCTION:
+        raise ValueError(f"Unknown variance reduction '{mode}', expected one of {', '.join(VARIANCE_REDUCTION)}.")
+
+    return rng.standard_normal(out=out, dtype=out.dtype)
+
+
+def simulate(model: dict, num_sim: int, rng: np.random.Generator, out: np.ndarray = None) -> np.ndarray:
+    """Simulate num_sim spot price paths. Returns an array of shape (num_sim, steps).
+
+    :param model: calibrated model from `prepare_model`
+    :param num_sim: number of paths
+    :param rng: seedable random generator, e.g. np.random.default_rng(seed)
+    :param out: optional preallocated float64 or float32 output buffer of shape (num_sim, steps)
+    """
+    level = model['level']
+    steps, dt = len(level), model['dt']
+    if out is None:
+        out = np.empty((num_sim, steps), dtype=np.dtype(model.get('precision', 'float64')))
+    phi = math.exp(-model['kappa'] * dt)
+    diffusion_std = (model['sigma'] * math.sqrt((1 - phi ** 2) / (2 * model['kappa']))
+                     if model['kappa'] > 0 else model['sigma'] * math.sqrt(dt))
+
+    diffusion_normals(model, rng, out)
+    out *= diffusion_std
+    if model['jump_intensity'] > 0:
+        # sum of n normal jumps: n * jump_mean + sqrt(n) * jump_vola * z
+        counts = rng.poisson(model['jump_intensity'] * dt, size=out.shape).astype(out.dtype)
+        jumps = rng.standard_normal(size=out.shape, dtype=out.dtype)
+        jumps *= np.sqrt(counts) * model['jump_vola']
+        jumps += counts * model['jump_mean']
+        out += jumps
+        del counts, jumps
+
+    ar1_inplace(out, phi, model['x0'])
+    mean, variance = moments(model, steps)
+    out -= (mean + 0.5 * variance).astype(out.dtype)
+    np.exp(out, out=out)
+    out *= level.astype(out.dtype)
+
+    return out
+
+
+def path_statistics(model: dict, paths: np.ndarray) -> dict:
+    """Strip value and mean price of the paths of one simulate() call, reduced to independent units.
+
+    The strip value of a path is the mean of its daily at-the-money calls max(S - level, 0), level is the forward
+    curve. Units are single paths, antithetic pairs ('antithetic') or independently shifted Sobol sets ('sobol').
+    """
+    level = model['level']
+    strip = np.maximum(np.subtract(paths, level, dtype=np.float64), 0.).mean(axis=1)
+    price = paths.mean(axis=1, dtype=np.float64)
+    weight = np.ones(len(paths))
+    mode = model.get('variance_reduction', 'none')
+    if mode == 'antithetic':
+        half = len(paths) // 2
+        pair = slice(0, half), slice(half, 2 * half)
+        strip = np.concatenate([(strip[pair[0]] + strip[pair[1]]) / 2, strip[2 * half:]])
+        price = np.concatenate([(price[pair[0]] + price[pair[1]]) / 2, price[2 * half:]])
+        weight = np.concatenate([np.full(half, 2.), weight[2 * half:]])
+    elif mode == 'sobol':
+        replications = sobol_replications(len(paths))
+        strip = np.array([strip[replication].mean() for replication in replications])
+        price = np.array([price[replication].mean() for replication in replications])
+        weight = np.array([replication.stop - replication.start for replication in replications], dtype=float)
+
+    return {'strip': strip, 'price': price, 'weight': weight}
+
+
+def strip_estimate(statistics: dict, expected_price: float, mode: str = 'none') -> dict:
+    """Strip value and its standard error from the units of `path_statistics` of all chunks.
+
+    :param statistics: strip value, mean price and weight of every unit
+    :param expected_price: expectation of the mean price of a path, the mean of `expected_prices`
+    :param mode: variance reduction of the run. In 'control_variate' mode the mean price is the control variate.
+    """
+    strip, price, weight = statistics['strip'], statistics['price'], statistics['weight']
+    units = len(strip)
+    if mode == 'control_variate' and units > 1:
+        covariance = np.cov(strip, price, aweights=weight)
+        beta = covariance[0, 1] / covariance[1, 1] if covariance[1, 1] > 0 else 0.
+        strip = strip - beta * (price - expected_price)
+    value = float(np.average(strip, weights=weight))
+    if units < 2:
+        return {'strip_value': value, 'std_error': float('nan'), 'units': units}
+    # weighted standard error of the mean of independent units
+    variance = np.sum((weight * (strip - value)) ** 2) / np.sum(weight) ** 2 * units / (units - 1)
+
+    return {'strip_value': value, 'std_error': float(math.sqrt(variance)), 'units': units}
+
+
+def memory_footprint(num_sim: int, steps: int, precision: str = 'float64', workers: int = 1,
+                     variance_reduction: str = 'none') -> dict:
+    """Bytes of the scenario file and of the working memory of all workers for a simulation.
+
+    A worker holds at most one chunk of rows of scenario_io.MAX_CHUNK_BYTES plus the jump temporaries.
+    """
+    itemsize = np.dtype(precision).itemsize
+    chunk_rows = min(num_sim, max(1, scenario_io.MAX_CHUNK_BYTES // (steps * itemsize)))
+    # output buffer, jump sizes and the int64 jump counts of one chunk
+    worker_bytes = chunk_rows * steps * (2 * itemsize + 8)
+    if variance_reduction == 'sobol':
+        # float64 normals and Brownian bridge paths
+        worker_bytes += chunk_rows * (2 * steps + 1) * 8
+
+    return {'scenario_file': num_sim * steps * itemsize, 'workers': workers * worker_bytes}
+
+
+def chunk_rng(params: dict) -> np.random.Generator:
+    """Independent, reproducible random generator of one job chunk."""
+    seed_sequence = np.random.SeedSequence(params['seed']).spawn(params.get('num_chunks', 1))
+    return np.random.default_rng(seed_sequence[params.get('chunk_index', 0)])
@@ -0,0 +1,5 @@
+"""The tool modules are flat scripts next to this folder, the tests import them from there."""
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
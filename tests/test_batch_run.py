@@ -0,0 +1,23 @@
+import numpy as np
+
+import batch_run
+import lsm_engine
+import result_cache
+from test_lsm_engine import PARAMS, PRICES
+
+
+def test_storage_run_is_cached_without_timings_and_scenario_values(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, 'CACHE_DIR', tmp_path.joinpath('cache'))
+    rng = np.random.default_rng(2)
+    S = PRICES * np.exp(rng.normal(0., 0.2, size=(20, len(PRICES))))
+    monkeypatch.setattr(lsm_engine, 'valuation_scenarios', lambda params, offset, count: S[offset:offset + count])
+    params = dict(PARAMS, use_scenarios=len(S), export_path=str(tmp_path), show_statistics=True)
+
+    result = batch_run.run_one(params)
+    assert 'scenario_values' not in result
+    assert set(result['statistics']) == set(lsm_engine.value_statistics(np.zeros(2)))
+    assert result['timings']
+
+    cached = result_cache.get(result_cache.make_key('lsm', params))
+    assert cached == {key: value for key, value in result.items() if key != 'timings'}
+    assert batch_run.run_one(params) == cached
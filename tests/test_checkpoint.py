@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import checkpoint
+import lsm_engine
+
+DAYS = 40
+PARAMS = {'interest_rate': 1. / 36000, 'start_date': '2021-10-01', 'end_date': '2021-11-10', 'use_scenarios': 50,
+          'initial_storage_volume': 0., 'speicher_wert_besteht': False,
+          'einspeicherleistung_min_max': [0., 50.], 'ausspeicherleistung_min_max': [0., 100.],
+          'total_min_max_volume': [0., 6000.], 'vol_min_max_start': [0., 0.], 'vol_min_max_end': [0., 0.],
+          'inject_costs': 0.5, 'eject_costs': 0.5, 'run_delta': True, 'variation': 1., 'up': 1, 'down': -1}
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def scenarios():
+    rng = np.random.default_rng(3)
+    return 40. * np.exp(np.cumsum(rng.normal(0., 0.05, size=(PARAMS['use_scenarios'], DAYS)), axis=1))
+
+
+def test_resumed_valuation_equals_uninterrupted_run(tmp_path, monkeypatch, scenarios):
+    uninterrupted = lsm_engine.value_storage(PARAMS, scenarios)
+    params = dict(PARAMS, checkpoint_dir=tmp_path, chunk_index=0)
+    # a checkpoint after every day, the first run stops after the third one
+    monkeypatch.setattr(checkpoint, 'CHECKPOINT_SECONDS', -1.)
+    save_state, saved = checkpoint.save_state, []
+
+    def save_and_stop(folder, index, state):
+        save_state(folder, index, state)
+        saved.append(state['day'])
+        if len(saved) == 3:
+            raise Interrupted()
+
+    monkeypatch.setattr(checkpoint, 'save_state', save_and_stop)
+    with pytest.raises(Interrupted):
+        lsm_engine.value_storage(params, scenarios)
+    assert checkpoint.load_state(tmp_path, 0)['day'] == DAYS - 3
+
+    monkeypatch.setattr(checkpoint, 'save_state', save_state)
+    load_state, loaded = checkpoint.load_state, []
+
+    def load_and_record(folder, index):
+        loaded.append(load_state(folder, index))
+        return loaded[-1]
+
+    monkeypatch.setattr(checkpoint, 'load_state', load_and_record)
+    resumed = lsm_engine.value_storage(params, scenarios)
+
+    assert loaded[0]['day'] == DAYS - 3
+    assert resumed == uninterrupted
+
+
+def test_finished_chunks_are_loaded_for_the_same_split(tmp_path):
+    chunks = [{'chunk_index': index, 'chunk_offset': 10 * index, 'num_chunks': 3} for index in range(3)]
+    checkpoint.save_chunk(tmp_path, chunks[1], {'value': 1.})
+
+    assert checkpoint.load_chunks(tmp_path, chunks) == {1: {'value': 1.}}
+    # a different split of the scenarios does not match the stored chunk
+    assert checkpoint.load_chunks(tmp_path, [dict(chunk, num_chunks=4) for chunk in chunks]) == {}
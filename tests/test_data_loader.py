@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+import data_loader
+
+
+@pytest.mark.parametrize('sample, delimiter', [("Datum;Preis\n2021-01-01;40,5\n", ';'),
+                                               ("date,price\n2021-01-01,40.5\n", ','),
+                                               ("date\tprice\n2021-01-01\t40.5\n", '\t'),
+                                               ("40.5\n41.0\n", ';'),
+                                               ("", ';')])
+def test_sniff_delimiter(sample, delimiter):
+    assert data_loader.sniff_delimiter(sample) == delimiter
+
+
+def test_parse_csv_column_skips_the_header_and_accepts_decimal_commas(tmp_path):
+    path = tmp_path.joinpath('actual_spot_prices.csv')
+    path.write_text("Datum;Preis\n2021-01-01;40,5\n2021-01-02;41\n\n")
+
+    np.testing.assert_array_equal(data_loader.parse_csv_column(path), [40.5, 41.])
+
+
+def test_load_column_parses_a_changed_file_again(tmp_path, monkeypatch):
+    path = tmp_path.joinpath('month_prices.csv')
+    path.write_text("1;2\n3;4\n")
+    parsed = []
+    parse = data_loader.parse_csv_column
+    monkeypatch.setattr(data_loader, 'parse_csv_column', lambda *args: parsed.append(args) or parse(*args))
+
+    np.testing.assert_array_equal(data_loader.load_column(path), [2., 4.])
+    data_loader.clear_cache()
+    # the sidecar file answers the second load
+    np.testing.assert_array_equal(data_loader.load_column(path), [2., 4.])
+    assert len(parsed) == 1
+
+    path.write_text("1;2\n3;4\n5;6\n")
+    os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(data_loader.load_column(path), [2., 4., 6.])
+    assert len(parsed) == 2
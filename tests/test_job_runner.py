@@ -0,0 +1,110 @@
+import threading
+import time
+
+import job_runner
+
+
+class Window:
+    """Stand-in of the GUI window, collects the job events."""
+
+    def __init__(self):
+        self.events = []
+        self.finished = threading.Event()
+
+    def write_event_value(self, event, value):
+        self.events.append((event, value))
+        if event in (job_runner.DONE_EVENT, job_runner.ERROR_EVENT, job_runner.CANCELLED_EVENT):
+            self.finished.set()
+
+    def final_events(self) -> list:
+        return [(event, value) for event, value in self.events
+                if event not in (job_runner.PROGRESS_EVENT, job_runner.PARTIAL_EVENT)]
+
+
+def sleep_chunk(chunk: dict) -> int:
+    time.sleep(60)
+    return chunk['n']
+
+
+def test_split_count():
+    assert job_runner.split_count(10, 4) == [3, 3, 2, 2]
+    assert job_runner.split_count(2, 4) == [1, 1]
+
+
+def test_cancel_stops_the_worker_processes_at_once():
+    window = Window()
+    job = job_runner.start_job(window, sleep_chunk, {'n': 4}, 'n', max_workers=2, chunks_per_worker=2)
+    deadline = time.monotonic() + 30
+    while not getattr(job._executor, '_processes', None) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    processes = list(job._executor._processes.values())
+
+    job.cancel()
+    assert window.final_events() == [(job_runner.CANCELLED_EVENT, None)]
+    job._thread.join(10)
+    for process in processes:
+        process.join(10)
+
+    assert not job.is_alive()
+    assert not any(process.is_alive() for process in processes)
+    assert window.final_events() == [(job_runner.CANCELLED_EVENT, None)]
+
+
+def test_cancel_before_the_pool_starts_is_reported_once():
+    window = Window()
+    job = job_runner.Job(window, sleep_chunk, [{'n': 1, 'chunk_index': 0}], job_runner.collect_results, 1)
+    job.cancel()
+    job.start()._thread.join(30)
+
+    assert window.final_events() == [(job_runner.CANCELLED_EVENT, None)]
+
+
+def count_chunk(chunk: dict) -> dict:
+    if chunk.get('fail_at') == chunk['chunk_index']:
+        raise RuntimeError('worker crashed')
+    with _lock:
+        _computed.append(chunk['chunk_index'])
+    return {'n': chunk['n'], 'offset': chunk['chunk_offset']}
+
+
+_computed = []
+_lock = threading.Lock()
+
+
+def test_rerun_resumes_from_the_finished_chunks(tmp_path):
+    crashed = Window()
+    job_runner.start_job(crashed, count_chunk, {'n': 8, 'fail_at': 3}, 'n', max_workers=1, chunks_per_worker=4,
+                         checkpoint_dir=tmp_path, in_process=True)
+    assert crashed.finished.wait(30)
+    assert crashed.final_events() == [(job_runner.ERROR_EVENT, 'worker crashed')]
+    # one worker thread: the chunks before the crash are finished and stored
+    assert _computed == [0, 1, 2]
+
+    _computed.clear()
+    resumed = Window()
+    job_runner.start_job(resumed, count_chunk, {'n': 8}, 'n', max_workers=1, chunks_per_worker=4,
+                         checkpoint_dir=tmp_path, in_process=True)
+    assert resumed.finished.wait(30)
+
+    assert _computed == [3]
+    expected = [{'n': 2, 'offset': offset} for offset in (0, 2, 4, 6)]
+    assert resumed.final_events() == [(job_runner.DONE_EVENT, expected)]
+
+
+def test_chunks_are_prepared_in_the_job_thread():
+    window, release, threads = Window(), threading.Event(), []
+
+    def prepare(chunks: list) -> list:
+        threads.append(threading.current_thread())
+        assert release.wait(30)
+        return [dict(chunk, n=10 * chunk['n']) for chunk in chunks]
+
+    job = job_runner.Job(window, job_runner.collect_results, [{'n': 1}, {'n': 2}], job_runner.collect_results, 1,
+                         in_process=True, prepare=prepare).start()
+    # start() returns while the preparation runs
+    assert not window.finished.is_set()
+    release.set()
+    assert window.finished.wait(30)
+
+    assert threads == [job._thread]
+    assert window.final_events() == [(job_runner.DONE_EVENT, [{'n': 10}, {'n': 20}])]
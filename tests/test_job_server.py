@@ -0,0 +1,157 @@
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+import job_runner
+import job_server
+
+
+class Window:
+    """Stand-in of the GUI window, collects the job events."""
+
+    def __init__(self):
+        self.events = []
+        self.finished = threading.Event()
+
+    def write_event_value(self, event, value):
+        self.events.append((event, value))
+        if event in job_server.FINAL_EVENTS:
+            self.finished.set()
+
+    def final_events(self) -> list:
+        return [(event, value) for event, value in self.events if event in job_server.FINAL_EVENTS]
+
+
+@pytest.fixture
+def key_file(tmp_path, monkeypatch):
+    monkeypatch.delenv(job_server.KEY_VARIABLE, raising=False)
+    monkeypatch.setattr(job_server, 'KEY_FILE', tmp_path.joinpath('keys', 'job_server.key'))
+    return job_server.KEY_FILE
+
+
+@pytest.fixture
+def server(key_file):
+    """Address of a job server running in a thread of this process."""
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    address = f'localhost:{port}'
+    threading.Thread(target=job_server.serve, args=(address, 1), daemon=True).start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return address
+
+
+@pytest.mark.parametrize('address, expected', [('localhost:6001', ('localhost', 6001)),
+                                               ('server.local', ('server.local', 6000)),
+                                               (' :7000 ', ('localhost', 7000)),
+                                               ('', ('localhost', 6000)),
+                                               (None, ('localhost', 6000))])
+def test_parse_address(address, expected):
+    assert job_server.parse_address(address) == expected
+
+
+@pytest.mark.parametrize('address', ['localhost:port', 'localhost:0', 'localhost:70000', 'localhost:'])
+def test_parse_address_rejects_invalid_ports(address):
+    with pytest.raises(ValueError, match='Invalid job server address'):
+        job_server.parse_address(address)
+
+
+def test_invalid_address_ends_the_job_with_an_error(key_file):
+    job_server.auth_key(create=True)
+    window = Window()
+    job = job_server.submit(window, 'spot', {}, 'localhost:port')
+
+    assert window.finished.wait(10)
+    [(event, message)] = window.final_events()
+    assert event == job_runner.ERROR_EVENT and 'Invalid job server address' in message
+    job.cancel()
+    assert len(window.final_events()) == 1
+
+
+def test_cancel_without_connection_ends_the_job(key_file):
+    window = Window()
+    job = job_server.RemoteJob(window, job_server.DEFAULT_ADDRESS, {'tool': 'spot', 'params': {}})
+    job.cancel()
+    job.start()._thread.join(10)
+
+    assert window.final_events() == [(job_runner.CANCELLED_EVENT, None)]
+
+
+def test_key_file_is_created_private_and_reused(key_file):
+    with pytest.raises(RuntimeError, match='No job server key'):
+        job_server.auth_key()
+    key = job_server.auth_key(create=True)
+
+    assert len(key) == 64
+    assert job_server.auth_key() == key
+    if os.name == 'posix':
+        assert stat.S_IMODE(key_file.stat().st_mode) == 0o600
+        key_file.chmod(0o644)
+        with pytest.raises(RuntimeError, match='can be read by other users'):
+            job_server.auth_key()
+
+
+def test_environment_key_wins(key_file, monkeypatch):
+    monkeypatch.setenv(job_server.KEY_VARIABLE, 'secret')
+
+    assert job_server.auth_key(create=True) == b'secret'
+    assert not key_file.exists()
+
+
+def test_server_reports_errors_and_survives_a_wrong_key(server, monkeypatch):
+    window = Window()
+    job_server.submit(window, 'unknown', {}, server)
+    assert window.finished.wait(10)
+    assert window.final_events() == [(job_runner.ERROR_EVENT,
+                                      "Unknown tool 'unknown', expected one of spot, lsm, portfolio.")]
+
+    monkeypatch.setenv(job_server.KEY_VARIABLE, 'wrong')
+    window = Window()
+    job_server.submit(window, 'unknown', {}, server)
+    assert window.finished.wait(10)
+    assert 'refused the key' in window.final_events()[0][1]
+
+    monkeypatch.delenv(job_server.KEY_VARIABLE)
+    window = Window()
+    job_server.submit(window, 'unknown', {}, server)
+    assert window.finished.wait(10)
+    assert 'Unknown tool' in window.final_events()[0][1]
+
+
+class StartedJob:
+    def __init__(self, window):
+        self.window = window
+
+    def cancel(self):
+        self.window.write_event_value(job_runner.CANCELLED_EVENT, None)
+
+
+def test_job_left_while_starting_is_cancelled(monkeypatch):
+    starting = threading.Event()
+
+    def slow_start(window, params, workers):
+        starting.set()
+        time.sleep(0.5)
+        return StartedJob(window)
+
+    monkeypatch.setitem(job_server.TOOLS, 'spot', slow_start)
+    scheduler = job_server.Scheduler(2)
+    job, events = scheduler.submit({'tool': 'spot', 'params': {'run': 1}})
+    assert starting.wait(10)
+    scheduler.unsubscribe(job, events)
+    deadline = time.monotonic() + 10
+    while scheduler._jobs and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert job.cancelled
+    assert scheduler._jobs == {} and scheduler._running == 0
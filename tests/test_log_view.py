@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip('PySimpleGUI')
+import log_view  # noqa: E402
+
+
+class Element:
+    """Stand-in of the Multiline log element."""
+
+    def __init__(self):
+        self.text, self.updates = '', 0
+
+    def update(self, text: str, append: bool = False):
+        self.text = self.text + text if append else text
+        self.updates += 1
+
+
+def test_prints_are_shown_in_one_update():
+    log, window = log_view.LogBuffer(), {log_view.LOG_KEY: Element()}
+    for index in range(3):
+        print(index, file=log)
+    print("partial", end='', file=log)
+    log.flush_to(window)
+    log.flush_to(window)
+
+    assert window[log_view.LOG_KEY].text == "0\n1\n2\n"
+    assert window[log_view.LOG_KEY].updates == 1
+
+
+def test_the_log_keeps_the_last_lines():
+    log, window = log_view.LogBuffer(max_lines=3), {log_view.LOG_KEY: Element()}
+    log.flush_to(window)
+    for index in range(5):
+        print(index, file=log)
+    log.flush_to(window)
+
+    assert window[log_view.LOG_KEY].text == "... 2 lines not shown ...\n2\n3\n4\n"
+    for index in range(5, 8):
+        print(index, file=log)
+    log.flush_to(window)
+    # more than 2 * max_lines lines in the element: it is rewritten from the ring buffer
+    assert window[log_view.LOG_KEY].text == "5\n6\n7\n"
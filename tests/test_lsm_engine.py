@@ -0,0 +1,109 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import calendar_index
+import lsm_engine
+
+# 5 volume levels of 100 MWh, injection of at most one and withdrawal of at most two levels per day
+PARAMS = {'interest_rate': 0.001, 'start_date': '2021-10-01', 'end_date': '2021-10-06', 'use_scenarios': 1,
+          'initial_storage_volume': 100., 'speicher_wert_besteht': True,
+          'einspeicherleistung_min_max': [0., 100. / 24], 'ausspeicherleistung_min_max': [0., 200. / 24],
+          'total_min_max_volume': [0., 400.], 'vol_min_max_start': [100., 100.], 'vol_min_max_end': [100., 300.],
+          'inject_costs': 1., 'eject_costs': 2., 'run_delta': False}
+PRICES = np.array([30., 10., 50., 20., 60.])
+
+
+def brute_force_value(params: dict, prices: np.ndarray, volume_levels: int) -> float:
+    """Best value over every sequence of daily volume changes, for prices known in advance."""
+    grid = lsm_engine.volume_grid(params, volume_levels)
+    step = grid[1] - grid[0]
+    offsets = lsm_engine.feasible_offsets(params, step, len(grid))
+    discount = calendar_index.valuation_days(params['start_date'], params['end_date'],
+                                             params['interest_rate'])['step_discount']
+    end_min, end_max = params['vol_min_max_end']
+    best = -np.inf
+    for moves in itertools.product(offsets, repeat=len(prices)):
+        level = int(np.abs(grid - params['initial_storage_volume']).argmin())
+        value, factor = 0., 1.
+        for move, price, day_discount in zip(moves, prices, discount):
+            level += move
+            if not 0 <= level < len(grid):
+                break
+            cost = params['inject_costs'] if move > 0 else -params['eject_costs']
+            value += factor * -move * step * (price + cost)
+            factor *= day_discount
+        else:
+            if end_min <= grid[level] <= end_max:
+                if params['speicher_wert_besteht']:
+                    value += factor * grid[level] * prices[-1]
+                best = max(best, value)
+
+    return best
+
+
+@pytest.mark.parametrize('scenarios', [1, lsm_engine.VECTORIZED_SCENARIOS + 4])
+def test_lsm_matches_brute_force_on_known_prices(scenarios):
+    # identical scenarios: the regression reproduces the next day's values exactly, the LSM is the exact DP.
+    S = np.tile(PRICES, (scenarios, 1))
+    params = dict(PARAMS, use_scenarios=scenarios)
+    result = lsm_engine.value_storage(params, S, volume_levels=5)
+
+    assert result['volume_levels'] == 5
+    assert result['value'] == pytest.approx(brute_force_value(params, PRICES, 5), rel=1e-9)
+    assert result['std_error'] == pytest.approx(0., abs=1e-6)
+
+
+def test_value_is_at_most_perfect_foresight():
+    rng = np.random.default_rng(1)
+    S = 40. * np.exp(rng.normal(0., 0.3, size=(200, len(PRICES))))
+    params = dict(PARAMS, use_scenarios=len(S))
+    result = lsm_engine.value_storage(params, S, volume_levels=5)
+    foresight = np.mean([brute_force_value(params, prices, 5) for prices in S])
+
+    assert result['value'] <= foresight
+
+
+def test_delta_run_values_the_shifted_prices():
+    params = dict(PARAMS, run_delta=True, variation=1., up=1, down=-1)
+    result = lsm_engine.value_storage(params, PRICES[None], volume_levels=5)
+
+    assert result['value'] == pytest.approx(brute_force_value(params, PRICES, 5), rel=1e-9)
+    assert result['value_up'] == pytest.approx(brute_force_value(params, PRICES + 1., 5), rel=1e-9)
+    assert result['value_down'] == pytest.approx(brute_force_value(params, PRICES - 1., 5), rel=1e-9)
+    assert result['delta'] == pytest.approx((result['value_up'] - result['value_down']) / 2, rel=1e-9)
+
+
+@pytest.mark.parametrize('scenarios', [1, lsm_engine.VECTORIZED_SCENARIOS + 4])
+def test_pruned_grid_keeps_the_value(scenarios):
+    S = np.tile(PRICES, (scenarios, 1))
+    params = dict(PARAMS, use_scenarios=scenarios, adaptive_grid=True, grid_tolerance=0.)
+    result = lsm_engine.value_storage(params, S, volume_levels=5)
+
+    # unreachable levels are skipped, without changing the value
+    assert result['computed_levels'] < 5
+    assert result['value'] == pytest.approx(brute_force_value(params, PRICES, 5), rel=1e-9)
+
+
+def test_grid_knots_drop_linear_stretches():
+    profile = np.concatenate([np.arange(10.), np.full(10, 9.)])
+
+    np.testing.assert_array_equal(lsm_engine.grid_knots(profile, 1e-6, max_gap=8), [0, 8, 9, 16, 19])
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.npy'])
+def test_mean_curve_is_read_in_chunks(tmp_path, monkeypatch, suffix):
+    rng = np.random.default_rng(4)
+    S = 40. * np.exp(rng.normal(0., 0.3, size=(11, len(PRICES) + 2)))
+    path = tmp_path.joinpath('scenarios' + suffix)
+    if suffix == '.csv':
+        np.savetxt(path, S, delimiter=';')
+        monkeypatch.setattr(lsm_engine, 'CSV_CHUNK_ROWS', 3)
+    else:
+        np.save(path, S)
+        monkeypatch.setattr(lsm_engine.scenario_io, 'MAX_CHUNK_BYTES', 3 * S.shape[1] * S.itemsize)
+    params = dict(PARAMS, scenario_file=str(path), chunk_offset=2, use_scenarios=7)
+
+    assert [len(chunk) for chunk in lsm_engine.scenario_chunks(path, 2, 7)] == [3, 3, 1]
+    np.testing.assert_allclose(lsm_engine.mean_curve(params), S[2:9, :len(PRICES)].mean(axis=0)[None])
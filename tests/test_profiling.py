@@ -0,0 +1,59 @@
+import threading
+
+import job_runner
+import profiling
+from test_job_runner import Window
+
+
+def test_records_go_to_the_collector_of_their_thread():
+    barrier = threading.Barrier(2)
+    collected = {}
+
+    def job(name: str):
+        with profiling.collector() as records:
+            barrier.wait()
+            with profiling.stage(name):
+                barrier.wait()
+        collected[name] = [entry['stage'] for entry in records]
+
+    threads = [threading.Thread(target=job, args=(name,)) for name in ('first', 'second')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert collected == {'first': ['first'], 'second': ['second']}
+
+
+def test_records_outside_of_a_collector_are_not_kept():
+    profiling.record('gui', 1.)
+    with profiling.collector() as outer:
+        with profiling.collector() as inner:
+            profiling.record('chunk', 1.)
+        profiling.record('combine', 1.)
+
+    assert [entry['stage'] for entry in inner] == ['chunk']
+    assert [entry['stage'] for entry in outer] == ['combine']
+
+
+@profiling.collect_timings
+def timed_chunk(chunk: dict) -> dict:
+    with profiling.stage('work'):
+        return {'n': chunk['n']}
+
+
+def combine_timings(results: list) -> dict:
+    return {'timings': [entry for result in results for entry in result['timings']]}
+
+
+def test_job_reports_its_preparation_and_chunk_timings():
+    window = Window()
+    with profiling.collector() as preparation:
+        profiling.record('calibration', 1.)
+    job_runner.start_job(window, timed_chunk, {'n': 4}, 'n', combine=combine_timings, max_workers=2,
+                         chunks_per_worker=1, in_process=True, timings=preparation)
+    assert window.finished.wait(30)
+
+    (event, result), = window.final_events()
+    assert event == job_runner.DONE_EVENT
+    assert [entry['stage'] for entry in result['timings']] == ['calibration', 'work', 'work']
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import result_cache
+import scenario_io
+
+
+def write_scenarios(path, scenarios: np.ndarray, run: str, shared: bool = False):
+    """Scenario file written like the spot simulation does, with the cache key of the run in the header."""
+    path = scenario_io.create_scenario_file(path, *scenarios.shape, metadata={'cache_key': run}, shared=shared)
+    scenario_io.write_chunks(path, 0, len(scenarios), lambda rows, out: out.__setitem__(slice(None), scenarios))
+
+    return path
+
+
+def storage_key(path) -> str:
+    return result_cache.make_key('lsm', {'scenario_file': str(path), 'use_scenarios': 4})
+
+
+def test_key_changes_with_the_scenario_contents(tmp_path):
+    rng = np.random.default_rng(0)
+    path = write_scenarios(tmp_path.joinpath('spot_price_simulation'), rng.random((4, 10)), 'run-a')
+    first = storage_key(path)
+
+    assert storage_key(path) == first
+    path = write_scenarios(path, rng.random((4, 10)), 'run-b')
+    assert storage_key(path) != first
+
+
+def test_key_ignores_output_only_parameters(tmp_path):
+    params = {'scenario_file': str(tmp_path.joinpath('missing.npy')), 'use_scenarios': 4}
+
+    assert result_cache.make_key('lsm', params) == result_cache.make_key('lsm', dict(params, export_path='out'))
+    assert result_cache.make_key('lsm', params) != result_cache.make_key('lsm', dict(params, use_scenarios=5))
+
+
+def test_put_and_get(tmp_path):
+    result_cache.put('key', {'value': 1.}, cache_dir=tmp_path)
+
+    assert result_cache.get('key', cache_dir=tmp_path) == {'value': 1.}
+    assert result_cache.get('other', cache_dir=tmp_path) is None
+
+
+@pytest.fixture
+def shared_blocks():
+    yield
+    scenario_io.release_shared()
+
+
+def test_key_changes_with_shared_scenario_contents(tmp_path, shared_blocks):
+    rng = np.random.default_rng(0)
+    path = write_scenarios(tmp_path.joinpath('spot_price_simulation'), rng.random((4, 10)), 'run-a', shared=True)
+    first = storage_key(path)
+
+    assert not scenario_io.scenario_path(path).exists()
+    assert storage_key(path) == first
+    path = write_scenarios(path, rng.random((4, 10)), 'run-b', shared=True)
+    assert storage_key(path) != first
+
+
+def test_key_changes_with_a_republished_shared_block(tmp_path, shared_blocks):
+    # scenarios parsed from a csv file carry no cache key, the creation time tells the publications apart.
+    path = scenario_io.share_array(tmp_path.joinpath('prices_portfolio'), np.ones((4, 10)))
+    first = storage_key(path)
+    path = scenario_io.share_array(path, np.zeros((4, 10)))
+
+    assert storage_key(path) != first
+    np.testing.assert_array_equal(scenario_io.open_scenarios(path), np.zeros((4, 10)))
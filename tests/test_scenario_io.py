@@ -0,0 +1,42 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import scenario_io
+
+
+@pytest.fixture
+def shared_blocks():
+    yield
+    scenario_io.release_shared()
+
+
+def test_memory_mapped_chunks(tmp_path):
+    path = scenario_io.create_scenario_file(tmp_path.joinpath('spot_price_simulation'), 5, 3, metadata={'seed': 1})
+    scenario_io.write_chunks(path, 1, 3, lambda rows, out: out.__setitem__(slice(None), np.arange(rows)[:, None]))
+
+    np.testing.assert_array_equal(scenario_io.open_scenarios(path, 1, 3)[:, 0], [0, 1, 2])
+    assert scenario_io.read_header(path)['seed'] == 1
+
+
+def read_shared(connection, path):
+    while connection.recv():
+        scenarios = scenario_io.open_scenarios(path)
+        connection.send((scenarios.shape, float(scenarios.sum())))
+
+
+def test_reader_follows_a_republished_block(tmp_path, shared_blocks):
+    path = tmp_path.joinpath('spot_price_simulation')
+    context = multiprocessing.get_context('spawn')
+    connection, reader_connection = context.Pipe()
+    reader = context.Process(target=read_shared, args=(reader_connection, path))
+    reader.start()
+    try:
+        for scenarios in (np.ones((3, 4)), np.full((5, 2), 2.), np.full((5, 2), 3.)):
+            scenario_io.share_array(path, scenarios)
+            connection.send(True)
+            assert connection.recv() == (scenarios.shape, scenarios.sum())
+    finally:
+        connection.send(False)
+        reader.join(10)
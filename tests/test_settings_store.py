@@ -0,0 +1,50 @@
+import json
+import time
+
+import settings_store
+
+
+def writes(monkeypatch) -> list:
+    """Values of every write of a settings file."""
+    written, flush = [], settings_store.SettingsStore.flush
+
+    def counting_flush(store):
+        saved = store._saved
+        flush(store)
+        if store._saved is not saved:
+            written.append(store._saved)
+
+    monkeypatch.setattr(settings_store.SettingsStore, 'flush', counting_flush)
+    return written
+
+
+def test_changes_within_the_debounce_time_are_written_once(tmp_path, monkeypatch):
+    written = writes(monkeypatch)
+    store = settings_store.SettingsStore(tmp_path.joinpath('settings.json'), debounce=0.2)
+
+    assert store.update({'a': 1})
+    assert store.update({'b': 2})
+    assert not store.update({'a': 1})
+    assert not tmp_path.joinpath('settings.json').exists()
+    deadline = time.monotonic() + 10
+    while not written and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)
+
+    assert written == [{'a': 1, 'b': 2}]
+    assert json.loads(tmp_path.joinpath('settings.json').read_text()) == {'a': 1, 'b': 2}
+
+
+def test_flush_writes_pending_changes_at_once(tmp_path, monkeypatch):
+    written = writes(monkeypatch)
+    path = tmp_path.joinpath('settings.json')
+    path.write_text(json.dumps({'a': 1}))
+    store = settings_store.SettingsStore(path, debounce=60.)
+
+    store.flush()
+    assert written == []
+    store.update({'a': 2})
+    store.flush()
+
+    assert written == [{'a': 2}]
+    assert settings_store.SettingsStore(path).get('a') == 2
@@ -0,0 +1,83 @@
+import math
+import statistics
+
+import numpy as np
+import pytest
+
+import spot_simulation
+
+NUM_SIM = 20000
+
+
+def make_model(variance_reduction: str, jumps: bool = True) -> dict:
+    """Daily model over 60 days around a flat level of 40, starting 15% above it.
+
+    The jumps are large enough that an expectation without their convexity is off by more than 6 standard errors.
+    """
+    return {'level': np.full(60, 40.), 'dt': 1 / 365, 'kappa': 30., 'sigma': 1.2, 'x0': 0.15,
+            'jump_intensity': 60. if jumps else 0., 'jump_mean': 0.1, 'jump_vola': 0.6,
+            'variance_reduction': variance_reduction}
+
+
+def analytic_strip(model: dict) -> float:
+    """Mean of the daily at-the-money calls of the lognormal model without jumps (Black's formula)."""
+    forward = spot_simulation.expected_prices(model)
+    _, variance = spot_simulation.moments(model, len(forward))
+    strike, sd = model['level'], np.sqrt(variance)
+    d1 = (np.log(forward / strike) + variance / 2) / sd
+    cdf = np.vectorize(statistics.NormalDist().cdf)
+
+    return float(np.mean(forward * cdf(d1) - strike * cdf(d1 - sd)))
+
+
+def run(model: dict, seed: int = 0) -> dict:
+    paths = spot_simulation.simulate(model, NUM_SIM, np.random.default_rng(seed))
+    return spot_simulation.path_statistics(model, paths)
+
+
+def test_antithetic_rows_are_mirrored():
+    out = np.empty((5, 8))
+    spot_simulation.diffusion_normals(make_model('antithetic'), np.random.default_rng(0), out)
+
+    np.testing.assert_array_equal(out[:2], -out[2:4])
+
+
+@pytest.mark.parametrize('mode', ['none', 'antithetic', 'control_variate'])
+def test_mean_price_matches_expected_prices(mode):
+    model = make_model(mode)
+    units = run(model)
+    # the mean price of the units, with its standard error
+    mean = spot_simulation.strip_estimate(dict(units, strip=units['price']), 0.)
+    expected = spot_simulation.expected_prices(model).mean()
+
+    assert abs(mean['strip_value'] - expected) < 4 * mean['std_error']
+
+
+@pytest.mark.parametrize('mode', ['antithetic', 'control_variate'])
+def test_strip_estimate_matches_analytic_value(mode):
+    model = make_model(mode, jumps=False)
+    expected_price = float(spot_simulation.expected_prices(model).mean())
+    estimate = spot_simulation.strip_estimate(run(model), expected_price, mode)
+
+    assert abs(estimate['strip_value'] - analytic_strip(model)) < 4 * estimate['std_error']
+
+
+def test_control_variate_reduces_the_standard_error():
+    errors = {}
+    for mode in ('none', 'control_variate'):
+        model = make_model(mode)
+        expected_price = float(spot_simulation.expected_prices(model).mean())
+        errors[mode] = spot_simulation.strip_estimate(run(model), expected_price, mode)['std_error']
+
+    assert errors['control_variate'] < errors['none'] / 2
+
+
+def test_control_variate_of_the_control_itself_is_exact():
+    model = make_model('control_variate')
+    units = run(model)
+    expected_price = float(spot_simulation.expected_prices(model).mean())
+    estimate = spot_simulation.strip_estimate(dict(units, strip=units['price']), expected_price, 'control_variate')
+
+    assert estimate['strip_value'] == pytest.approx(expected_price, rel=1e-12)
+    assert estimate['std_error'] == pytest.approx(0., abs=1e-9 * expected_price)
+    assert math.isfinite(estimate['std_error'])
@@ -0,0 +1,49 @@
+import math
+
+import numpy as np
+import pytest
+
+import volatility
+
+
+def write_prices(path, prices, encoding: str = 'utf-8', header: str = 'Datum;Preis €'):
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        f.write(header + '\n' + ''.join(f"2021-01-{index % 28 + 1:02d};{price:.6f}\n"
+                                        for index, price in enumerate(prices)))
+
+
+def test_without_inverts_welford():
+    summary = {'count': 0, 'mean': 0., 'm2': 0.}
+    for x in (1., 4., 2., 8.):
+        volatility.welford(summary, x)
+
+    assert volatility.without(summary, 8.) == pytest.approx({'count': 3, 'mean': 7. / 3, 'm2': 14. / 3})
+
+
+def test_jump_in_the_warm_up_is_classified_without_itself():
+    series = volatility.new_series('prices.csv', jump_distance=6.)
+    returns = [0.01, -0.01] * 14 + [0.5, 0.01]
+    for x in returns:
+        volatility.add_return(series, x)
+
+    # with the jump in its own standard deviation it would be within 6 standard deviations
+    assert abs(0.5 - np.mean(returns)) < 6. * np.std(returns, ddof=1)
+    assert series['jump_free']['count'] == len(returns) - 1
+    assert volatility.std(series['jump_free']) == pytest.approx(np.std(returns[:28] + [0.01], ddof=1))
+
+
+def test_appended_cp1252_file(tmp_path):
+    path = tmp_path.joinpath('actual_spot_prices.csv')
+    prices = 40. * np.exp(np.cumsum(np.random.default_rng(5).normal(0., 0.02, 50)))
+    write_prices(path, prices[:30], encoding='cp1252')
+    series = volatility.update_series(None, path, 3.)
+    with open(path, 'a', encoding='cp1252') as f:
+        f.write(''.join(f"2021-02-01;{price:.6f}\n" for price in prices[30:]))
+    series = volatility.update_series(series, path, 3.)
+
+    returns = np.diff(np.log(np.round(prices, 6)))
+    assert series['returns']['count'] == len(returns)
+    assert volatility.std(series['returns']) == pytest.approx(np.std(returns, ddof=1))
+    # the file was only appended to, nothing was read twice
+    assert series['offset'] == path.stat().st_size
+    assert series['last_log_price'] == pytest.approx(math.log(round(prices[-1], 6)))
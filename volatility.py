@@ -0,0 +1,183 @@
+"""Streaming volatility estimates of the simple GUI, stored in volas_for_gui.json.
+
+The log returns of actual_spot_prices.csv and TermPrices_YEAR.csv are read in a single pass and summarized with
+Welford's algorithm (count, mean, sum of squared deviations). A spot return is a jump if it is further than
+`jump_distance` standard deviations away from the running mean of all returns before it, jump free returns feed a
+second summary. The returns of the warm up are classified against the other warm up returns, a jump never widens the
+standard deviation it is measured with. The summaries and the read position of every csv file are kept in the json
+file, so prices appended to a csv file are added without reading the history again. A file that was changed in any
+other way is read again from the start.
+"""
+import csv
+import json
+import math
+import os
+import pathlib
+
+from loguru import logger
+
+VOLATILITY_FILE = 'volas_for_gui.json'
+# csv files exported by Excel are often cp1252, not utf-8
+ENCODINGS = ('utf-8', 'cp1252')
+# returns needed before the jump filter has a reliable standard deviation, earlier returns are classified later.
+WARMUP_RETURNS = 30
+
+
+def welford(summary: dict, x: float) -> None:
+    """Add x to the running summary {'count', 'mean', 'm2'} in place."""
+    summary['count'] += 1
+    delta = x - summary['mean']
+    summary['mean'] += delta / summary['count']
+    summary['m2'] += delta * (x - summary['mean'])
+
+
+def without(summary: dict, x: float) -> dict:
+    """Summary of the values of summary except x, the inverse of `welford`."""
+    count = summary['count'] - 1
+    mean = (summary['count'] * summary['mean'] - x) / count if count else 0.
+    return {'count': count, 'mean': mean, 'm2': max(0., summary['m2'] - (x - mean) * (x - summary['mean']))}
+
+
+def std(summary: dict) -> float:
+    """Sample standard deviation of a summary, nan below two values."""
+    return math.sqrt(summary['m2'] / (summary['count'] - 1)) if summary['count'] > 1 else float('nan')
+
+
+def new_series(path, jump_distance: float) -> dict:
+    """Empty state of one csv file."""
+    return {'path': str(pathlib.Path(path).resolve()), 'jump_distance': jump_distance, 'offset': 0, 'tail': '',
+            'delimiter': None, 'last_log_price': None, 'pending': [],
+            'returns': {'count': 0, 'mean': 0., 'm2': 0.}, 'jump_free': {'count': 0, 'mean': 0., 'm2': 0.}}
+
+
+def is_jump(series: dict, x: float, returns: dict = None) -> bool:
+    """True if x is more than jump_distance standard deviations away from the mean of returns.
+
+    :param returns: summary x is compared with, the returns of series by default. It must not contain x.
+    """
+    returns = series['returns'] if returns is None else returns
+    return abs(x - returns['mean']) > series['jump_distance'] * std(returns)
+
+
+def add_return(series: dict, x: float) -> None:
+    """Classify the log return x against the returns before it and add it to the summaries."""
+    if series['returns']['count'] < WARMUP_RETURNS:
+        series['pending'].append(x)
+        welford(series['returns'], x)
+        if series['returns']['count'] == WARMUP_RETURNS:
+            for pending in series['pending']:
+                if not is_jump(series, pending, without(series['returns'], pending)):
+                    welford(series['jump_free'], pending)
+            series['pending'] = []
+        return
+    if not is_jump(series, x):
+        welford(series['jump_free'], x)
+    welford(series['returns'], x)
+
+
+def unchanged_prefix(series: dict, path: pathlib.Path) -> bool:
+    """True if the part of the csv file read so far is still the same, i.e. the file was only appended to."""
+    if series['offset'] == 0:
+        return True
+    if path.stat().st_size < series['offset']:
+        return False
+    tail = series['tail'].encode('latin-1')
+    with open(path, 'rb') as f:
+        f.seek(series['offset'] - len(tail))
+        return f.read(len(tail)) == tail
+
+
+def decode(data: bytes) -> str:
+    """Text of the csv bytes in the first of ENCODINGS that fits. Undecodable bytes of the last one are replaced."""
+    for encoding in ENCODINGS[:-1]:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode(ENCODINGS[-1], errors='replace')
+
+
+def read_appended(series: dict, path, column: int = -1) -> int:
+    """Add the complete rows behind the read position of the csv file to series. Returns the number of new prices.
+
+    Rows that can not be converted (e.g. the header) are skipped, like in `data_loader.parse_csv_column`.
+    """
+    with open(path, 'rb') as f:
+        f.seek(series['offset'])
+        data = f.read()
+    # an incomplete last row is read with the next update
+    end = data.rfind(b'\n') + 1
+    if end == 0:
+        return 0
+    text = decode(data[:end])
+    if series['delimiter'] is None:
+        # imported here, data_loader loads numpy and this module is imported when the GUI starts
+        import data_loader
+        series['delimiter'] = data_loader.sniff_delimiter(text[:4096])
+    prices = 0
+    for row in csv.reader(text.splitlines(), delimiter=series['delimiter']):
+        try:
+            log_price = math.log(float(row[column].replace(",", ".")))
+        except (IndexError, ValueError):
+            continue
+        if series['last_log_price'] is not None:
+            add_return(series, log_price - series['last_log_price'])
+        series['last_log_price'] = log_price
+        prices += 1
+    series['offset'] += end
+    # the raw bytes of the last row, latin-1 maps every byte to one character
+    series['tail'] = data[data.rfind(b'\n', 0, end - 1) + 1:end].decode('latin-1')
+
+    return prices
+
+
+def update_series(series: dict, path, jump_distance: float) -> dict:
+    """Bring the state of one csv file up to date, reading only appended rows where possible."""
+    path = pathlib.Path(path)
+    if (series is None or series['path'] != str(path.resolve()) or series['jump_distance'] != jump_distance
+            or not unchanged_prefix(series, path)):
+        series = new_series(path, jump_distance)
+    new_prices = read_appended(series, path)
+    if new_prices:
+        logger.info(f"{new_prices} new prices of {path.name} added to the volatility estimate.")
+
+    return series
+
+
+def jump_free_summary(series: dict) -> dict:
+    """Summary of the jump free returns, including returns still waiting for the end of the warm up."""
+    summary = dict(series['jump_free'])
+    for pending in series['pending']:
+        if not is_jump(series, pending, without(series['returns'], pending)):
+            welford(summary, pending)
+
+    return summary
+
+
+def update(params: dict) -> dict:
+    """Update volas_for_gui.json in params['export_path'] and return the volatilities.
+
+    :param params: simple GUI parameters, uses 'actual_spot_prices', 'term_prices', 'jump_distance', 't', 'm' and
+        'export_path'
+    """
+    json_path = pathlib.Path(params['export_path']).joinpath(VOLATILITY_FILE)
+    try:
+        with open(json_path, 'r') as f:
+            state = json.load(f).get('state', {})
+    except (OSError, ValueError):
+        state = {}
+    spot = update_series(state.get('spot'), params['actual_spot_prices'], params['jump_distance'])
+    # the jump filter of the term prices is not used, only the volatility of all returns
+    term = update_series(state.get('term'), params['term_prices'], params['jump_distance'])
+    annualization = math.sqrt(params['m'] / params['t'])
+    volatilities = {'vola': std(term['returns']) * annualization,
+                    'jump_vola': std(spot['returns']) * annualization,
+                    'no_jumps_vola': std(jump_free_summary(spot)) * annualization,
+                    }
+    # write to a temporary file first, the GUI may read the file at any time.
+    temporary = json_path.with_name(json_path.name + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(dict(volatilities, state={'spot': spot, 'term': term}), f)
+    os.replace(temporary, json_path)
+
+    return volatilities